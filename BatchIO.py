@@ -0,0 +1,118 @@
+import os
+from BlockDevice import BlockDevice
+from VolumeFile import VolumeFile
+
+class BatchRead:
+  '''
+  Read many (file, range) requests in one pass over the device: physical extents
+  are sorted by offset, merged across small gaps and fetched with vectored
+  positional reads, each request is handed back as soon as all its pieces arrived
+  '''
+  try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+  except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+  def __init__(self, dev: BlockDevice, max_gap: int = 64 << 10, max_read: int = 16 << 20) -> None:
+    self.dev = dev
+    self.max_gap = max_gap
+    self.max_read = max_read
+    self.keys = []
+    self.buffers: list[bytearray] = []
+    self.left: list[int] = []
+    # (device offset, length, request number, offset in the request buffer)
+    self.pieces: list[tuple[int, int, int, int]] = []
+    self.scratch = bytearray(max_gap)
+    self.last_end = None
+    self.naive_seeks = 0
+    self.seeks = 0
+    self.reads = 0
+    self.bytes_read = 0
+
+  def __len__(self) -> int:
+    return len(self.keys)
+
+  def add(self, key, file: VolumeFile, offset: int = 0, size: int = None):
+    end = file.size if size is None else min(file.size, offset + size)
+    request = len(self.keys)
+    buffer = bytearray(max(0, end - offset))
+    self.keys.append(key)
+    self.buffers.append(buffer)
+    self.left.append(0)
+    if file.dev is None:
+      # Resident data has no extents, it is already in memory
+      file.seek(offset)
+      file.readinto(buffer)
+      return
+    pos = offset
+    while pos < end:
+      vcn, within = divmod(pos, file.cluster_size)
+      dev_offset, clusters = file.locate(vcn)
+      if clusters <= 0:
+        break
+      n = min(end - pos, clusters * file.cluster_size - within)
+      if dev_offset is not None:
+        # Sparse pieces stay zero
+        self.pieces.append((dev_offset + within, n, request, pos - offset))
+        self.left[request] += 1
+        if dev_offset + within != self.last_end:
+          self.naive_seeks += 1
+        self.last_end = dev_offset + within + n
+      pos += n
+
+  def run(self):
+    '''
+    Yield (key, data) for every request, in completion order
+    '''
+    for request in range(len(self.keys)):
+      if self.left[request] == 0:
+        yield self.__finish(request)
+    self.pieces.sort()
+    last_end = None
+    i = 0
+    while i < len(self.pieces):
+      start = self.pieces[i][0]
+      end = start + self.pieces[i][1]
+      j = i + 1
+      while j < len(self.pieces) and j - i < self.IOV_MAX // 2:
+        next_start, length = self.pieces[j][:2]
+        if next_start < end or next_start - end > self.max_gap or next_start + length - start > self.max_read:
+          break
+        end = next_start + length
+        j += 1
+      if start != last_end:
+        self.seeks += 1
+      last_end = end
+      yield from self.__read_group(i, j, start)
+      i = j
+    self.pieces = []
+
+  def stats(self) -> dict:
+    return {
+      "Requests": len(self.keys),
+      "Reads": self.reads,
+      "Bytes": self.bytes_read,
+      "Seeks": self.seeks,
+      "Seeks Saved": self.naive_seeks - self.seeks,
+    }
+
+  def __read_group(self, i: int, j: int, start: int):
+    iov = []
+    pos = start
+    for dev_offset, length, request, buf_offset in self.pieces[i:j]:
+      if dev_offset > pos:
+        iov.append(memoryview(self.scratch)[:dev_offset - pos])
+      iov.append(memoryview(self.buffers[request])[buf_offset:buf_offset + length])
+      pos = dev_offset + length
+    self.bytes_read += self.dev.preadv(iov, start)
+    self.reads += 1
+    del iov
+    for _, _, request, _ in self.pieces[i:j]:
+      self.left[request] -= 1
+      if self.left[request] == 0:
+        yield self.__finish(request)
+
+  def __finish(self, request: int):
+    buffer = self.buffers[request]
+    self.buffers[request] = None
+    return self.keys[request], buffer
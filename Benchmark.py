@@ -0,0 +1,182 @@
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Union
+from DirEntry import join_path
+from FAT32 import FAT32
+from NTFS import NTFS
+from Shell import Shell
+import ImageGen
+
+try:
+  import resource
+except ImportError:
+  # Unix only, peak memory is left out on Windows
+  resource = None
+
+# Times the explorer on synthetic images: every (file system, file count) pair is measured in a
+# fresh interpreter so that mount times are cold and peak memory belongs to that run only.
+# Results are written as JSON, runs with the same parameters can be compared key by key.
+
+SCALES = (1000, 10000, 100000)
+# Files per directory the tree shape aims for, depth grows with the file count
+FILES_PER_DIR = 1000
+
+def tree_shape(files: int, fanout: int) -> 'tuple[int, int]':
+  # At least one level so that there is something to cd into
+  depth = 1
+  dirs = 1 + fanout
+  while files / dirs > FILES_PER_DIR:
+    depth += 1
+    dirs += fanout ** depth
+  return depth, fanout
+
+def peak_memory() -> int:
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Bytes on macOS, KiB elsewhere
+  return peak if sys.platform == "darwin" else peak * 1024
+
+class Timer:
+  def __init__(self) -> None:
+    self.results = {}
+
+  @contextlib.contextmanager
+  def measure(self, name: str):
+    start = time.perf_counter()
+    yield
+    self.results[name] = round(time.perf_counter() - start, 6)
+
+def measure(fs: str, image: str, lazy: bool = False) -> dict:
+  '''
+  Mount image and time the shell commands on it, command output goes to the null device
+  '''
+  timer = Timer()
+  result = {}
+  with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+    with timer.measure("mount"):
+      vol: Union[FAT32, NTFS] = FAT32(image, use_cache=False) if fs == "fat32" else NTFS(image, use_cache=False, lazy=lazy)
+    shell = Shell(vol)
+    with timer.measure("ls"):
+      shell.onecmd("ls")
+
+    # List and cd down the first sub-directory of every level, then back up
+    chain = []
+    with timer.measure("cd"):
+      while True:
+        names = [f["Name"] for f in vol.get_dir() if f["Flags"] & 0x10 and f["Name"] not in (".", "..")]
+        cwd = vol.get_cwd()
+        if names:
+          shell.onecmd("cd " + names[0])
+        if not names or vol.get_cwd() == cwd:
+          break
+        chain.append(names[0])
+      for _ in chain:
+        shell.onecmd("cd ..")
+    result["cd_depth"] = len(chain)
+
+    with timer.measure("tree"):
+      shell.onecmd("tree")
+
+    files = 0
+    size = 0
+    with timer.measure("cat"):
+      for dirpath, entries in vol.walk(""):
+        for entry in entries:
+          if entry.is_dir:
+            continue
+          with vol.open(join_path(dirpath, entry.name)) as f:
+            while True:
+              chunk = f.read(Shell.chunk_size)
+              if not chunk:
+                break
+              size += len(chunk)
+          files += 1
+    result["cat_files"] = files
+    result["cat_bytes"] = size
+    result["cat_MB/s"] = round(size / max(timer.results["cat"], 1e-9) / (1 << 20), 2)
+
+    shell.close()
+    del vol
+    gc.collect()
+  result["seconds"] = timer.results
+  result["peak_memory"] = peak_memory()
+  return result
+
+def generate(fs: str, image: str, files: int, args) -> float:
+  depth, fanout = tree_shape(files, args.fanout)
+  start = time.perf_counter()
+  root = ImageGen.build_tree(files, depth, fanout, args.min_size, args.max_size, args.long_names, seed=args.seed)
+  if fs == "fat32":
+    ImageGen.make_fat32(image, root, frag=args.frag, seed=args.seed)
+  else:
+    ImageGen.make_ntfs(image, root, frag=args.frag, seed=args.seed)
+  return round(time.perf_counter() - start, 3)
+
+def run(args) -> dict:
+  os.makedirs(args.workdir, exist_ok=True)
+  runs = []
+  for files in args.scales:
+    for fs in args.fs:
+      image = os.path.join(args.workdir, f"{fs}-{files}-{args.max_size}-{args.frag}-{args.long_names}-{args.seed}.img")
+      generated = None
+      if not os.path.exists(image):
+        print(f"Generating {image}...", file=sys.stderr)
+        generated = generate(fs, image, files, args)
+      print(f"Measuring {fs} with {files} files...", file=sys.stderr)
+      command = [sys.executable, os.path.abspath(__file__), "--measure", fs, image] + (["--lazy"] if args.lazy else [])
+      child = subprocess.run(command, capture_output=True, text=True)
+      if child.returncode != 0:
+        raise Exception(f"Measuring {image} failed:\n{child.stderr}")
+      result = json.loads(child.stdout)
+      depth, fanout = tree_shape(files, args.fanout)
+      runs.append({"fs": fs, "files": files, "depth": depth, "fanout": fanout, "image_bytes": os.path.getsize(image),
+                   "generate_seconds": generated, **result})
+      if not args.keep:
+        os.remove(image)
+  return {
+    "date": datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "cpus": os.cpu_count(),
+    "parameters": {"min_size": args.min_size, "max_size": args.max_size, "frag": args.frag,
+                   "long_names": args.long_names, "seed": args.seed, "lazy": args.lazy},
+    "runs": runs,
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the explorer on synthetic FAT32/NTFS images")
+  parser.add_argument("--fs", nargs="+", choices=["fat32", "ntfs"], default=["fat32", "ntfs"])
+  parser.add_argument("--scales", nargs="+", type=int, default=list(SCALES), help="file counts, e.g. 1000 100000 5000000")
+  parser.add_argument("--fanout", type=int, default=8)
+  parser.add_argument("--min-size", type=int, default=0)
+  parser.add_argument("--max-size", type=int, default=8192)
+  parser.add_argument("--long-names", type=float, default=0.5)
+  parser.add_argument("--frag", type=float, default=0.1)
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--lazy", action="store_true", help="mount NTFS with on-demand directory reads")
+  parser.add_argument("--workdir", default="bench", help="where the images are generated")
+  parser.add_argument("--keep", action="store_true", help="keep the images for later runs")
+  parser.add_argument("-o", "--output", help="JSON file to write, stdout if not given")
+  parser.add_argument("--measure", nargs=2, metavar=("FS", "IMAGE"), help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.measure:
+    print(json.dumps(measure(*args.measure, lazy=args.lazy)))
+    return
+  results = run(args)
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+  else:
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,107 @@
+import mmap
+import os
+import re
+import threading
+from typing import Union
+
+class BlockDevice:
+  # Raw Windows volumes only take reads that start and end on a sector boundary, unmapped
+  # reads are widened to this (a multiple of any sector size in use) and sliced
+  ALIGNMENT = 0x1000
+
+  def __init__(self, name: str) -> None:
+    self.path = BlockDevice.resolve(name)
+    self.name = name if BlockDevice.is_drive_letter(name) else os.path.basename(os.path.normpath(name))
+    self.fd = open(self.path, 'rb')
+    self.fd.seek(0, os.SEEK_END)
+    self.size = self.fd.tell()
+    self.fd.seek(0)
+    self.lock = threading.Lock()
+    self.map = None
+    self.view = None
+    try:
+      # Raw Windows volumes cannot be mapped, those fall back to seek + read
+      if self.size:
+        self.map = mmap.mmap(self.fd.fileno(), self.size, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+    except (OSError, ValueError):
+      self.map = None
+
+  @staticmethod
+  def is_drive_letter(name: str) -> bool:
+    return re.fullmatch(r"[A-Za-z]:", name) is not None
+
+  @staticmethod
+  def resolve(name: str) -> str:
+    if BlockDevice.is_drive_letter(name):
+      return r'\\.\%s' % name
+    return name
+
+  def is_mapped(self) -> bool:
+    return self.view is not None
+
+  def read(self, offset: int, size: int) -> Union[memoryview, bytes]:
+    if self.view is not None:
+      return self.view[offset:offset + size]
+    return self.__read_aligned(offset, size)
+
+  def readinto(self, offset: int, buf) -> int:
+    if self.view is not None:
+      n = min(len(buf), max(0, self.size - offset))
+      buf[:n] = self.view[offset:offset + n]
+      return n
+    data = self.__read_aligned(offset, len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+  def pread(self, offset: int, size: int) -> bytes:
+    # Positional read straight from the file, safe to run from several threads at once
+    return self.__read_aligned(offset, size)
+
+  def preadv(self, buffers: list, offset: int) -> int:
+    # Scatter one contiguous positional read over several buffers
+    size = sum(len(buf) for buf in buffers)
+    if hasattr(os, 'preadv') and offset % BlockDevice.ALIGNMENT == 0 and size % BlockDevice.ALIGNMENT == 0:
+      return os.preadv(self.fd.fileno(), buffers, offset)
+    data = memoryview(self.pread(offset, size))
+    pos = 0
+    for buf in buffers:
+      n = min(len(buf), len(data) - pos)
+      buf[:n] = data[pos:pos + n]
+      pos += n
+    return pos
+
+  def __read_aligned(self, offset: int, size: int) -> bytes:
+    start = offset - offset % BlockDevice.ALIGNMENT
+    end = -(-(offset + size) // BlockDevice.ALIGNMENT) * BlockDevice.ALIGNMENT
+    if hasattr(os, 'pread'):
+      chunks = []
+      pos = start
+      while pos < end:
+        chunk = os.pread(self.fd.fileno(), end - pos, pos)
+        if not chunk:
+          break
+        chunks.append(chunk)
+        pos += len(chunk)
+      data = b"".join(chunks)
+    else:
+      with self.lock:
+        self.fd.seek(start)
+        data = self.fd.read(end - start)
+    if start == offset and len(data) <= size:
+      return data
+    return data[offset - start:offset - start + size]
+
+  def close(self):
+    if self.map is not None:
+      try:
+        self.view.release()
+        self.map.close()
+      except BufferError:
+        # Slices handed out by read() are still alive, the map goes with them
+        pass
+      self.view = None
+      self.map = None
+    if self.fd:
+      self.fd.close()
+      self.fd = None
@@ -0,0 +1,12 @@
+from collections import namedtuple
+
+# One row of a directory listing as yielded by FAT32.walk / NTFS.walk,
+# ref is the first cluster (FAT32) or MFT record number (NTFS) of the entry
+DirEntry = namedtuple("DirEntry", ["name", "is_dir", "size", "flags", "ref", "modified"])
+
+def join_path(dirpath: str, name: str) -> str:
+  return dirpath.rstrip("\\") + "\\" + name
+
+# A deleted entry found by FAT32.deleted / NTFS.deleted, extents are the (first cluster, count)
+# runs of its data that are still unallocated out of the clusters it needs
+DeletedEntry = namedtuple("DeletedEntry", ["path", "is_dir", "size", "created", "modified", "ref", "clusters", "extents"])
@@ -0,0 +1,221 @@
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from typing import Union
+from BatchIO import BatchRead
+from DirEntry import DirEntry
+from FAT32 import FAT32
+from NTFS import NTFS
+
+# Files up to this size are gathered and read offset-sorted with BatchRead,
+# bigger ones are streamed chunk by chunk
+SMALL_FILE = 1 << 20
+BATCH_BYTES = 32 << 20
+CHUNK_SIZE = 4 << 20
+
+class Extractor:
+  '''
+  Copy a file or directory tree off a volume: a reader thread pulls data from
+  the volume, a writer thread puts it on the host, a bounded queue sits in between
+  '''
+  def __init__(self, vol: Union[FAT32, NTFS], queue_size: int = 16) -> None:
+    self.vol = vol
+    self.queue: queue.Queue = queue.Queue(queue_size)
+    self.files = 0
+    self.dirs = 0
+    self.bytes = 0
+    self.error = None
+    self.dest = None
+    self.stop = threading.Event()
+
+  def extract(self, src: str, dest: str, progress: bool = True) -> dict:
+    top = self.vol.stat(src)
+    if top.name in (".", ".."):
+      # The entry a directory has for itself or its parent, not its real name
+      src = self.vol.abspath(src)
+      top = self.vol.stat(src)
+    self.dest = os.path.realpath(dest)
+    start = time.time()
+    reader = threading.Thread(target=self.__run_reader, args=(top, src, dest), daemon=True)
+    writer = threading.Thread(target=self.__run_writer, daemon=True)
+    reader.start()
+    writer.start()
+    while writer.is_alive():
+      writer.join(0.5)
+      if progress:
+        self.__print_progress(start)
+    if progress:
+      print()
+    self.stop.set()
+    reader.join()
+    if self.error is not None:
+      raise self.error
+    return self.stats(start)
+
+  def stats(self, start: float) -> dict:
+    elapsed = max(time.time() - start, 1e-9)
+    return {
+      "Files": self.files,
+      "Directories": self.dirs,
+      "Bytes": self.bytes,
+      "Seconds": round(elapsed, 3),
+      "MB/s": round(self.bytes / elapsed / (1 << 20), 2),
+      "Files/s": round(self.files / elapsed, 2),
+    }
+
+  def __print_progress(self, start: float):
+    stats = self.stats(start)
+    sys.stdout.write(f"\r{stats['Files']} files, {stats['Bytes'] / (1 << 20):.1f} MB, "
+                     f"{stats['MB/s']:.1f} MB/s, {stats['Files/s']:.0f} files/s   ")
+    sys.stdout.flush()
+
+  def __run_reader(self, top: DirEntry, src: str, dest: str):
+    try:
+      self.__read(top, src, dest)
+    except Exception as e:
+      # Let the writer finish what it got, then stop
+      self.error = self.error or e
+      self.__put(None)
+
+  def __run_writer(self):
+    try:
+      self.__write()
+    except Exception as e:
+      self.error = self.error or e
+      self.stop.set()
+
+  def __put(self, item):
+    # Blocks while the writer is behind, gives up once the pipeline is stopping
+    while True:
+      try:
+        self.queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        if self.stop.is_set():
+          return False
+
+  @staticmethod
+  def host_name(name: str) -> str:
+    # "." and ".." would leave the directory, Windows drops trailing dots and spaces
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name)
+    return re.sub(r"[. ]+$", lambda m: "_" * len(m.group()), name) or "_"
+
+  def __inside_dest(self, path: str) -> str:
+    if os.path.commonpath([self.dest, os.path.realpath(path)]) != self.dest:
+      raise Exception(f"{path} is outside of {self.dest}")
+    return path
+
+  # Queue items: ("dir", host path, entry), ("data", host path, entry, chunk, first, last), None at the end
+
+  def __read(self, top: DirEntry, src: str, dest: str):
+    if not top.is_dir:
+      self.__put(("dir", dest, top._replace(modified=None)))
+      self.__read_files([(os.path.join(dest, Extractor.host_name(top.name)), top)])
+      self.__put(None)
+      return
+    # Like cp -r, a directory lands in dest under its own name, the volume root straight in dest
+    if top.name in (self.vol.name, "."):
+      root = dest
+      top = top._replace(modified=None)
+    else:
+      root = os.path.join(dest, Extractor.host_name(top.name))
+    top_path = None
+    for dirpath, entries in self.vol.walk(src):
+      if top_path is None:
+        top_path = dirpath.rstrip("\\")
+        if not self.__put(("dir", root, top)):
+          return
+      rel = dirpath.rstrip("\\")[len(top_path):].strip("\\")
+      host_dir = os.path.join(root, *[Extractor.host_name(part) for part in rel.split("\\") if part])
+      files = []
+      for entry in entries:
+        path = os.path.join(host_dir, Extractor.host_name(entry.name))
+        if entry.is_dir:
+          if not self.__put(("dir", path, entry)):
+            return
+        else:
+          files.append((path, entry))
+      if not self.__read_files(files):
+        return
+    self.__put(None)
+
+  def __read_files(self, files: 'list[tuple[str, DirEntry]]') -> bool:
+    batch = BatchRead(self.vol.dev)
+    batch_bytes = 0
+    for path, entry in files:
+      if entry.size > SMALL_FILE:
+        if not self.__stream_file(path, entry):
+          return False
+        continue
+      batch.add((path, entry), self.vol.open_entry(entry))
+      batch_bytes += entry.size
+      if batch_bytes >= BATCH_BYTES:
+        if not self.__flush(batch):
+          return False
+        batch = BatchRead(self.vol.dev)
+        batch_bytes = 0
+    return self.__flush(batch)
+
+  def __flush(self, batch: BatchRead) -> bool:
+    for (path, entry), data in batch.run():
+      if not self.__put(("data", path, entry, data, True, True)):
+        return False
+    return True
+
+  def __stream_file(self, path: str, entry: DirEntry) -> bool:
+    file = self.vol.open_entry(entry)
+    first = True
+    while True:
+      chunk = bytearray(max(1, min(CHUNK_SIZE, entry.size - file.tell())))
+      n = file.readinto(chunk)
+      del chunk[n:]
+      last = file.tell() >= entry.size or n == 0
+      if not self.__put(("data", path, entry, chunk, first, last)):
+        return False
+      first = False
+      if last:
+        return True
+
+  def __write(self):
+    dir_times: list[tuple[str, DirEntry]] = []
+    out = None
+    try:
+      while True:
+        item = self.queue.get()
+        if item is None:
+          break
+        if item[0] == "dir":
+          _, path, entry = item
+          os.makedirs(self.__inside_dest(path), exist_ok=True)
+          dir_times.append((path, entry))
+          self.dirs += 1
+          continue
+        _, path, entry, data, first, last = item
+        if first:
+          out = open(self.__inside_dest(path), 'wb')
+        out.write(data)
+        self.bytes += len(data)
+        if last:
+          out.close()
+          out = None
+          Extractor.set_times(path, entry)
+          self.files += 1
+    finally:
+      if out is not None:
+        out.close()
+    # Directories last, writing their children bumped their mtime
+    for path, entry in reversed(dir_times):
+      Extractor.set_times(path, entry)
+
+  @staticmethod
+  def set_times(path: str, entry: DirEntry):
+    if entry.modified is None:
+      return
+    try:
+      ts = entry.modified.timestamp()
+      os.utime(path, (ts, ts))
+    except (OSError, ValueError, OverflowError):
+      pass
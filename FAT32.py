@@ -1,7 +1,19 @@
 from enum import Flag, auto
 from datetime import datetime
-from itertools import chain
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import re
+import struct
+import sys
+import hashlib
+from typing import Union
+from BlockDevice import BlockDevice
+from DirEntry import DeletedEntry, DirEntry, join_path
+from Find import FindFilter, TrigramIndex
+import IndexCache
+from VolumeFile import VolumeFile
 class Attribute(Flag):
     READ_ONLY = auto()
     HIDDEN = auto()
@@ -11,146 +23,524 @@ class Attribute(Flag):
     ARCHIVE = auto()
 
 class FAT:
+  ENTRY_MASK = 0x0FFFFFFF
+  BAD_CLUSTER = 0x0FFFFFF7
+  # Clears the reserved top nibble of the last byte of each little-endian entry
+  HIGH_MASK = bytes(b & 0x0F for b in range(256))
+  # End of chain values xor 0x0FFFFFF8 to 0-7 in their low byte
+  EOC_LOW = bytes(0 if b < 8 else 1 for b in range(256))
+  # Entries per pass of scan(), 16 MiB of table
+  SCAN_CHUNK = 1 << 22
+
   def __init__(self, data) -> None:
     self.raw_data = data
-    self.elements = []
-    for i in range(0, len(self.raw_data), 4):
-      self.elements.append(int.from_bytes(self.raw_data[i:i + 4], byteorder='little'))
-  
+    # Power of two run length -> (words 1, 1, ..., words 1, 2, ...) for the run skipping in
+    # get_extents, at most 17 lengths up to 1 << 16
+    self.runs: 'dict[int, tuple[int, int]]' = {}
+    # View the table as 32-bit little-endian words, no per-entry objects
+    if sys.byteorder == 'little':
+      self.elements = memoryview(self.raw_data).cast('I')
+    else:
+      self.elements = array('I')
+      self.elements.frombytes(self.raw_data)
+      self.elements.byteswap()
+
+  def __len__(self) -> int:
+    return len(self.elements)
+
+  def __getitem__(self, index: int) -> int:
+    return self.elements[index] & FAT.ENTRY_MASK
+
   def get_cluster_chain(self, index: int) -> 'list[int]':
     index_list = []
+    elements = self.elements
     while True:
       index_list.append(index)
-      index = self.elements[index]
-      if index == 0x0FFFFFFF or index == 0x0FFFFFF7:
+      index = elements[index] & FAT.ENTRY_MASK
+      # end of chain (0x0FFFFFF8-0x0FFFFFFF), bad cluster, or a broken link
+      if index >= FAT.BAD_CLUSTER or index < 2 or index >= len(elements):
         break
+      if len(index_list) > len(elements):
+        raise Exception("Cluster chain loop detected")
     return index_list 
 
+  def scan(self, start: int, stop: int) -> 'tuple[int, int, int, int]':
+    '''
+    (free, bad, end of chain, linked to the next cluster) counts of entries start..stop-1.
+    Whole slices are compared at once as big integers: split the entries into their four
+    byte planes, xor each against the wanted byte, or them together and count the zero bytes.
+    '''
+    free = bad = ends = contiguous = 0
+    patterns = None
+    for lo in range(start, stop, FAT.SCAN_CHUNK):
+      hi = min(stop, lo + FAT.SCAN_CHUNK)
+      n = hi - lo
+      chunk = bytearray(self.raw_data[lo * 4:hi * 4])
+      chunk[3::4] = chunk[3::4].translate(FAT.HIGH_MASK)
+      planes = [int.from_bytes(chunk[i::4], 'little') for i in range(4)]
+      # Full chunks share the patterns, they are dropped with the call instead of pinning tens of MiB
+      if patterns is None or patterns[0] != n:
+        patterns = FAT.__patterns(n)
+      _, ones, words_ones, sequence = patterns
+      free += FAT.__count_zero(planes[0] | planes[1] | planes[2] | planes[3], n)
+      # Bad is 0x0FFFFFF7, end of chain 0x0FFFFFF8-0x0FFFFFFF, both share the upper three bytes
+      upper = (planes[1] ^ ones * 0xFF) | (planes[2] ^ ones * 0xFF) | (planes[3] ^ ones * 0x0F)
+      bad += FAT.__count_zero(upper | (planes[0] ^ ones * 0xF7), n)
+      low = (planes[0] ^ ones * 0xF8).to_bytes(n, 'little').translate(FAT.EOC_LOW)
+      ends += FAT.__count_zero(upper | int.from_bytes(low, 'little'), n)
+      # Entry i holding i + 1, against the successor sequence lo + 1, lo + 2, ...
+      diff = (int.from_bytes(chunk, 'little') ^ (sequence + words_ones * lo)).to_bytes(n * 4, 'little')
+      contiguous += FAT.__count_zero(int.from_bytes(diff[0::4], 'little') | int.from_bytes(diff[1::4], 'little')
+                                     | int.from_bytes(diff[2::4], 'little') | int.from_bytes(diff[3::4], 'little'), n)
+    return free, bad, ends, contiguous
+
+  @staticmethod
+  def __patterns(n: int) -> 'tuple[int, int, int, int]':
+    # n, bytes 1, 1, 1, ..., words 1, 1, 1, ... and words 1, 2, 3, ... as integers
+    ones = int.from_bytes(b"\x01" * n, 'little')
+    words_ones = int.from_bytes(b"\x01\x00\x00\x00" * n, 'little')
+    sequence = int.from_bytes(array('I', range(1, n + 1)).tobytes(), sys.byteorder)
+    return n, ones, words_ones, sequence
+
+  @staticmethod
+  def __count_zero(merged: int, n: int) -> int:
+    return merged.to_bytes(n, 'little').count(0)
+
+  def get_extents(self, index: int) -> 'list[tuple[int, int]]':
+    # Coalesce the chain into (first cluster, cluster count) runs, long runs are
+    # skipped by comparing whole slices of the table with the successor sequence
+    extents = []
+    elements = self.elements
+    size = len(elements)
+    total = 0
+    while True:
+      start = index
+      step = 8
+      while index + 1 < size and elements[index] & FAT.ENTRY_MASK == index + 1:
+        if step > 1 and self.__linked(index, min(index + step, size - 1)):
+          index = min(index + step, size - 1)
+          step = min(step * 2, 1 << 16)
+        elif step > 1:
+          step //= 2
+        else:
+          index += 1
+      extents.append((start, index - start + 1))
+      total += index - start + 1
+      index = elements[index] & FAT.ENTRY_MASK
+      # end of chain (0x0FFFFFF8-0x0FFFFFFF), bad cluster, or a broken link
+      if index >= FAT.BAD_CLUSTER or index < 2 or index >= size:
+        break
+      if total > size:
+        raise Exception("Cluster chain loop detected")
+    return extents
+
+  def __linked(self, start: int, stop: int) -> bool:
+    # Whether entries start..stop-1 each point at the next cluster
+    n = stop - start
+    if n <= 0:
+      return False
+    sequence = self.runs.get(n)
+    if sequence is None:
+      sequence = (int.from_bytes(b"\x01\x00\x00\x00" * n, 'little'),
+                  int.from_bytes(array('I', range(1, n + 1)).tobytes(), sys.byteorder))
+      # Lengths clipped at the end of the table are one-offs, keep the doubling steps only
+      if n & (n - 1) == 0:
+        self.runs[n] = sequence
+    words_ones, successors = sequence
+    return int.from_bytes(self.raw_data[start * 4:stop * 4], 'little') == successors + words_ones * start
+
 class RDETentry:
+  # name, ext, attr, reserved, creation tenths, creation time/date, access date,
+  # cluster high word, update time/date, cluster low word, size
+  LAYOUT = struct.Struct("<8s3sBBBHHHHHHHI")
+  __slots__ = ("raw_data", "long_name", "fields")
+
   def __init__(self, data) -> None:
-    self.raw_data = data
-    self.flag = data[0xB:0xC]
-    self.is_subentry: bool = False
-    self.is_deleted: bool = False
-    self.is_empty: bool = False
-    self.is_label: bool = False
-    self.attr = Attribute(0)
-    self.size = 0
-    self.date_created = 0
-    self.last_accessed = 0
-    self.date_updated = 0
-    self.ext = b""
+    self.raw_data = bytes(data)
     self.long_name = ""
-    if self.flag == b'\x0f':
-      self.is_subentry = True
-
-    if not self.is_subentry:
-      self.name = self.raw_data[:0x8]
-      self.ext = self.raw_data[0x8:0xB]
-      if self.name[:1] == b'\xe5':
-        self.is_deleted = True
-      if self.name[:1] == b'\x00':
-        self.is_empty = True
-        self.name = ""
-        return
-      
-      self.attr = Attribute(int.from_bytes(self.flag, byteorder='little'))
-      if Attribute.VOLLABLE in self.attr:
-        self.is_label = True
-        return
+    # Decoded on first use, most slots are never looked at
+    self.fields = None
 
-      self.time_created_raw = int.from_bytes(self.raw_data[0xD:0x10], byteorder='little')
-      self.date_created_raw = int.from_bytes(self.raw_data[0x10:0x12], byteorder='little')
-      self.last_accessed_raw = int.from_bytes(self.raw_data[0x12:0x14], byteorder='little')
+  def __unpack(self) -> tuple:
+    if self.fields is None:
+      self.fields = RDETentry.LAYOUT.unpack(self.raw_data)
+    return self.fields
 
-      self.time_updated_raw = int.from_bytes(self.raw_data[0x16:0x18], byteorder='little')
-      self.date_updated_raw = int.from_bytes(self.raw_data[0x18:0x1A], byteorder='little')
+  @property
+  def flag(self) -> bytes:
+    return self.raw_data[0xB:0xC]
 
-      h = (self.time_created_raw & 0b111110000000000000000000) >> 19
-      m = (self.time_created_raw & 0b000001111110000000000000) >> 13
-      s = (self.time_created_raw & 0b000000000001111110000000) >> 7
-      ms =(self.time_created_raw & 0b000000000000000001111111)
-      year = 1980 + ((self.date_created_raw & 0b1111111000000000) >> 9)
-      mon = (self.date_created_raw & 0b0000000111100000) >> 5
-      day = self.date_created_raw & 0b0000000000011111
+  # Flag tests work on the raw bytes, building Attribute values is comparatively slow
+  LABEL = Attribute.VOLLABLE.value
+  SYSTEM = Attribute.SYSTEM.value
+  DIRECTORY = Attribute.DIRECTORY.value
+  ARCHIVE = Attribute.ARCHIVE.value
 
-      self.date_created = datetime(year, mon, day, h, m, s, ms)
+  @property
+  def is_subentry(self) -> bool:
+    return self.raw_data[0xB] == 0x0F
 
-      year = 1980 + ((self.last_accessed_raw & 0b1111111000000000) >> 9)
-      mon = (self.last_accessed_raw & 0b0000000111100000) >> 5
-      day = self.last_accessed_raw & 0b0000000000011111
+  @property
+  def is_deleted(self) -> bool:
+    return self.raw_data[0] == 0xE5 and self.raw_data[0xB] != 0x0F
 
-      self.last_accessed = datetime(year, mon, day)
+  @property
+  def is_empty(self) -> bool:
+    return self.raw_data[0] == 0 and self.raw_data[0xB] != 0x0F
 
-      h = (self.time_updated_raw & 0b1111100000000000) >> 11
-      m = (self.time_updated_raw & 0b0000011111100000) >> 5
-      s = (self.time_updated_raw & 0b0000000000011111) * 2
-      year = 1980 + ((self.date_updated_raw & 0b1111111000000000) >> 9)
-      mon = (self.date_updated_raw & 0b0000000111100000) >> 5
-      day = self.date_updated_raw & 0b0000000000011111
+  @property
+  def is_label(self) -> bool:
+    return self.__has_attr() and bool(self.raw_data[0xB] & RDETentry.LABEL)
 
-      self.date_updated = datetime(year, mon, day, h, m, s)
+  @property
+  def attr(self) -> Attribute:
+    return Attribute(self.raw_data[0xB]) if self.__has_attr() else Attribute(0)
 
-      self.start_cluster = int.from_bytes(self.raw_data[0x14:0x16][::-1] + self.raw_data[0x1A:0x1C][::-1], byteorder='big') 
-      self.size = int.from_bytes(self.raw_data[0x1C:0x20], byteorder='little')
+  @property
+  def name(self) -> Union[bytes, str]:
+    if self.is_subentry:
+      # The 13 UTF-16 characters of a long name part, padded with 0xFFFF after a NUL
+      raw = self.raw_data[0x1:0xB] + self.raw_data[0xE:0x1A] + self.raw_data[0x1C:0x20]
+      return raw.decode('utf-16le').split('\uffff', 1)[0].strip('\x00')
+    if self.is_empty:
+      return ""
+    return self.raw_data[:0x8]
 
-    else:
-      self.index = self.raw_data[0]
-      self.name = b""
-      for i in chain(range(0x1, 0xB), range(0xE, 0x1A), range(0x1C, 0x20)):
-        self.name += int.to_bytes(self.raw_data[i], 1, byteorder='little')
-        if self.name.endswith(b"\xff\xff"):
-          self.name = self.name[:-2]
-          break
-      self.name = self.name.decode('utf-16le').strip('\x00')
+  @property
+  def ext(self) -> bytes:
+    if self.is_subentry:
+      return b""
+    return self.raw_data[0x8:0xB]
+
+  @property
+  def index(self) -> int:
+    return self.raw_data[0]
+
+  @property
+  def start_cluster(self) -> int:
+    fields = self.__unpack()
+    return fields[8] << 16 | fields[11]
+
+  @property
+  def size(self) -> int:
+    if not self.__has_stat():
+      return 0
+    return self.__unpack()[12]
+
+  @property
+  def date_created(self) -> datetime:
+    if not self.__has_stat():
+      return 0
+    _, _, _, _, tenths, time, date = self.__unpack()[:7]
+    time_raw = time << 8 | tenths
+    h = (time_raw & 0b111110000000000000000000) >> 19
+    m = (time_raw & 0b000001111110000000000000) >> 13
+    s = (time_raw & 0b000000000001111110000000) >> 7
+    ms =(time_raw & 0b000000000000000001111111)
+    return datetime(1980 + (date >> 9), (date >> 5) & 0xF, date & 0x1F, h, m, s, ms)
+
+  @property
+  def last_accessed(self) -> datetime:
+    if not self.__has_stat():
+      return 0
+    date = self.__unpack()[7]
+    return datetime(1980 + (date >> 9), (date >> 5) & 0xF, date & 0x1F)
+
+  @property
+  def date_updated(self) -> datetime:
+    if not self.__has_stat():
+      return 0
+    time, date = self.__unpack()[9:11]
+    return fat_datetime(date, time)
+
+  def __has_attr(self) -> bool:
+    return self.raw_data[0xB] != 0x0F and self.raw_data[0] != 0
+
+  def __has_stat(self) -> bool:
+    return self.__has_attr() and not self.raw_data[0xB] & RDETentry.LABEL
 
   def is_active_entry(self) -> bool:
-    return not (self.is_empty or self.is_subentry or self.is_deleted or self.is_label or Attribute.SYSTEM in self.attr)
+    return (self.raw_data[0] not in (0, 0xE5) and self.raw_data[0xB] != 0x0F
+            and not self.raw_data[0xB] & (RDETentry.LABEL | RDETentry.SYSTEM))
   
   def is_directory(self) -> bool:
-    return Attribute.DIRECTORY in self.attr
+    return self.__has_attr() and bool(self.raw_data[0xB] & RDETentry.DIRECTORY)
 
   def is_archive(self) -> bool:
-    return Attribute.ARCHIVE in self.attr
+    return self.__has_attr() and bool(self.raw_data[0xB] & RDETentry.ARCHIVE)
+
+def fat_datetime(date: int, time: int = 0) -> datetime:
+  return datetime(1980 + (date >> 9), (date >> 5) & 0xF, date & 0x1F, time >> 11, (time >> 5) & 0x3F, (time & 0x1F) * 2)
 
 class RDET:
+  '''
+  Directory table decoded in one pass into columns, one row per named short entry
+  (deleted entries and long name slots excluded), RDETentry objects are built on demand
+  '''
   def __init__(self, data: bytes) -> None:
     self.raw_data: bytes = data
-    self.entries: list[RDETentry] = []
-    long_name = ""
-    for i in range(0, len(data), 32):
-      self.entries.append(RDETentry(self.raw_data[i: i + 32]))
-      if self.entries[-1].is_empty or self.entries[-1].is_deleted:
-        long_name = ""
+    buf = bytes(data)
+    slots = len(buf) // 32
+    # Slot classification works on the first and attribute byte of every slot at once
+    firsts = buf[0:slots * 32:32]
+    attrs = buf[0xB:slots * 32:32]
+    self.count = RDET.table_end(firsts, attrs)
+
+    self.slots = array('I')
+    self.names: list[str] = []
+    self.attrs = bytearray()
+    self.clusters = array('I')
+    self.sizes = array('I')
+    # FAT date << 16 | time of the last update
+    self.times = array('I')
+    unpack = RDETentry.LAYOUT.unpack_from
+    lfn_start = -1
+    for i in range(self.count):
+      if attrs[i] == 0x0F:
+        if lfn_start < 0:
+          lfn_start = i
         continue
-      if self.entries[-1].is_subentry:
-        long_name = self.entries[-1].name + long_name
+      if firsts[i] == 0xE5:
+        lfn_start = -1
         continue
+      name, ext, attr, _, _, _, _, _, hi, time, date, lo, size = unpack(buf, i * 32)
+      if lfn_start >= 0:
+        long_name = RDET.join_long_name(buf, lfn_start, i)
+        lfn_start = -1
+      else:
+        extend = ext.strip().decode()
+        long_name = name.strip().decode() + "." + extend if extend else name.strip().decode()
+      self.slots.append(i)
+      self.names.append(long_name)
+      self.attrs.append(attr)
+      self.clusters.append(hi << 16 | lo)
+      self.sizes.append(size)
+      self.times.append(date << 16 | time)
+
+    # Rows of the entries get_active_entries / ls show
+    hidden = RDETentry.LABEL | RDETentry.SYSTEM
+    self.active = array('I', (row for row in range(len(self.slots)) if not self.attrs[row] & hidden))
+    self.active_entries: list[RDETentry] = None
+    self.all_entries: list[RDETentry] = None
+    # Lower-cased name -> active entry, built on the first lookup
+    self.index: dict[str, RDETentry] = None
+
+  @staticmethod
+  def table_end(firsts: bytes, attrs: bytes) -> int:
+    # Nothing is ever written past the first free slot
+    pos = firsts.find(b"\x00")
+    while pos >= 0:
+      if attrs[pos] != 0x0F:
+        return pos
+      pos = firsts.find(b"\x00", pos + 1)
+    return len(firsts)
 
-      if long_name != "":
-        self.entries[-1].long_name = long_name
+  @staticmethod
+  def join_long_name(buf: bytes, start: int, stop: int) -> str:
+    # Fragments in slots start..stop-1 are stored last part first, join them all and decode once
+    raw = b"".join(buf[j * 32 + 0x1:j * 32 + 0xB] + buf[j * 32 + 0xE:j * 32 + 0x1A] + buf[j * 32 + 0x1C:j * 32 + 0x20]
+                   for j in range(stop - 1, start - 1, -1))
+    return raw.decode('utf-16le', 'replace').split('\uffff', 1)[0].split('\x00', 1)[0]
+
+  @staticmethod
+  def iter_deleted(data, everything: bool = False):
+    '''
+    Yield (name, unpacked fields) of the entries marked deleted (0xE5), or of every named entry
+    but "." and ".." with everything. Long names are rebuilt from the deleted slots before the
+    entry, a short name has its lost first character shown as "_".
+    '''
+    buf = bytes(data)
+    slots = len(buf) // 32
+    firsts = buf[0:slots * 32:32]
+    attrs = buf[0xB:slots * 32:32]
+    end = RDET.table_end(firsts, attrs)
+    unpack = RDETentry.LAYOUT.unpack_from
+    candidates = range(end) if everything else RDET.__marked(firsts, end)
+    for i in candidates:
+      attr = attrs[i]
+      if attr == 0x0F or attr & RDETentry.LABEL or (everything and firsts[i] == 0x2E):
+        continue
+      start = i
+      while start > 0 and attrs[start - 1] == 0x0F and (firsts[start - 1] == 0xE5) == (firsts[i] == 0xE5):
+        start -= 1
+      fields = unpack(buf, i * 32)
+      if start < i:
+        name = RDET.join_long_name(buf, start, i)
       else:
-        extend = self.entries[-1].ext.strip().decode()
-        if extend == "":
-          self.entries[-1].long_name = self.entries[-1].name.strip().decode()
-        else:
-          self.entries[-1].long_name = self.entries[-1].name.strip().decode() + "." + extend
-      long_name = ""
+        stem = fields[0].strip()
+        if firsts[i] == 0xE5:
+          stem = b"_" + stem[1:]
+        ext = fields[1].strip()
+        name = stem.decode('ascii', 'replace') + ("." + ext.decode('ascii', 'replace') if ext else "")
+      yield name, fields
+
+  @staticmethod
+  def __marked(firsts: bytes, end: int):
+    pos = firsts.find(b"\xe5", 0, end)
+    while pos >= 0:
+      yield pos
+      pos = firsts.find(b"\xe5", pos + 1, end)
+
+  @property
+  def entries(self) -> 'list[RDETentry]':
+    # Every slot up to and including the terminating free one
+    if self.all_entries is None:
+      buf = bytes(self.raw_data)
+      self.all_entries = [RDETentry(buf[i * 32:i * 32 + 32]) for i in range(min(self.count + 1, len(buf) // 32))]
+      for row, slot in enumerate(self.slots):
+        self.all_entries[slot].long_name = self.names[row]
+    return self.all_entries
 
   def get_active_entries(self) -> 'list[RDETentry]':
-    entry_list = []
-    for i in range(len(self.entries)):
-      if self.entries[i].is_active_entry():
-        entry_list.append(self.entries[i])
-    return entry_list
+    if self.active_entries is None:
+      if self.all_entries is not None:
+        self.active_entries = [self.all_entries[self.slots[row]] for row in self.active]
+      else:
+        self.active_entries = []
+        for row in self.active:
+          slot = self.slots[row]
+          entry = RDETentry(self.raw_data[slot * 32:slot * 32 + 32])
+          entry.long_name = self.names[row]
+          self.active_entries.append(entry)
+    return self.active_entries
+
+  def dir_entries(self) -> 'list[DirEntry]':
+    # Active rows without "." and "..", straight from the columns
+    entries = []
+    dates: dict[int, datetime] = {}
+    for row in self.active:
+      name = self.names[row]
+      if name in (".", ".."):
+        continue
+      stamp = self.times[row]
+      if stamp not in dates:
+        dates[stamp] = fat_datetime(stamp >> 16, stamp & 0xFFFF)
+      attr = self.attrs[row]
+      entries.append(DirEntry(name, bool(attr & RDETentry.DIRECTORY), self.sizes[row], attr, self.clusters[row], dates[stamp]))
+    return entries
 
   def find_entry(self, name) -> RDETentry:
-    for i in range(len(self.entries)):
-      if self.entries[i].is_active_entry() and self.entries[i].long_name.lower() == name.lower():
-        return self.entries[i]
-    return None
+    if self.index is None:
+      self.index = {}
+      for entry in self.get_active_entries():
+        self.index.setdefault(entry.long_name.lower(), entry)
+    return self.index.get(name.lower())
+
+  def invalidate_index(self):
+    # Must be called whenever the entries are modified
+    self.index = None
+
+class DETCache:
+  '''
+  LRU store of parsed directory tables bounded by an estimated byte budget,
+  pinned tables (the root) are never evicted
+  '''
+  # Rough in-memory cost of one named entry (columns, name, RDETentry once listed)
+  ENTRY_OVERHEAD = 256
+
+  def __init__(self, budget: int) -> None:
+    self.budget = budget
+    self.tables: OrderedDict[int, RDET] = OrderedDict()
+    self.costs: dict[int, int] = {}
+    self.pinned: set[int] = set()
+    self.used = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  @staticmethod
+  def cost(det: RDET) -> int:
+    return len(det.raw_data) + len(det.slots) * DETCache.ENTRY_OVERHEAD
+
+  def __len__(self) -> int:
+    return len(self.tables)
+
+  def __contains__(self, cluster: int) -> bool:
+    return cluster in self.tables
+
+  def get(self, cluster: int) -> RDET:
+    det = self.tables.get(cluster)
+    if det is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.tables.move_to_end(cluster)
+    return det
+
+  def put(self, cluster: int, det: RDET, pin: bool = False):
+    if cluster in self.tables:
+      self.used -= self.costs[cluster]
+    self.tables[cluster] = det
+    self.tables.move_to_end(cluster)
+    self.costs[cluster] = DETCache.cost(det)
+    self.used += self.costs[cluster]
+    if pin:
+      self.pinned.add(cluster)
+    self.__evict()
+
+  def items(self):
+    return self.tables.items()
+
+  def stats(self) -> dict:
+    return {
+      "Tables": len(self.tables),
+      "Bytes": self.used,
+      "Budget": self.budget,
+      "Hits": self.hits,
+      "Misses": self.misses,
+      "Evictions": self.evictions,
+    }
+
+  def __evict(self):
+    # Oldest first, the table just added stays even if it alone exceeds the budget
+    for cluster in list(self.tables):
+      if self.used <= self.budget or len(self.tables) <= len(self.pinned) + 1:
+        break
+      if cluster in self.pinned:
+        continue
+      del self.tables[cluster]
+      self.used -= self.costs.pop(cluster)
+      self.evictions += 1
+
+class ChainIndex:
+  '''
+  Extents of one cluster chain as parallel arrays, logical cluster -> extent by bisection
+  '''
+  __slots__ = ("vcns", "clusters", "counts")
+
+  def __init__(self, extents: 'list[tuple[int, int]]') -> None:
+    self.vcns = array('I')
+    self.clusters = array('I')
+    self.counts = array('I')
+    vcn = 0
+    for cluster, count in extents:
+      self.vcns.append(vcn)
+      self.clusters.append(cluster)
+      self.counts.append(count)
+      vcn += count
+
+  def __len__(self) -> int:
+    # Clusters in the chain
+    return self.vcns[-1] + self.counts[-1] if self.vcns else 0
+
+class FAT32File(VolumeFile):
+  def __init__(self, volume: 'FAT32', start_cluster: int, size: int) -> None:
+    super().__init__(volume.dev, size, volume.SC * volume.BS)
+    self.data_offset = (volume.SB + volume.SF * volume.NF) * volume.BS
+    # Built once per chain and shared, seeking never walks the chain
+    self.chain = volume.chain_index(start_cluster) if size != 0 else ChainIndex([])
+
+  def locate(self, vcn: int) -> 'tuple[int, int]':
+    chain = self.chain
+    if vcn >= len(chain):
+      return None, 0
+    i = bisect_right(chain.vcns, vcn) - 1
+    skip = vcn - chain.vcns[i]
+    return self.data_offset + (chain.clusters[i] + skip - 2) * self.cluster_size, chain.counts[i] - skip
 
 class FAT32:
+  # Chains kept by chain_index
+  CHAIN_CACHE = 256
   important_info = [
     "Bytes Per Sector",
     "Sectors Per Cluster", 
@@ -162,11 +552,27 @@ class FAT32:
     "Starting Sector of Data",
     "FAT Name"
   ]
-  def __init__(self, name: str) -> None:
-    self.name = name
-    self.cwd = [self.name]
+  def __init__(self, name: Union[str, BlockDevice], check_mirrors: bool = False, use_cache: bool = True,
+               det_budget: int = 64 << 20, io_workers: int = 8) -> None:
+    # det_budget: approximate bytes of parsed directory tables kept in memory
+    # io_workers: threads reading subdirectory tables ahead of a walk, 0 or 1 disables it
+    self.io_workers = io_workers
+    self.pool = None
+    self.last_extents: list[tuple[int, int]] = []
+    self.chains: OrderedDict[int, ChainIndex] = OrderedDict()
+    # Directory tables in the index cache file: first cluster -> (offset, size) in the file
+    self.cached_dirs: dict[int, tuple[int, int]] = {}
+    # Tables read from the volume since, saved along with the cached ones on exit
+    self.read_dirs: set[int] = set()
+    self.cache_dirty = False
+    self.use_cache = use_cache
+    # Trigram index over every name on the volume, built by the first indexed find
+    self.name_index: TrigramIndex = None
+    self.index_entries: list[tuple[str, DirEntry]] = []
     try:
-      self.fd = open(r'\\.\%s' % self.name, 'rb')
+      self.dev = name if isinstance(name, BlockDevice) else BlockDevice(name)
+      self.name = self.dev.name
+      self.cwd = [self.name]
     except FileNotFoundError:
       print(f"[ERROR] No volume named {name}")
       exit()
@@ -179,29 +585,44 @@ class FAT32:
       exit() 
     
     try:
-      self.boot_sector_raw = self.fd.read(0x200)
+      self.boot_sector_raw = self.dev.read(0, 0x200)
       self.boot_sector = {}
       self.__extract_boot_sector()
       if self.boot_sector["FAT Name"] != b"FAT32   ":
         raise Exception("Not FAT32")
-      self.boot_sector["FAT Name"] = self.boot_sector["FAT Name"].decode()
+      self.boot_sector["FAT Name"] = bytes(self.boot_sector["FAT Name"]).decode()
       self.SB = self.boot_sector['Reserved Sectors']
       self.SF = self.boot_sector["Sectors Per FAT"]
       self.NF = self.boot_sector["No. Copies of FAT"]
       self.SC = self.boot_sector["Sectors Per Cluster"]
       self.BS = self.boot_sector["Bytes Per Sector"]
-      self.boot_sector_reserved_raw = self.fd.read(self.BS * (self.SB - 1))
+      self.boot_sector_reserved_raw = self.dev.read(0x200, self.BS * (self.SB - 1))
       
-      FAT_size = self.BS * self.SF
-      self.FAT: list[FAT] = []
-      for _ in range(self.NF):
-        self.FAT.append(FAT(self.fd.read(FAT_size)))
+      # Bit 7 of the flags disables mirroring, bits 0-3 then select the active FAT
+      self.active_fat = self.boot_sector["Flags"] & 0xF if self.boot_sector["Flags"] & 0x80 else 0
+      self.FAT = FAT(self.dev.read(self.BS * (self.SB + self.active_fat * self.SF), self.BS * self.SF))
+      if check_mirrors:
+        for i in self.check_fat_mirrors():
+          print(f"[WARNING] FAT copy {i} differs from the active FAT")
 
-      self.DET = {}
+      self.DET = DETCache(det_budget)
       
       start = self.boot_sector["Starting Cluster of RDET"]
-      self.DET[start] = RDET(self.get_all_cluster_data(start))
-      self.RDET = self.DET[start]
+      self.root = RDET(self.get_all_cluster_data(start))
+      self.DET.put(start, self.root, pin=True)
+      self.RDET = self.root
+      # The fingerprint only covers the metadata, directory tables can change below it. Without
+      # the size and mtime of an image file to catch that, tables are not cached at all
+      if self.use_cache and not IndexCache.file_stamp(self.dev):
+        self.use_cache = False
+      if self.use_cache:
+        self.cache_key = self.__cache_key()
+        columns = IndexCache.load(IndexCache.cache_path(self.dev), self.cache_key, on_disk=("data",))
+        if columns is not None:
+          base, _ = columns["data"]
+          offsets = columns["offsets"]
+          for i, cluster in enumerate(columns["clusters"]):
+            self.cached_dirs[cluster] = (base + offsets[i], offsets[i + 1] - offsets[i])
 
     except Exception as e:
       print(f"[ERROR] {e}")
@@ -210,17 +631,156 @@ class FAT32:
   @staticmethod
   def check_fat32(name: str):
     try:
-      with open(r'\\.\%s' % name, 'rb') as fd:
-        fd.read(1)
-        fd.seek(0x52)
-        fat_name = fd.read(8)
-        if fat_name == b"FAT32   ":
-          return True
-        return False
+      dev = BlockDevice(name)
+      fat_name = bytes(dev.read(0x52, 8))
+      dev.close()
+      if fat_name == b"FAT32   ":
+        return True
+      return False
     except Exception as e:
       print(f"[ERROR] {e}")
       exit()
 
+  def check_fat_mirrors(self, chunk_size: int = 1 << 20) -> 'list[int]':
+    mismatched = []
+    FAT_size = self.BS * self.SF
+    raw = memoryview(self.FAT.raw_data)
+    for i in range(self.NF):
+      if i == self.active_fat:
+        continue
+      base = self.BS * (self.SB + i * self.SF)
+      for off in range(0, FAT_size, chunk_size):
+        if self.dev.read(base + off, min(chunk_size, FAT_size - off)) != raw[off:off + chunk_size]:
+          mismatched.append(i)
+          break
+    return mismatched
+
+  def read_fsinfo(self) -> dict:
+    '''
+    Free cluster count and next free hint kept in the FSInfo sector, None where unknown
+    '''
+    raw = self.dev.read(self.boot_sector["FSInfo Sector"] * self.BS, 0x200)
+    lead, = struct.unpack_from("<I", raw, 0)
+    sig, free, next_free = struct.unpack_from("<III", raw, 0x1E4)
+    if lead != 0x41615252 or sig != 0x61417272:
+      return {"Valid": False, "Free Clusters": None, "Next Free": None}
+    return {
+      "Valid": True,
+      "Free Clusters": None if free == 0xFFFFFFFF else free,
+      "Next Free": None if next_free == 0xFFFFFFFF else next_free,
+    }
+
+  def space_usage(self, buckets: int = 64) -> dict:
+    '''
+    Free, used and bad cluster counts from one pass over the FAT, checked against FSInfo.
+    Every used cluster that does not link to the next one ends a fragment.
+    Histogram holds the used fraction of buckets equal slices of the data area.
+    '''
+    clusters = min((self.boot_sector["No. Sectors In Volume"] - self.boot_sector["Starting Sector of Data"]) // self.SC,
+                   len(self.FAT) - 2)
+    buckets = max(1, min(buckets, clusters))
+    histogram = []
+    free = bad = ends = contiguous = 0
+    for i in range(buckets):
+      lo = 2 + clusters * i // buckets
+      hi = 2 + clusters * (i + 1) // buckets
+      b_free, b_bad, b_ends, b_contiguous = self.FAT.scan(lo, hi)
+      histogram.append((hi - lo - b_free - b_bad) / (hi - lo))
+      free += b_free
+      bad += b_bad
+      ends += b_ends
+      contiguous += b_contiguous
+    used = clusters - free - bad
+    fsinfo = self.read_fsinfo()
+    return {
+      "Cluster Size": self.SC * self.BS,
+      "Clusters": clusters,
+      "Free Clusters": free,
+      "Used Clusters": used,
+      "Bad Clusters": bad,
+      "Chains": ends,
+      "Fragments": used - contiguous,
+      "FSInfo Free Clusters": fsinfo["Free Clusters"],
+      "FSInfo Next Free": fsinfo["Next Free"],
+      "FSInfo Matches": fsinfo["Free Clusters"] == free,
+      "Histogram": histogram,
+    }
+
+  def fragmentation(self, path: str = ""):
+    '''
+    Yield (path, entry, fragments) for every file and directory below path,
+    fragments being the number of contiguous runs its cluster chain breaks into
+    '''
+    for dirpath, entries in self.walk(path):
+      for entry in entries:
+        if 2 <= entry.ref < len(self.FAT) and (entry.is_dir or entry.size > 0):
+          yield join_path(dirpath, entry.name), entry, len(self.FAT.get_extents(entry.ref))
+
+  def __cache_key(self) -> dict:
+    # Boot sector, FSInfo, root directory and evenly spaced FAT pages
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(self.boot_sector_raw)
+    digest.update(self.dev.read(self.boot_sector["FSInfo Sector"] * self.BS, self.BS))
+    digest.update(self.RDET.raw_data)
+    fat = self.FAT.raw_data
+    step = max(4096, (len(fat) // 64) & ~4095)
+    for off in range(0, len(fat), step):
+      digest.update(fat[off:off + 4096])
+    return {
+      "fs": "FAT32",
+      "serial": self.boot_sector["Volume Serial Number"],
+      "geometry": [self.BS, self.SC, self.SB, self.NF, self.SF, self.boot_sector["No. Sectors In Volume"]],
+      "fingerprint": digest.hexdigest(),
+      "stamp": IndexCache.file_stamp(self.dev),
+    }
+
+  def save_cache(self):
+    if not self.use_cache or not self.cache_dirty:
+      return
+    # Only the parsed tables are held in memory, the others are read again from the old
+    # cache file or the volume
+    path = IndexCache.cache_path(self.dev)
+    parsed = dict(self.DET.items())
+    old = [self.cached_dirs[cluster] for cluster in self.cached_dirs.keys() - parsed.keys()]
+    if old:
+      start = min(offset for offset, _ in old)
+      old_data = memoryview(IndexCache.read(path, start, max(offset + size for offset, size in old) - start))
+    tables = {}
+    for cluster in sorted(self.read_dirs | self.cached_dirs.keys() | parsed.keys()):
+      try:
+        if cluster in parsed:
+          tables[cluster] = parsed[cluster].raw_data
+        elif cluster in self.cached_dirs:
+          offset, size = self.cached_dirs[cluster]
+          tables[cluster] = old_data[offset - start:offset - start + size]
+        else:
+          tables[cluster] = self.__read_chain(cluster)
+      except Exception:
+        continue
+    clusters = array('I', tables.keys())
+    offsets = array('Q', [0])
+    for cluster in clusters:
+      offsets.append(offsets[-1] + len(tables[cluster]))
+    data = b"".join(tables[cluster] for cluster in clusters)
+    if IndexCache.save(path, self.cache_key, {"clusters": clusters, "offsets": offsets, "data": data}):
+      self.cache_dirty = False
+      base = IndexCache.load(path, self.cache_key, on_disk=("data",))["data"][0]
+      self.cached_dirs = {cluster: (base + offsets[i], offsets[i + 1] - offsets[i]) for i, cluster in enumerate(clusters)}
+      self.read_dirs.clear()
+
+  def __load_det(self, cluster: int) -> RDET:
+    det = self.DET.get(cluster)
+    if det is None:
+      if cluster in self.cached_dirs:
+        det = RDET(IndexCache.read(IndexCache.cache_path(self.dev), *self.cached_dirs[cluster]))
+      else:
+        det = RDET(self.get_all_cluster_data(cluster))
+        if self.use_cache:
+          self.read_dirs.add(cluster)
+          self.cache_dirty = True
+      self.DET.put(cluster, det)
+    return det
+
   def __extract_boot_sector(self):
     # self.boot_sector['Jump_Code'] = self.boot_sector_raw[:3]
     # self.boot_sector['OEM_ID'] = self.boot_sector_raw[3:0xB]
@@ -236,8 +796,9 @@ class FAT32:
     self.boot_sector['Flags'] = int.from_bytes(self.boot_sector_raw[0x28:0x2A], byteorder='little')
     self.boot_sector['FAT32 Version'] = self.boot_sector_raw[0x2A:0x2C]
     self.boot_sector['Starting Cluster of RDET'] = int.from_bytes(self.boot_sector_raw[0x2C:0x30], byteorder='little')
-    # self.boot_sector['Sector Number of the FileSystem Information Sector'] = self.boot_sector_raw[0x30:0x32]
+    self.boot_sector['FSInfo Sector'] = int.from_bytes(self.boot_sector_raw[0x30:0x32], byteorder='little')
     # self.boot_sector['Sector Number of BackupBoot'] = self.boot_sector_raw[0x32:0x34]
+    self.boot_sector['Volume Serial Number'] = int.from_bytes(self.boot_sector_raw[0x43:0x47], byteorder='little')
     self.boot_sector['FAT Name'] = self.boot_sector_raw[0x52:0x5A]
     # self.boot_sector['Executable Code'] = self.boot_sector_raw[0x5A:0x1FE]
     # self.boot_sector['Signature'] = self.boot_sector_raw[0x1FE:0x200]
@@ -261,7 +822,7 @@ class FAT32:
     dirs = self.__parse_path(dir)
 
     if dirs[0] == self.name:
-      cdet = self.DET[self.boot_sector["Starting Cluster of RDET"]]
+      cdet = self.root
       dirs.pop(0)
     else:
       cdet = self.RDET
@@ -272,35 +833,198 @@ class FAT32:
         raise Exception("Directory not found!")
       if entry.is_directory():
         if entry.start_cluster == 0:
-          cdet = self.DET[self.boot_sector["Starting Cluster of RDET"]]
+          cdet = self.root
           continue
-        if entry.start_cluster in self.DET:
-          cdet = self.DET[entry.start_cluster]
-          continue
-        self.DET[entry.start_cluster] = RDET(self.get_all_cluster_data(entry.start_cluster))
-        cdet = self.DET[entry.start_cluster] 
+        cdet = self.__load_det(entry.start_cluster)
       else:
         raise Exception("Not a directory")
     return cdet
   
+  def walk(self, path: str = "", max_depth: int = None):
+    '''
+    Yield (dirpath, entries) for path and every directory below it, depth first
+    in listing order, entries are DirEntry rows without "." and "..".
+    Removing directories from entries before resuming prunes them like os.walk.
+    Subdirectories of a level >= max_depth are not listed. The cwd is left alone.
+    '''
+    top = self.visit_dir(path) if path != "" else self.RDET
+    stack = [(path if path != "" else self.get_cwd(), top, 0)]
+    seen = {self.boot_sector["Starting Cluster of RDET"]}
+    while stack:
+      dirpath, det, depth = stack.pop()
+      if not isinstance(det, RDET):
+        # Pushed as a cluster number, read when its turn comes
+        cluster, det = det, None
+        if cluster >= 2 and cluster not in seen:
+          seen.add(cluster)
+          try:
+            det = self.__load_det(cluster)
+          except Exception:
+            pass
+      entries = det.dir_entries() if det is not None else []
+      yield dirpath, entries
+      if max_depth is not None and depth + 1 >= max_depth:
+        continue
+      self.prefetch_dirs([entry.ref for entry in entries if entry.is_dir and entry.ref not in seen])
+      for entry in reversed(entries):
+        if entry.is_dir:
+          stack.append((join_path(dirpath, entry.name), entry.ref, depth + 1))
+
+  def deleted(self, path: str = ""):
+    '''
+    Yield a DeletedEntry for every deleted entry below path, one directory table at a time.
+    A deleted directory whose first cluster is still free and still holds a table has that
+    cluster searched too, everything in it counts as deleted. The clusters of deleted data are assumed to follow
+    each other, as the FAT chain is gone.
+    '''
+    top = self.visit_dir(path) if path != "" else self.RDET
+    stack = [(path if path != "" else self.get_cwd(), top, False)]
+    seen = {self.boot_sector["Starting Cluster of RDET"]}
+    cluster_size = self.SC * self.BS
+    while stack:
+      dirpath, det, gone = stack.pop()
+      if not isinstance(det, RDET):
+        cluster, det = det, None
+        try:
+          det = self.__load_det(cluster)
+        except Exception:
+          continue
+      for name, fields in RDET.iter_deleted(det.raw_data, everything=gone):
+        is_dir = bool(fields[2] & RDETentry.DIRECTORY)
+        cluster = fields[8] << 16 | fields[11]
+        size = fields[12]
+        clusters = 1 if is_dir else -(-size // cluster_size)
+        if cluster < 2 or cluster >= len(self.FAT):
+          clusters = 0
+        entry_path = join_path(dirpath, name)
+        yield DeletedEntry(entry_path, is_dir, size, FAT32.__safe_datetime(fields[6], fields[5]),
+                           FAT32.__safe_datetime(fields[10], fields[9]), cluster, clusters, self.__free_runs(cluster, clusters))
+        if is_dir and clusters and cluster not in seen and self.FAT[cluster] == 0:
+          seen.add(cluster)
+          data = self.dev.pread(self.__offset_from_cluster(cluster) * self.BS, cluster_size)
+          # A directory table starts with its "." entry
+          if data[:11] == b".          " and data[0xB] & RDETentry.DIRECTORY:
+            stack.append((entry_path, RDET(data), True))
+      if gone:
+        continue
+      subdirs = [entry.ref for entry in det.dir_entries() if entry.is_dir and entry.ref not in seen]
+      self.prefetch_dirs(subdirs)
+      for entry in reversed(det.dir_entries()):
+        if entry.is_dir and 2 <= entry.ref < len(self.FAT) and entry.ref not in seen:
+          seen.add(entry.ref)
+          stack.append((join_path(dirpath, entry.name), entry.ref, False))
+
+  def __free_runs(self, cluster: int, count: int) -> 'list[tuple[int, int]]':
+    # Runs of cluster..cluster+count-1 the FAT still marks free
+    runs = []
+    elements = self.FAT.elements
+    start = None
+    for c in range(cluster, min(cluster + count, len(elements))):
+      if elements[c] & FAT.ENTRY_MASK == 0:
+        if start is None:
+          start = c
+      elif start is not None:
+        runs.append((start, c - start))
+        start = None
+    if start is not None:
+      runs.append((start, min(cluster + count, len(elements)) - start))
+    return runs
+
+  @staticmethod
+  def __safe_datetime(date: int, time: int) -> datetime:
+    try:
+      return fat_datetime(date, time)
+    except ValueError:
+      return None
+
+  def abspath(self, path: str) -> str:
+    dirs = self.__parse_path(path) if path != "" else []
+    if dirs and dirs[0] == self.name:
+      parts = []
+      dirs.pop(0)
+    else:
+      parts = self.cwd[1:]
+    for d in dirs:
+      if d == "..":
+        if parts:
+          parts.pop()
+      elif d not in ("", "."):
+        parts.append(d)
+    return "\\".join([self.name] + parts)
+
+  def find(self, path: str, flt: FindFilter, use_index: bool = False):
+    '''
+    Yield (path, entry) for everything below path matching flt
+    '''
+    top = self.abspath(path)
+    ids = None
+    if use_index:
+      if self.name_index is None:
+        self.index_entries = [(join_path(dirpath, entry.name), entry) for dirpath, entries in self.walk(self.name) for entry in entries]
+        self.name_index = TrigramIndex((i, entry.name) for i, (_, entry) in enumerate(self.index_entries))
+      ids = self.name_index.candidates(flt.literal())
+    if ids is None:
+      for dirpath, entries in self.walk(top):
+        for entry in entries:
+          if flt.match(entry):
+            yield join_path(dirpath, entry.name), entry
+      return
+    self.visit_dir(top)
+    prefix = top.lower().rstrip("\\") + "\\"
+    for i in ids:
+      file_path, entry = self.index_entries[i]
+      if file_path.lower().startswith(prefix) and flt.match(entry):
+        yield file_path, entry
+
+  def prefetch_dirs(self, clusters: 'list[int]'):
+    '''
+    Read the tables of the given directories concurrently into the DET cache
+    '''
+    # Cluster numbers grow with the physical offset, sorting them gives an elevator order
+    todo = sorted({cluster for cluster in clusters
+                   if 2 <= cluster < len(self.FAT) and cluster not in self.DET and cluster not in self.cached_dirs})
+    if len(todo) < 2 or self.io_workers <= 1:
+      return
+    if self.pool is None:
+      self.pool = ThreadPoolExecutor(self.io_workers)
+    try:
+      for cluster, data in zip(todo, self.pool.map(self.__read_chain, todo)):
+        if self.use_cache:
+          self.read_dirs.add(cluster)
+          self.cache_dirty = True
+        self.DET.put(cluster, RDET(data))
+    except Exception:
+      # Broken chains are reported when the directory is actually visited
+      pass
+
+  def __read_chain(self, cluster: int) -> bytes:
+    cluster_size = self.SC * self.BS
+    return b"".join(self.dev.pread(self.__offset_from_cluster(start) * self.BS, count * cluster_size)
+                    for start, count in self.FAT.get_extents(cluster))
+
   def get_dir(self, dir=""):
     try:
       if dir != "":
         cdet = self.visit_dir(dir)
-        entry_list = cdet.get_active_entries()
       else:
-        entry_list = self.RDET.get_active_entries()
+        cdet = self.RDET
+      # Straight from the columns, no RDETentry objects
       ret = []
-      for entry in entry_list:
+      dates: dict[int, datetime] = {}
+      for row in cdet.active:
+        stamp = cdet.times[row]
+        if stamp not in dates:
+          dates[stamp] = fat_datetime(stamp >> 16, stamp & 0xFFFF)
+        cluster = cdet.clusters[row]
         obj = {}
-        obj["Flags"] = entry.attr.value
-        obj["Date Modified"] = entry.date_updated
-        obj["Size"] = entry.size
-        obj["Name"] = entry.long_name
-        if entry.start_cluster == 0:
-          obj["Sector"] = (entry.start_cluster + 2) * self.SC
+        obj["Flags"] = cdet.attrs[row]
+        obj["Date Modified"] = dates[stamp]
+        obj["Size"] = cdet.sizes[row]
+        obj["Name"] = cdet.names[row]
+        if cluster == 0:
+          obj["Sector"] = (cluster + 2) * self.SC
         else:
-          obj["Sector"] = entry.start_cluster * self.SC
+          obj["Sector"] = cluster * self.SC
         ret.append(obj)
       return ret
     except Exception as e:
@@ -326,16 +1050,40 @@ class FAT32:
     except Exception as e:
       raise(e)
 
-  def get_all_cluster_data(self, cluster_index):
-    index_list = self.FAT[0].get_cluster_chain(cluster_index)
-    data = b""
-    for i in index_list:
-      off = self.__offset_from_cluster(i)
-      self.fd.seek(off * self.BS)
-      data += self.fd.read(self.SC * self.BS)
+  def chain_index(self, cluster: int) -> ChainIndex:
+    # Recently opened chains stay indexed, reopening a big file skips the FAT walk
+    chain = self.chains.get(cluster)
+    if chain is None:
+      chain = self.chains[cluster] = ChainIndex(self.FAT.get_extents(cluster))
+      if len(self.chains) > FAT32.CHAIN_CACHE:
+        self.chains.popitem(last=False)
+    else:
+      self.chains.move_to_end(cluster)
+    return chain
+
+  def get_all_cluster_data(self, cluster_index, size=None) -> Union[bytearray, memoryview, bytes]:
+    if size == 0:
+      self.last_extents = []
+      return bytearray()
+    extents = self.FAT.get_extents(cluster_index)
+    cluster_size = self.SC * self.BS
+    total = sum(count for _, count in extents) * cluster_size
+    if size is not None:
+      total = min(total, size)
+    self.last_extents = extents
+    if len(extents) == 1:
+      # Contiguous chain, hand out a slice of the device directly
+      return self.dev.read(self.__offset_from_cluster(extents[0][0]) * self.BS, total)
+    data = bytearray(total)
+    view = memoryview(data)
+    pos = 0
+    for start, count in extents:
+      if pos >= total:
+        break
+      pos += self.dev.readinto(self.__offset_from_cluster(start) * self.BS, view[pos:pos + count * cluster_size])
     return data
   
-  def get_text_file(self, path: str) -> str:
+  def __get_file_entry(self, path: str) -> RDETentry:
     path = self.__parse_path(path)
     if len(path) > 1:
       name = path[-1]
@@ -349,40 +1097,42 @@ class FAT32:
       raise Exception("File doesn't exist")
     if entry.is_directory():
       raise Exception("Is a directory")
-    index_list = self.FAT[0].get_cluster_chain(entry.start_cluster)
-    data = ""
-    size_left = entry.size
-    for i in index_list:
-      if size_left <= 0:
-        break
-      off = self.__offset_from_cluster(i)
-      self.fd.seek(off * self.BS)
-      raw_data = self.fd.read(min(self.SC * self.BS, size_left))
-      size_left -= self.SC * self.BS
-      try:
-        data += raw_data.decode()
-      except UnicodeDecodeError as e:
-        raise Exception("Not a text file, please use appropriate software to open.")
-      except Exception as e:
-        raise(e)
-    return data
+    return entry
+
+  def get_text_file(self, path: str) -> str:
+    entry = self.__get_file_entry(path)
+    raw_data = self.get_all_cluster_data(entry.start_cluster, entry.size)
+    try:
+      return str(raw_data, 'utf-8')
+    except UnicodeDecodeError as e:
+      raise Exception("Not a text file, please use appropriate software to open.")
+    except Exception as e:
+      raise(e)
 
   def get_file_content(self, path: str) -> bytes:
-    path = self.__parse_path(path)
-    if len(path) > 1:
-      name = path[-1]
-      path = "\\".join(path[:-1])
-      cdet = self.visit_dir(path)
-      entry = cdet.find_entry(name)
-    else: 
-      entry = self.RDET.find_entry(path[0])
+    entry = self.__get_file_entry(path)
+    data = self.get_all_cluster_data(entry.start_cluster, entry.size)
+    return data
+
+  def open(self, path: str) -> FAT32File:
+    entry = self.__get_file_entry(path)
+    return FAT32File(self, entry.start_cluster, entry.size)
 
+  def open_entry(self, entry: DirEntry) -> FAT32File:
+    return FAT32File(self, entry.ref, entry.size)
+
+  def stat(self, path: str) -> DirEntry:
+    dirs = self.__parse_path(path)
+    if dirs == [self.name]:
+      return DirEntry(self.name, True, 0, Attribute.DIRECTORY.value, self.boot_sector["Starting Cluster of RDET"], None)
+    cdet = self.visit_dir("\\".join(dirs[:-1])) if len(dirs) > 1 else self.RDET
+    entry = cdet.find_entry(dirs[-1])
     if entry is None:
       raise Exception("File doesn't exist")
-    if entry.is_directory():
-      raise Exception("Is a directory")
-    data = self.get_all_cluster_data(entry.start_cluster)[:entry.size]
-    return data
+    return self.__dir_entry(entry)
+
+  def __dir_entry(self, entry: RDETentry) -> DirEntry:
+    return DirEntry(entry.long_name, entry.is_directory(), entry.size, entry.attr.value, entry.start_cluster, entry.date_updated)
 
   def __str__(self) -> str:
     s = "Volume name: " + self.name
@@ -392,6 +1142,10 @@ class FAT32:
     return s
 
   def __del__(self):
-    if getattr(self, "fd", None):
+    if getattr(self, "dev", None):
       print("Closing Volume...")
-      self.fd.close()
+      if getattr(self, "cache_key", None):
+        self.save_cache()
+      if getattr(self, "pool", None):
+        self.pool.shutdown()
+      self.dev.close()
@@ -0,0 +1,108 @@
+import fnmatch
+import re
+from array import array
+from datetime import datetime
+from DirEntry import DirEntry
+
+def to_filetime(date: datetime) -> int:
+  # Inverse of NTFS.as_datetime
+  return int(date.timestamp()) * 10000000 + 116444736000000000
+
+class FindFilter:
+  '''
+  Conditions of a find query, every given condition has to hold.
+  Names are matched case-insensitively, dates compare the last modified time.
+  '''
+  def __init__(self, name: str = None, regex: str = None, contains: str = None,
+               min_size: int = None, max_size: int = None,
+               after: datetime = None, before: datetime = None,
+               kind: str = None, attributes: int = 0) -> None:
+    self.glob = name
+    self.name = re.compile(fnmatch.translate(name.lower())) if name else None
+    self.regex = re.compile(regex, re.IGNORECASE) if regex else None
+    self.contains = contains.lower() if contains else None
+    self.min_size = min_size
+    self.max_size = max_size
+    self.after = after
+    self.before = before
+    if kind not in (None, "f", "d"):
+      raise Exception("Type must be f or d")
+    self.kind = kind
+    self.attributes = attributes
+
+  def literal(self) -> str:
+    # Longest piece of text every matching name contains, feeds the trigram index
+    pieces = [self.contains or ""]
+    if self.glob:
+      # A bracket expression stands for one unknown character like ?, an unclosed [ is literal
+      glob = re.sub(r"\[!?\]?[^\]]*\]", "?", self.glob.lower())
+      pieces += re.split(r"[*?]", glob)
+    return max(pieces, key=len)
+
+  def match_name(self, name: str) -> bool:
+    if self.contains is not None or self.name is not None:
+      lowered = name.lower()
+      if self.contains is not None and self.contains not in lowered:
+        return False
+      if self.name is not None and self.name.match(lowered) is None:
+        return False
+    if self.regex is not None and self.regex.search(name) is None:
+      return False
+    return True
+
+  def match_stat(self, is_dir: bool, size: int, flags: int) -> bool:
+    if self.kind is not None and (self.kind == "d") != is_dir:
+      return False
+    if self.min_size is not None and size < self.min_size:
+      return False
+    if self.max_size is not None and size > self.max_size:
+      return False
+    return flags & self.attributes == self.attributes
+
+  def match_date(self, modified: datetime) -> bool:
+    if self.after is None and self.before is None:
+      return True
+    if modified is None:
+      return False
+    if self.after is not None and modified < self.after:
+      return False
+    if self.before is not None and modified >= self.before:
+      return False
+    return True
+
+  def match(self, entry: DirEntry) -> bool:
+    return (self.match_stat(entry.is_dir, entry.size, entry.flags) and self.match_name(entry.name)
+            and self.match_date(entry.modified))
+
+class TrigramIndex:
+  '''
+  Lower-cased name trigram -> sorted ids of the names containing it
+  '''
+  def __init__(self, names) -> None:
+    # names: iterable of (id, name) in ascending id order
+    self.postings: dict[str, array] = {}
+    for i, name in names:
+      name = name.lower()
+      for gram in {name[j:j + 3] for j in range(len(name) - 2)}:
+        posting = self.postings.get(gram)
+        if posting is None:
+          posting = self.postings[gram] = array('I')
+        posting.append(i)
+
+  def candidates(self, text: str) -> 'list[int]':
+    '''
+    Ids of names that may contain text, None when text is too short to narrow anything down
+    '''
+    text = text.lower()
+    if len(text) < 3:
+      return None
+    grams = sorted({text[j:j + 3] for j in range(len(text) - 2)}, key=lambda g: len(self.postings.get(g, ())))
+    result = None
+    for gram in grams:
+      posting = self.postings.get(gram)
+      if posting is None:
+        return []
+      result = set(posting) if result is None else result.intersection(posting)
+      if not result:
+        return []
+    return sorted(result)
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Union
+from BatchIO import BatchRead
+from DirEntry import DirEntry, join_path
+from FAT32 import FAT32
+from NTFS import NTFS
+
+ALGORITHMS = ("md5", "sha1", "sha256")
+# Files up to this size are read offset-sorted with BatchRead and hashed from memory,
+# bigger ones are read and hashed chunk by chunk by a worker each
+SMALL_FILE = 1 << 20
+BATCH_BYTES = 32 << 20
+CHUNK_SIZE = 4 << 20
+# Bytes read but not hashed yet before the reader waits for the workers
+MAX_PENDING = 128 << 20
+
+class Hasher:
+  '''
+  Hash every file below a path: data is read in physical disk order, each piece is fed
+  to all the algorithms at once, hashing runs on a thread pool (hashlib drops the GIL)
+  '''
+  def __init__(self, vol: Union[FAT32, NTFS], workers: int = None, algorithms: 'tuple[str, ...]' = ALGORITHMS) -> None:
+    self.vol = vol
+    self.workers = workers or min(32, (os.cpu_count() or 1) + 2)
+    self.algorithms = algorithms
+    self.files = 0
+    self.bytes = 0
+    self.start = None
+    self.pending: deque = deque()
+    self.pending_bytes = 0
+
+  def hash(self, src: str = ""):
+    '''
+    Yield (path, entry, {algorithm: hex digest}) for every file below src, roughly in disk order
+    '''
+    self.start = time.time()
+    top = self.vol.stat(src) if src != "" else None
+    with ThreadPoolExecutor(self.workers) as pool:
+      try:
+        if top is not None and not top.is_dir:
+          yield from self.__hash_files(pool, [(src, top)])
+        else:
+          for dirpath, entries in self.vol.walk(src):
+            yield from self.__hash_files(pool, [(join_path(dirpath, entry.name), entry) for entry in entries if not entry.is_dir])
+        yield from self.__drain(0)
+      finally:
+        for future, _, _ in self.pending:
+          future.cancel()
+        self.pending.clear()
+
+  def stats(self) -> dict:
+    elapsed = max(time.time() - (self.start or time.time()), 1e-9)
+    return {
+      "Files": self.files,
+      "Bytes": self.bytes,
+      "Seconds": round(elapsed, 3),
+      "MB/s": round(self.bytes / elapsed / (1 << 20), 2),
+    }
+
+  def __hash_files(self, pool: ThreadPoolExecutor, files: 'list[tuple[str, DirEntry]]'):
+    large = []
+    batch = BatchRead(self.vol.dev)
+    batch_bytes = 0
+    for path, entry in files:
+      file = self.vol.open_entry(entry)
+      if entry.size > SMALL_FILE:
+        offset, _ = file.locate(0) if file.dev is not None else (None, 0)
+        large.append((offset or 0, path, entry, file))
+        continue
+      batch.add((path, entry), file)
+      batch_bytes += entry.size
+      if batch_bytes >= BATCH_BYTES:
+        yield from self.__flush(pool, batch)
+        batch = BatchRead(self.vol.dev)
+        batch_bytes = 0
+    yield from self.__flush(pool, batch)
+    # Big files go to the workers in the order they sit on the disk
+    for _, path, entry, file in sorted(large, key=lambda item: item[0]):
+      yield from self.__drain(MAX_PENDING - CHUNK_SIZE)
+      self.__submit(pool.submit(self.__digest_file, file), path, entry, CHUNK_SIZE)
+
+  def __flush(self, pool: ThreadPoolExecutor, batch: BatchRead):
+    for (path, entry), data in batch.run():
+      yield from self.__drain(MAX_PENDING - len(data))
+      self.__submit(pool.submit(self.__digest_data, data), path, entry, len(data))
+
+  def __submit(self, future: Future, path: str, entry: DirEntry, cost: int):
+    self.pending.append((future, (path, entry), cost))
+    self.pending_bytes += cost
+
+  def __drain(self, limit: int):
+    # Hand back finished results in submission order until at most limit bytes are pending
+    while self.pending and (self.pending_bytes > limit or self.pending[0][0].done()):
+      future, (path, entry), cost = self.pending.popleft()
+      self.pending_bytes -= cost
+      digests = future.result()
+      self.files += 1
+      self.bytes += entry.size
+      yield path, entry, digests
+
+  def __digest_data(self, data) -> 'dict[str, str]':
+    hashes = [hashlib.new(name) for name in self.algorithms]
+    for h in hashes:
+      h.update(data)
+    return {name: h.hexdigest() for name, h in zip(self.algorithms, hashes)}
+
+  def __digest_file(self, file) -> 'dict[str, str]':
+    hashes = [hashlib.new(name) for name in self.algorithms]
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    while True:
+      n = file.readinto(buffer)
+      if not n:
+        break
+      for h in hashes:
+        h.update(view[:n])
+    return {name: h.hexdigest() for name, h in zip(self.algorithms, hashes)}
+
+  def manifest_header(self, command: str = "") -> str:
+    # hashdeep's format, one "size,<algorithms>,filename" line per file follows
+    columns = ",".join(("size",) + self.algorithms + ("filename",))
+    return (f"%%%% HASHDEEP-1.0\n%%%% {columns}\n## Invoked from: {self.vol.name}\n"
+            f"## $ {command}\n##\n")
+
+  def manifest_line(self, path: str, entry: DirEntry, digests: 'dict[str, str]') -> str:
+    return ",".join([str(entry.size)] + [digests[name] for name in self.algorithms] + [path]) + "\n"
@@ -0,0 +1,595 @@
+import argparse
+import math
+import random
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+SECTOR = 0x200
+EOC = 0x0FFFFFFF
+
+# Synthetic FAT32 / NTFS images for trying out and benchmarking the explorer without a real
+# drive: a random tree is built first, make_fat32 / make_ntfs then lay it out on disk
+class Node:
+  __slots__ = ("name", "is_dir", "size", "children", "time", "seed", "deleted", "parent", "index")
+
+  def __init__(self, name, is_dir, size=0, time=None, seed=0, deleted=False) -> None:
+    self.name = name
+    self.is_dir = is_dir
+    self.size = size
+    self.children: list[Node] = []
+    self.time = time or datetime(2023, 1, 1, 12, 0, 0)
+    self.seed = seed
+    self.deleted = deleted
+    self.parent = None
+    self.index = 0
+
+  def add(self, node: 'Node') -> 'Node':
+    node.parent = self
+    self.children.append(node)
+    return node
+
+  def iter_nodes(self):
+    stack = [self]
+    while stack:
+      node = stack.pop()
+      yield node
+      stack.extend(reversed(node.children))
+
+def file_content(node: Node) -> bytes:
+  # Deterministic per file, every fifth one is binary, the rest are UTF-8 text lines
+  if node.size == 0:
+    return b""
+  if node.seed % 5 == 4:
+    return random.Random(node.seed).randbytes(node.size)
+  lines = []
+  total = 0
+  i = 0
+  while total < node.size:
+    line = f"{i:07d} {node.name} éèê\n"
+    lines.append(line)
+    total += len(line.encode())
+    i += 1
+  return "".join(lines).encode()[:node.size]
+
+def build_tree(files=100, depth=3, fanout=4, min_size=0, max_size=16384, long_names=0.5, deleted=0.0, seed=1) -> Node:
+  '''
+  fanout sub-directories per directory down to depth levels, files are spread over all directories,
+  long_names is the share of names that need long file name entries, deleted the share of files marked deleted
+  '''
+  rng = random.Random(seed)
+  root = Node("", True)
+  dirs = [root]
+  level = [root]
+  for d in range(depth):
+    nxt = []
+    for parent in level:
+      for k in range(fanout):
+        nxt.append(parent.add(Node(make_name(rng, f"DIR{d}{k}", long_names), True)))
+    dirs.extend(nxt)
+    level = nxt
+  base = datetime(2020, 1, 1)
+  for i in range(files):
+    parent = dirs[rng.randrange(len(dirs))]
+    size = rng.randint(min_size, max_size)
+    name = make_name(rng, f"F{i}", long_names) + rng.choice([".TXT", ".BIN", ".LOG", ".dat"])
+    time = base + timedelta(seconds=rng.randrange(100000000))
+    parent.add(Node(name, False, size, time, seed=rng.randrange(1 << 30), deleted=rng.random() < deleted))
+  for i, node in enumerate(root.iter_nodes()):
+    node.index = i
+  return root
+
+def make_name(rng: random.Random, stem: str, long_names: float) -> str:
+  if rng.random() < long_names:
+    return f"{stem} long name {rng.choice(['alpha', 'beta', 'gamma', 'delta'])} {rng.randrange(1000)}"
+  return stem
+
+class Allocator:
+  '''
+  Hands out clusters in increasing order, with probability frag a run is split into up to 4 pieces
+  with small gaps in between
+  '''
+  def __init__(self, first: int, frag: float, rng: random.Random) -> None:
+    self.next = first
+    self.frag = frag
+    self.rng = rng
+
+  def alloc(self, count: int, frag=None) -> 'list[tuple[int, int]]':
+    if count == 0:
+      return []
+    frag = self.frag if frag is None else frag
+    pieces = 1
+    if count > 1 and self.rng.random() < frag:
+      pieces = self.rng.randint(2, min(4, count))
+    runs = []
+    left = count
+    for p in range(pieces):
+      length = left if p == pieces - 1 else max(1, left // (pieces - p))
+      runs.append((self.next, length))
+      self.next += length
+      left -= length
+      if p != pieces - 1:
+        self.next += self.rng.randint(1, 3)
+    return runs
+
+def fat_date(t: datetime) -> int:
+  return ((t.year - 1980) << 9) | (t.month << 5) | t.day
+
+def fat_time(t: datetime) -> int:
+  return (t.hour << 11) | (t.minute << 5) | (t.second // 2)
+
+def short_name(name: str, used: set) -> 'tuple[bytes, bool]':
+  stem, dot, ext = name.rpartition(".")
+  if not dot:
+    stem, ext = name, ""
+  fits = name == name.upper() and " " not in name and len(stem) <= 8 and len(ext) <= 3 and name.isascii()
+  clean = lambda s: "".join(c for c in s.upper() if c.isalnum())
+  if fits and (stem.ljust(8) + ext.ljust(3)).encode() not in used:
+    raw = (stem.ljust(8) + ext.ljust(3)).encode()
+    used.add(raw)
+    return raw, False
+  n = 1
+  while True:
+    tail = f"~{n}"
+    raw = (clean(stem)[:8 - len(tail)] + tail).ljust(8).encode() + clean(ext)[:3].ljust(3).encode()
+    if raw not in used:
+      used.add(raw)
+      return raw, True
+    n += 1
+
+def lfn_checksum(raw: bytes) -> int:
+  s = 0
+  for c in raw:
+    s = (((s & 1) << 7) + (s >> 1) + c) & 0xFF
+  return s
+
+def fat_dirent(raw_name: bytes, attr: int, cluster: int, size: int, t: datetime) -> bytearray:
+  e = bytearray(32)
+  e[0:11] = raw_name
+  e[11] = attr
+  struct.pack_into("<BHHH", e, 0xD, 0, fat_time(t), fat_date(t), fat_date(t))
+  struct.pack_into("<H", e, 0x14, cluster >> 16)
+  struct.pack_into("<HH", e, 0x16, fat_time(t), fat_date(t))
+  struct.pack_into("<HI", e, 0x1A, cluster & 0xFFFF, size)
+  return e
+
+def lfn_entries(name: str, checksum: int) -> 'list[bytearray]':
+  units = name.encode("utf-16le")
+  chars = [units[i:i + 2] for i in range(0, len(units), 2)]
+  if len(chars) % 13:
+    chars.append(b"\x00\x00")
+  while len(chars) % 13:
+    chars.append(b"\xff\xff")
+  parts = [chars[i:i + 13] for i in range(0, len(chars), 13)]
+  out = []
+  for seq, part in enumerate(parts, 1):
+    e = bytearray(32)
+    e[0] = seq | (0x40 if seq == len(parts) else 0)
+    e[1:11] = b"".join(part[:5])
+    e[11] = 0x0F
+    e[13] = checksum
+    e[14:26] = b"".join(part[5:11])
+    e[28:32] = b"".join(part[11:13])
+    out.append(e)
+  return out[::-1]
+
+def make_fat32(path: str, root: Node, cluster_size=4096, frag=0.0, slack=0.1, seed=1) -> None:
+  rng = random.Random(seed)
+  spc = cluster_size // SECTOR
+  reserved, nfat = 32, 2
+  alloc = Allocator(2, frag, rng)
+  chains = {}
+  nodes = list(root.iter_nodes())
+
+  dir_bytes = {}
+  entry_off = {}
+  for node in nodes:
+    if not node.is_dir:
+      continue
+    data = bytearray()
+    used = set()
+    if node is root:
+      data += fat_dirent(b"SYNTHETIC  ", 0x08, 0, 0, node.time)
+    else:
+      data += fat_dirent(b".          ", 0x10, 0, 0, node.time)
+      data += fat_dirent(b"..         ", 0x10, 0, 0, node.time)
+    for child in node.children:
+      raw, need_lfn = short_name(child.name, used)
+      entries = lfn_entries(child.name, lfn_checksum(raw)) if need_lfn else []
+      entries.append(fat_dirent(raw, 0x10 if child.is_dir else 0x20, 0, 0 if child.is_dir else child.size, child.time))
+      if child.deleted:
+        for e in entries:
+          e[0] = 0xE5
+      entry_off[child.index] = len(data) + 32 * (len(entries) - 1)
+      for e in entries:
+        data += e
+    dir_bytes[node.index] = data
+  for node in nodes:
+    count = math.ceil(len(dir_bytes[node.index]) / cluster_size) if node.is_dir else math.ceil(node.size / cluster_size)
+    chains[node.index] = alloc.alloc(count)
+
+  total_clusters = int((alloc.next - 2) * (1 + slack)) + 16
+  fat_sectors = math.ceil((total_clusters + 2) * 4 / SECTOR)
+  data_start = reserved + nfat * fat_sectors
+  total_sectors = data_start + total_clusters * spc
+
+  fat = array('I', bytes(4 * (total_clusters + 2)))
+  fat[0], fat[1] = 0x0FFFFFF8, EOC
+  for node in nodes:
+    if node.deleted:
+      continue
+    clusters = [c for start, n in chains[node.index] for c in range(start, start + n)]
+    for a, b in zip(clusters, clusters[1:]):
+      fat[a] = b
+    if clusters:
+      fat[clusters[-1]] = EOC
+
+  def first_cluster(node):
+    runs = chains[node.index]
+    return runs[0][0] if runs else 0
+
+  for node in nodes:
+    if not node.is_dir:
+      continue
+    data = dir_bytes[node.index]
+    if node is not root:
+      struct.pack_into("<H", data, 0x14, first_cluster(node) >> 16)
+      struct.pack_into("<H", data, 0x1A, first_cluster(node) & 0xFFFF)
+      parent_cluster = 0 if node.parent is root else first_cluster(node.parent)
+      struct.pack_into("<H", data, 0x34, parent_cluster >> 16)
+      struct.pack_into("<H", data, 0x3A, parent_cluster & 0xFFFF)
+    for child in node.children:
+      off = entry_off[child.index]
+      struct.pack_into("<H", data, off + 0x14, first_cluster(child) >> 16)
+      struct.pack_into("<H", data, off + 0x1A, first_cluster(child) & 0xFFFF)
+
+  free = fat.count(0)
+  boot = bytearray(SECTOR)
+  boot[0:3] = b"\xEB\x58\x90"
+  boot[3:11] = b"MSWIN4.1"
+  struct.pack_into("<HBHBHHBHHHII", boot, 0xB, SECTOR, spc, reserved, nfat, 0, 0, 0xF8, 0, 63, 255, 0, total_sectors)
+  struct.pack_into("<IHHIHH", boot, 0x24, fat_sectors, 0, 0, 2, 1, 6)
+  struct.pack_into("<BBBI", boot, 0x40, 0x80, 0, 0x29, 0x1234ABCD)
+  boot[0x47:0x52] = b"SYNTHETIC  "
+  boot[0x52:0x5A] = b"FAT32   "
+  boot[0x1FE:0x200] = b"\x55\xAA"
+  fsinfo = bytearray(SECTOR)
+  struct.pack_into("<I", fsinfo, 0, 0x41615252)
+  struct.pack_into("<III", fsinfo, 0x1E4, 0x61417272, free, alloc.next)
+  struct.pack_into("<I", fsinfo, 0x1FC, 0xAA550000)
+
+  with open(path, "wb") as f:
+    f.truncate(total_sectors * SECTOR)
+    f.write(boot)
+    f.write(fsinfo)
+    f.seek(6 * SECTOR)
+    f.write(boot)
+    if sys.byteorder != 'little':
+      fat.byteswap()
+    fat_raw = fat.tobytes()
+    for i in range(nfat):
+      f.seek((reserved + i * fat_sectors) * SECTOR)
+      f.write(fat_raw)
+    for node in nodes:
+      data = dir_bytes[node.index] if node.is_dir else file_content(node)
+      pos = 0
+      for start, n in chains[node.index]:
+        f.seek((data_start + (start - 2) * spc) * SECTOR)
+        f.write(data[pos:pos + n * cluster_size])
+        pos += n * cluster_size
+
+def ntfs_time(t: datetime) -> int:
+  return int((t - datetime(1601, 1, 1)).total_seconds()) * 10000000
+
+def encode_runs(runs: 'list[tuple[int, int]]') -> bytes:
+  out = bytearray()
+  prev = 0
+  for lcn, length in runs:
+    lb = length.to_bytes((length.bit_length() + 8) // 8, "little")
+    if lcn is None:
+      out.append(len(lb))
+      out += lb
+      continue
+    delta = lcn - prev
+    prev = lcn
+    ob = delta.to_bytes(max(1, (delta.bit_length() + 8) // 8), "little", signed=True)
+    out.append((len(ob) << 4) | len(lb))
+    out += lb + ob
+  out.append(0)
+  return bytes(out)
+
+def align8(n: int) -> int:
+  return (n + 7) & ~7
+
+def resident_attr(type_id: int, content: bytes, name: str = "", attr_id: int = 0) -> bytes:
+  name_raw = name.encode("utf-16le")
+  content_off = align8(0x18 + len(name_raw))
+  length = align8(content_off + len(content))
+  a = bytearray(length)
+  struct.pack_into("<IIBBHHHIHBB", a, 0, type_id, length, 0, len(name) , 0x18, 0, attr_id, len(content), content_off, 0, 0)
+  a[0x18:0x18 + len(name_raw)] = name_raw
+  a[content_off:content_off + len(content)] = content
+  return bytes(a)
+
+def nonresident_attr(type_id: int, runs, real_size: int, cluster_size: int, name: str = "", attr_id: int = 0) -> bytes:
+  name_raw = name.encode("utf-16le")
+  run_off = align8(0x40 + len(name_raw))
+  runlist = encode_runs(runs)
+  length = align8(run_off + len(runlist))
+  clusters = sum(n for _, n in runs)
+  a = bytearray(length)
+  struct.pack_into("<IIBBHHH", a, 0, type_id, length, 1, len(name), 0x40, 0, attr_id)
+  struct.pack_into("<qqHH", a, 0x10, 0, clusters - 1, run_off, 0)
+  struct.pack_into("<qqq", a, 0x28, clusters * cluster_size, real_size, real_size)
+  a[0x40:0x40 + len(name_raw)] = name_raw
+  a[run_off:run_off + len(runlist)] = runlist
+  return bytes(a)
+
+def apply_fixup(buf: bytearray, usa_off: int, usn: int = 1) -> None:
+  sectors = len(buf) // SECTOR
+  struct.pack_into("<H", buf, usa_off, usn)
+  for i in range(sectors):
+    end = (i + 1) * SECTOR - 2
+    buf[usa_off + 2 + 2 * i:usa_off + 4 + 2 * i] = buf[end:end + 2]
+    struct.pack_into("<H", buf, end, usn)
+
+def file_name_body(parent: int, name: str, t: datetime, size: int, flags: int) -> bytes:
+  raw = name.encode("utf-16le")
+  ts = ntfs_time(t)
+  body = struct.pack("<QqqqqqqIIBB", parent | (1 << 48), ts, ts, ts, ts, (size + 4095) & ~4095, size, flags, 0, len(name), 1)
+  return body + raw
+
+def index_entry(ref: int, key: bytes, child=None, last=False) -> bytes:
+  length = align8(0x10 + len(key)) + (8 if child is not None else 0)
+  e = bytearray(length)
+  flags = (1 if child is not None else 0) | (2 if last else 0)
+  struct.pack_into("<QHHI", e, 0, ref | (1 << 48) if ref is not None else 0, length, len(key), flags)
+  e[0x10:0x10 + len(key)] = key
+  if child is not None:
+    struct.pack_into("<q", e, length - 8, child)
+  return bytes(e)
+
+def pack_index(items, capacity: int, block_size: int):
+  # items: list of (ref, key, child); returns (root_items, root_terminal_child, blocks)
+  blocks = []
+  terminal = None
+  level = items
+  while sum(len(index_entry(r, k, c)) for r, k, c in level) + len(index_entry(None, b"", terminal, True)) > capacity:
+    up = []
+    cur, cur_size = [], 0
+    limit = block_size - 0x40 - 0x18
+    for ref, key, child in level:
+      size = len(index_entry(ref, key, child))
+      if cur and cur_size + size > limit:
+        blocks.append((cur, child))
+        up.append((ref, key, len(blocks) - 1))
+        cur, cur_size = [], 0
+        continue
+      cur.append((ref, key, child))
+      cur_size += size
+    blocks.append((cur, terminal))
+    terminal = len(blocks) - 1
+    level = up
+  return level, terminal, blocks
+
+def make_ntfs(path: str, root: Node, cluster_size=4096, frag=0.0, mft_fragments=1, slack=0.1, seed=1) -> None:
+  rng = random.Random(seed)
+  record_size = 1024
+  spc = cluster_size // SECTOR
+  alloc = Allocator(1, frag, rng)
+  nodes = list(root.iter_nodes())
+  user = [n for n in nodes if n is not root]
+  first_user = 24
+  numbers = {root.index: 5}
+  for i, node in enumerate(user):
+    numbers[node.index] = first_user + i
+  record_count = first_user + len(user)
+  record_count += -record_count % (cluster_size // record_size)
+  mft_clusters = record_count * record_size // cluster_size
+
+  mft_runs = []
+  left = mft_clusters
+  for p in range(mft_fragments):
+    n = left if p == mft_fragments - 1 else max(1, left // (mft_fragments - p))
+    mft_runs += alloc.alloc(n, frag=0)
+    left -= n
+    if p != mft_fragments - 1:
+      alloc.next += 5
+  mirr_runs = alloc.alloc(1, frag=0)
+  upcase = b"".join(struct.pack("<H", ord(u) if len(u) == 1 else c) for c, u in ((c, chr(c).upper()) for c in range(0x10000)))
+  upcase_runs = alloc.alloc(len(upcase) // cluster_size, frag=0)
+
+  records = {}
+  data_runs = {}
+  index_blocks = {}
+  sys_time = datetime(2020, 1, 1)
+  system = ["$MFT", "$MFTMirr", "$LogFile", "$Volume", "$AttrDef", ".", "$Bitmap", "$Boot", "$BadClus", "$Secure", "$UpCase", "$Extend"]
+
+  for node in user:
+    if not node.is_dir and node.size > 600:
+      data_runs[node.index] = alloc.alloc(math.ceil(node.size / cluster_size))
+
+  dir_flags = 0x10000000
+  def node_flags(node):
+    return dir_flags if node.is_dir else 0x20
+
+  def node_key(node):
+    parent = numbers[node.parent.index]
+    return file_name_body(parent, node.name, node.time, 0 if node.is_dir else node.size, node_flags(node))
+
+  def build_record(number, name, parent, t, si_flags, attrs, in_use=True, is_dir=False):
+    rec = bytearray(record_size)
+    si = struct.pack("<qqqqIIIIIIqq", ntfs_time(t), ntfs_time(t), ntfs_time(t), ntfs_time(t), si_flags, 0, 0, 0, 0, 0, 0, 0)
+    fn = file_name_body(parent, name, t, 0, si_flags | (dir_flags if is_dir else 0))
+    body = resident_attr(0x10, si) + resident_attr(0x30, fn, attr_id=1) + b"".join(attrs)
+    flags = (1 if in_use else 0) | (2 if is_dir else 0)
+    struct.pack_into("<4sHHqHHHHII", rec, 0, b"FILE", 0x30, 3, 0, 1, 1, 0x38, flags, 0x38 + len(body) + 8, record_size)
+    struct.pack_into("<I", rec, 0x2C, number)
+    rec[0x38:0x38 + len(body)] = body
+    assert 0x38 + len(body) + 8 <= record_size, "record overflow"
+    struct.pack_into("<I", rec, 0x38 + len(body), 0xFFFFFFFF)
+    apply_fixup(rec, 0x30)
+    return rec
+
+  def dir_attrs(number, name, children_items, record_used):
+    root_hdr = 0x20
+    alloc_estimate = 0x48 + 32
+    capacity = record_size - 0x38 - record_used - align8(0x18 + 8) - 0x20 - alloc_estimate - 16
+    level, terminal, blocks = pack_index(children_items, capacity, cluster_size)
+    entries = b"".join(index_entry(r, k, c) for r, k, c in level) + index_entry(None, b"", terminal, True)
+    node_hdr = struct.pack("<IIII", 0x10, 0x10 + len(entries), 0x10 + len(entries), 1 if blocks else 0)
+    content = struct.pack("<IIIB3x", 0x30, 1, cluster_size, 1) + node_hdr + entries
+    attrs = [resident_attr(0x90, content, "$I30", 2)]
+    if blocks:
+      runs = alloc.alloc(len(blocks))
+      index_blocks[number] = (runs, blocks)
+      attrs.append(nonresident_attr(0xA0, runs, len(blocks) * cluster_size, cluster_size, "$I30", 3))
+    return attrs
+
+  def children_items(node, extra=()):
+    items = [(numbers[c.index], node_key(c), None) for c in node.children if not c.deleted]
+    items += list(extra)
+    items.sort(key=lambda x: x[1][0x42:].decode("utf-16le").upper())
+    return items
+
+  # Root and directories
+  sys_items = []
+  for i, name in enumerate(system):
+    if name == ".":
+      continue
+    sys_items.append((i, file_name_body(5, name, sys_time, 0, 0x06 | (dir_flags if name == "$Extend" else 0)), None))
+  sys_items.append((5, file_name_body(5, ".", sys_time, 0, 0x06 | dir_flags), None))
+  for node in nodes:
+    if not node.is_dir:
+      continue
+    number = numbers[node.index]
+    name = "." if node is root else node.name
+    fn_len = align8(0x18 + 0x42 + 2 * len(name))
+    items = children_items(node, sys_items if node is root else ())
+    attrs = dir_attrs(number, name, items, 0x60 + fn_len)
+    parent = 5 if node is root else numbers[node.parent.index]
+    flags = 0x06 if node is root else 0
+    records[number] = build_record(number, name, parent, node.time, flags, attrs, in_use=not node.deleted, is_dir=True)
+
+  total_clusters = int(alloc.next * (1 + slack)) + 64
+  bitmap_bytes = math.ceil(total_clusters / 8)
+  bitmap_runs = alloc.alloc(math.ceil(bitmap_bytes / cluster_size), frag=0)
+  total_clusters = max(total_clusters, alloc.next + 16)
+  bitmap_bytes = math.ceil(total_clusters / 8)
+
+  def file_record(node):
+    if node.index in data_runs:
+      attr = nonresident_attr(0x80, data_runs[node.index], node.size, cluster_size)
+    else:
+      attr = resident_attr(0x80, file_content(node))
+    return build_record(numbers[node.index], node.name, numbers[node.parent.index], node.time, 0x20, [attr], in_use=not node.deleted)
+
+  sys_attrs = {
+    0: [nonresident_attr(0x80, mft_runs, mft_clusters * cluster_size, cluster_size)],
+    1: [nonresident_attr(0x80, mirr_runs, 4 * record_size, cluster_size)],
+    6: [nonresident_attr(0x80, bitmap_runs, bitmap_bytes, cluster_size)],
+    7: [nonresident_attr(0x80, [(0, 1)], 8192, cluster_size)],
+    10: [nonresident_attr(0x80, upcase_runs, len(upcase), cluster_size)],
+  }
+  for i, name in enumerate(system):
+    if i == 5:
+      continue
+    is_dir = name == "$Extend"
+    attrs = sys_attrs.get(i, [resident_attr(0x80, b"")]) if not is_dir else dir_attrs(i, name, [], 0x60 + align8(0x18 + 0x42 + 2 * len(name)))
+    records[i] = build_record(i, name, 5, sys_time, 0x06, attrs, is_dir=is_dir)
+
+  # One byte per cluster while marking, packed into bits once at the end
+  used = bytearray(total_clusters)
+  def mark(runs):
+    for lcn, n in runs:
+      used[lcn:lcn + n] = b"\x01" * n
+  mark([(0, 1)])
+  for runs in [mft_runs, mirr_runs, upcase_runs, bitmap_runs]:
+    mark(runs)
+  for node in user:
+    if node.index in data_runs and not node.deleted:
+      mark(data_runs[node.index])
+  for runs, _ in index_blocks.values():
+    mark(runs)
+
+  bitmap = int(used.translate(bytes.maketrans(b"\x00\x01", b"01"))[::-1], 2).to_bytes(bitmap_bytes, "little")
+
+  def record_offset(number):
+    # Records sit back to back in the clusters of mft_runs
+    vcn, pos = divmod(number * record_size, cluster_size)
+    for lcn, n in mft_runs:
+      if vcn < n:
+        return (lcn + vcn) * cluster_size + pos
+      vcn -= n
+
+  total_sectors = total_clusters * spc
+  boot = bytearray(SECTOR)
+  boot[0:3] = b"\xEB\x52\x90"
+  boot[3:11] = b"NTFS    "
+  struct.pack_into("<HBH", boot, 0xB, SECTOR, spc, 0)
+  boot[0x15] = 0xF8
+  struct.pack_into("<qqqbxxxbxxxQ", boot, 0x28, total_sectors - 1, mft_runs[0][0], mirr_runs[0][0], -10, 1, 0x1234ABCD5678EF90)
+  boot[0x1FE:0x200] = b"\x55\xAA"
+
+  def write_runs(f, runs, data):
+    pos = 0
+    for lcn, n in runs:
+      f.seek(lcn * cluster_size)
+      f.write(data[pos:pos + n * cluster_size])
+      pos += n * cluster_size
+
+  with open(path, "wb") as f:
+    f.truncate(total_clusters * cluster_size)
+    f.write(boot)
+    # File records are written as they are built, only directories and metadata files are kept
+    for number, rec in records.items():
+      f.seek(record_offset(number))
+      f.write(rec)
+    write_runs(f, mirr_runs, b"".join(records[i] for i in range(4)))
+    write_runs(f, upcase_runs, upcase)
+    write_runs(f, bitmap_runs, bitmap)
+    for node in user:
+      if node.is_dir:
+        continue
+      f.seek(record_offset(numbers[node.index]))
+      f.write(file_record(node))
+      if node.index in data_runs:
+        write_runs(f, data_runs[node.index], file_content(node))
+    for number, (runs, blocks) in index_blocks.items():
+      data = bytearray()
+      for vcn, (items, terminal) in enumerate(blocks):
+        block = bytearray(cluster_size)
+        entries = b"".join(index_entry(r, k, c) for r, k, c in items) + index_entry(None, b"", terminal, True)
+        struct.pack_into("<4sHHqq", block, 0, b"INDX", 0x28, 1 + cluster_size // SECTOR, 0, vcn)
+        has_sub = any(c is not None for _, _, c in items) or terminal is not None
+        struct.pack_into("<IIII", block, 0x18, 0x28, 0x28 + len(entries), cluster_size - 0x18, 1 if has_sub else 0)
+        block[0x40:0x40 + len(entries)] = entries
+        apply_fixup(block, 0x28)
+        data += block
+      write_runs(f, runs, data)
+
+def main():
+  parser = argparse.ArgumentParser(description="Generate synthetic FAT32/NTFS images")
+  parser.add_argument("fs", choices=["fat32", "ntfs"])
+  parser.add_argument("output")
+  parser.add_argument("--files", type=int, default=100)
+  parser.add_argument("--depth", type=int, default=2)
+  parser.add_argument("--fanout", type=int, default=3)
+  parser.add_argument("--min-size", type=int, default=0)
+  parser.add_argument("--max-size", type=int, default=16384)
+  parser.add_argument("--long-names", type=float, default=0.5)
+  parser.add_argument("--frag", type=float, default=0.0)
+  parser.add_argument("--mft-fragments", type=int, default=1)
+  parser.add_argument("--cluster-size", type=int, default=4096)
+  parser.add_argument("--deleted", type=float, default=0.0)
+  parser.add_argument("--seed", type=int, default=1)
+  args = parser.parse_args()
+  root = build_tree(args.files, args.depth, args.fanout, args.min_size, args.max_size, args.long_names, args.deleted, args.seed)
+  if args.fs == "fat32":
+    make_fat32(args.output, root, args.cluster_size, frag=args.frag, seed=args.seed)
+  else:
+    make_ntfs(args.output, root, args.cluster_size, frag=args.frag, mft_fragments=args.mft_fragments, seed=args.seed)
+
+if __name__ == "__main__":
+  main()
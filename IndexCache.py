@@ -0,0 +1,88 @@
+import json
+import os
+import re
+import sys
+from array import array
+from BlockDevice import BlockDevice
+
+MAGIC = b"SHELBYIX"
+VERSION = 1
+
+def cache_path(dev: BlockDevice) -> str:
+  # Next to image files, in the user's cache directory for drives and raw devices
+  if os.path.isfile(dev.path):
+    return dev.path + ".shelby-cache"
+  cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "shelby")
+  return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", dev.path) + ".shelby-cache")
+
+def file_stamp(dev: BlockDevice) -> 'list[int]':
+  # Size and mtime of image files, raw devices rely on the metadata fingerprint alone
+  if not os.path.isfile(dev.path):
+    return []
+  st = os.stat(dev.path)
+  return [st.st_size, st.st_mtime_ns]
+
+def save(path: str, key: dict, columns: dict) -> bool:
+  layout = []
+  blobs = []
+  for name, column in columns.items():
+    typecode = column.typecode if isinstance(column, array) else ""
+    blob = column.tobytes() if isinstance(column, array) else bytes(column)
+    layout.append([name, typecode, len(blob)])
+    blobs.append(blob)
+  header = json.dumps({"version": VERSION, "byteorder": sys.byteorder, "key": key, "columns": layout}).encode()
+  try:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+      f.write(MAGIC)
+      f.write(len(header).to_bytes(4, byteorder='little'))
+      f.write(header)
+      for blob in blobs:
+        f.write(blob)
+    os.replace(tmp, path)
+    return True
+  except OSError as e:
+    print(f"[WARNING] Could not write index cache: {e}")
+    return False
+
+def load(path: str, key: dict, on_disk: 'tuple[str, ...]' = ()) -> dict:
+  '''
+  Return the cached columns, or None when the cache is missing or stale.
+  Columns named in on_disk are left in the file, their (offset, size) is returned instead
+  '''
+  try:
+    with open(path, 'rb') as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        return None
+      header = json.loads(f.read(int.from_bytes(f.read(4), byteorder='little')))
+      if header["version"] != VERSION or header["byteorder"] != sys.byteorder or header["key"] != key:
+        return None
+      columns = {}
+      for name, typecode, size in header["columns"]:
+        if name in on_disk:
+          columns[name] = (f.tell(), size)
+          f.seek(size, os.SEEK_CUR)
+          continue
+        blob = f.read(size)
+        if len(blob) != size:
+          return None
+        if typecode:
+          columns[name] = array(typecode)
+          columns[name].frombytes(blob)
+        else:
+          columns[name] = blob
+      if f.tell() > os.fstat(f.fileno()).st_size:
+        return None
+      return columns
+  except (OSError, ValueError, KeyError):
+    return None
+
+def read(path: str, offset: int, size: int) -> bytes:
+  # A piece of a column load left on disk
+  with open(path, 'rb') as f:
+    f.seek(offset)
+    data = f.read(size)
+  if len(data) != size:
+    raise Exception("Index cache is truncated")
+  return data
@@ -1,6 +1,20 @@
+import os
 import re
+import sys
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from enum import Flag, auto
 from datetime import datetime
+from array import array
+from bisect import bisect_right
+from typing import Union
+from BlockDevice import BlockDevice
+from DirEntry import DeletedEntry, DirEntry, join_path
+from Find import FindFilter, TrigramIndex, to_filetime
+from VolumeFile import VolumeFile
+import IndexCache
 class NTFSAttribute(Flag):
     READ_ONLY = auto()
     HIDDEN = auto()
@@ -21,12 +35,164 @@ class NTFSAttribute(Flag):
 def as_datetime(timestamp):
   return datetime.fromtimestamp((timestamp - 116444736000000000) // 10000000)
 
+def apply_fixup(buf, start: int, size: int) -> bool:
+  # Restore the last two bytes of every 512-byte stride from the update sequence array
+  usa_offset = int.from_bytes(buf[start + 4:start + 6], byteorder='little')
+  usa_count = int.from_bytes(buf[start + 6:start + 8], byteorder='little')
+  usn = buf[start + usa_offset:start + usa_offset + 2]
+  for i in range(1, usa_count):
+    end = start + i * 512
+    if end > start + size or buf[end - 2:end] != usn:
+      return False
+    entry = start + usa_offset + 2 * i
+    buf[end - 2:end] = buf[entry:entry + 2]
+  return True
+
+def read_mft_extent(dev: BlockDevice, offset: int, size: int, record_size: int) -> memoryview:
+  buf = bytearray(size)
+  if offset is not None:
+    dev.readinto(offset, buf)
+  view = memoryview(buf)
+  for rec in range(0, size, record_size):
+    if view[rec:rec + 4] == b"FILE":
+      apply_fixup(view, rec, record_size)
+  return view
+
+def parse_mft_records(chunk, record_size: int) -> 'list[tuple]':
+  rows = []
+  for off in range(0, len(chunk), record_size):
+    if chunk[off:off + 4] == b"FILE":
+      try:
+        rows.append(MFTRecord(chunk[off:off + record_size]).summary())
+      except Exception as e:
+        pass
+  return rows
+
+def find_attribute(buf, attr_type: int, name: str = "") -> int:
+  # Offset of the first attribute of that type and name in a fixed-up record, -1 if absent
+  pos = int.from_bytes(buf[0x14:0x16], byteorder='little')
+  while pos + 8 <= len(buf):
+    current = int.from_bytes(buf[pos:pos + 4], byteorder='little')
+    size = int.from_bytes(buf[pos + 4:pos + 8], byteorder='little')
+    if current == 0xFFFFFFFF or size == 0:
+      break
+    if current == attr_type:
+      name_length = buf[pos + 9]
+      name_offset = int.from_bytes(buf[pos + 0xA:pos + 0xC], byteorder='little')
+      if str(buf[pos + name_offset:pos + name_offset + 2 * name_length], 'utf-16le') == name:
+        return pos
+    pos += size
+  return -1
+
+def iter_index_node(buf, node: int):
+  '''
+  Yield (file reference, key, subnode VCN or None, last) for the entries of an index node header at node
+  '''
+  pos = node + int.from_bytes(buf[node:node + 4], byteorder='little')
+  end = node + int.from_bytes(buf[node + 4:node + 8], byteorder='little')
+  while pos + 0x10 <= min(end, len(buf)):
+    length = int.from_bytes(buf[pos + 8:pos + 0xA], byteorder='little')
+    key_length = int.from_bytes(buf[pos + 0xA:pos + 0xC], byteorder='little')
+    flags = int.from_bytes(buf[pos + 0xC:pos + 0x10], byteorder='little')
+    if length < 0x10:
+      break
+    subnode = int.from_bytes(buf[pos + length - 8:pos + length], byteorder='little', signed=True) if flags & 1 else None
+    ref = int.from_bytes(buf[pos:pos + 6], byteorder='little')
+    yield ref, bytes(buf[pos + 0x10:pos + 0x10 + key_length]), subnode, bool(flags & 2)
+    if flags & 2:
+      break
+    pos += length
+
+worker_devices: 'dict[str, BlockDevice]' = {}
+
+def parse_mft_extent(path: str, offset: int, size: int, record_size: int) -> 'list[tuple]':
+  # Runs in a worker process, each worker maps the device once
+  dev = worker_devices.get(path)
+  if dev is None:
+    dev = worker_devices[path] = BlockDevice(path)
+  return parse_mft_records(read_mft_extent(dev, offset, size, record_size), record_size)
+
+class RunList:
+  def __init__(self, raw=b"") -> None:
+    # Parallel VCN -> LCN table, LCN -1 marks a sparse run
+    self.vcns = array('q')
+    self.lcns = array('q')
+    self.lengths = array('q')
+    vcn = 0
+    lcn = 0
+    pos = 0
+    while pos < len(raw) and raw[pos] != 0:
+      length_size = raw[pos] & 0x0F
+      offset_size = (raw[pos] & 0xF0) >> 4
+      pos += 1
+      length = int.from_bytes(raw[pos:pos + length_size], byteorder='little')
+      pos += length_size
+      self.vcns.append(vcn)
+      self.lengths.append(length)
+      if offset_size:
+        lcn += int.from_bytes(raw[pos:pos + offset_size], byteorder='little', signed=True)
+        self.lcns.append(lcn)
+      else:
+        self.lcns.append(-1)
+      pos += offset_size
+      vcn += length
+
+  def __len__(self) -> int:
+    return len(self.vcns)
+
+  def __iter__(self):
+    for i in range(len(self.vcns)):
+      yield self.vcns[i], self.lcns[i] if self.lcns[i] >= 0 else None, self.lengths[i]
+
+  def total_clusters(self) -> int:
+    return sum(self.lengths)
+
+  def first_lcn(self) -> int:
+    for lcn in self.lcns:
+      if lcn >= 0:
+        return lcn
+    return 0
+
+  def lookup(self, vcn: int) -> int:
+    # Index of the run holding vcn, -1 past the end
+    i = bisect_right(self.vcns, vcn) - 1
+    if i < 0 or vcn >= self.vcns[i] + self.lengths[i]:
+      return -1
+    return i
+
+class NTFSFile(VolumeFile):
+  def __init__(self, dev: BlockDevice, runs: RunList, size: int, cluster_size: int) -> None:
+    super().__init__(dev, size, cluster_size)
+    self.runs = runs
+
+  def locate(self, vcn: int) -> 'tuple[int, int]':
+    i = self.runs.lookup(vcn)
+    if i < 0:
+      return None, 0
+    skip = vcn - self.runs.vcns[i]
+    left = self.runs.lengths[i] - skip
+    if self.runs.lcns[i] < 0:
+      return None, left
+    return (self.runs.lcns[i] + skip) * self.cluster_size, left
+
+class ResidentFile(VolumeFile):
+  def __init__(self, content: bytes) -> None:
+    super().__init__(None, len(content), 1)
+    self.content = content
+
+  def readinto(self, b) -> int:
+    data = self.content[self.pos:self.pos + len(b)]
+    memoryview(b).cast('B')[:len(data)] = data
+    self.pos += len(data)
+    return len(data)
+
 class MFTRecord:
-  def __init__(self, data) -> None:
+  def __init__(self, data, deleted: bool = False) -> None:
+    # deleted: parse records no longer in use instead of skipping them
     self.raw_data = data
     self.file_id = int.from_bytes(self.raw_data[0x2C:0x30], byteorder='little')
     self.flag = self.raw_data[0x16]
-    if self.flag == 0 or self.flag == 2:
+    if (self.flag == 0 or self.flag == 2) and not deleted:
       # Deleted record
       raise Exception("Skip this record")
     standard_info_start = int.from_bytes(self.raw_data[0x14:0x16], byteorder='little')
@@ -39,10 +205,17 @@ class MFTRecord:
     self.__parse_file_name(file_name_start)
     data_start = file_name_start + file_name_size
     data_sig = self.raw_data[data_start:data_start + 4]
-    if data_sig[0] == 64:
-      data_start += int.from_bytes(self.raw_data[data_start + 4:data_start + 8], byteorder='little')
-    
-    data_sig = self.raw_data[data_start:data_start + 4]
+    # Skip extra names, object id, security descriptor... up to $DATA / $INDEX_ROOT
+    while int.from_bytes(data_sig, byteorder='little') < 0x80:
+      attr_size = int.from_bytes(self.raw_data[data_start + 4:data_start + 8], byteorder='little')
+      if attr_size == 0:
+        break
+      if data_sig[0] == 0x30 and self.file_name["namespace"] == 2:
+        # The DOS 8.3 alias came first, the long name is in a later $FILE_NAME
+        self.__parse_file_name(data_start)
+      data_start += attr_size
+      data_sig = self.raw_data[data_start:data_start + 4]
+
     self.data = {}
     if data_sig[0] == 128:
       self.__parse_data(data_start)
@@ -50,48 +223,33 @@ class MFTRecord:
       self.standard_info['flags'] |= NTFSAttribute.DIRECTORY
       self.data['size'] = 0
       self.data['resident'] = True
-    self.childs: list[MFTRecord] = []
 
     del self.raw_data
 
+  def summary(self) -> tuple:
+    # Compact row shipped (possibly from a worker process) into the FileTable
+    return (self.file_id, self.file_name['parent_id'], self.standard_info['flags'].value,
+            self.data.get('size', 0), self.standard_info['created_time'], self.standard_info['last_modified_time'],
+            self.data.get('cluster_offset', 0), self.data.get('resident', True), self.file_name['long_name'],
+            self.data.get('runs_raw', b""))
+
   def is_directory(self):
     return NTFSAttribute.DIRECTORY in self.standard_info['flags']
   
-  def is_leaf(self):
-    return not len(self.childs)
-
-  def is_active_record(self):
-    flags = self.standard_info['flags']
-    if NTFSAttribute.SYSTEM in flags or NTFSAttribute.HIDDEN in flags:
-      return False
-    return True
-  
-  def find_record(self, name: str):
-    for record in self.childs:
-      if record.file_name['long_name'] == name:
-        return record
-    return None
-  
-  def get_active_records(self) -> 'list[MFTRecord]':
-    record_list: list[MFTRecord] = []
-    for record in self.childs:
-      if record.is_active_record():
-        record_list.append(record)
-    return record_list
-  
   def __parse_data(self, start):
     self.data['resident'] = not bool(self.raw_data[start+0x8])
     if self.data['resident']:
       offset = int.from_bytes(self.raw_data[start + 0x14:start + 0x16], byteorder='little')
       self.data['size'] = int.from_bytes(self.raw_data[start+0x10:start+0x14], byteorder='little')
-      self.data['content'] = self.raw_data[start + offset:start + offset + self.data['size']]
+      self.data['content'] = bytes(self.raw_data[start + offset:start + offset + self.data['size']])
     else:
-      cluster_chain = self.raw_data[start + 0x40]
-      offset = (cluster_chain & 0xF0) >> 4
-      size = cluster_chain & 0x0F
+      length = int.from_bytes(self.raw_data[start + 0x4:start + 0x8], byteorder='little')
+      run_offset = int.from_bytes(self.raw_data[start + 0x20:start + 0x22], byteorder='little')
       self.data['size'] = int.from_bytes(self.raw_data[start + 0x30: start + 0x38], byteorder='little')
-      self.data['cluster_size'] = int.from_bytes(self.raw_data[start + 0x41: start + 0x41 + size], byteorder='little')
-      self.data['cluster_offset'] =  int.from_bytes(self.raw_data[start + 0x41 + size: start + 0x41 + size + offset], byteorder='little')
+      self.data['runs_raw'] = bytes(self.raw_data[start + run_offset:start + length])
+      self.data['runs'] = RunList(self.data['runs_raw'])
+      self.data['cluster_size'] = self.data['runs'].total_clusters()
+      self.data['cluster_offset'] = self.data['runs'].first_lcn()
 
 
   def __parse_file_name(self, start):
@@ -106,7 +264,8 @@ class MFTRecord:
     
     self.file_name["parent_id"] = int.from_bytes(body[:6], byteorder='little')
     name_length = body[64]
-    self.file_name["long_name"] = body[66:66 + name_length * 2].decode('utf-16le')  # unicode
+    self.file_name["namespace"] = body[65]
+    self.file_name["long_name"] = str(body[66:66 + name_length * 2], 'utf-16le')  # unicode
 
   def __parse_standard_info(self, start):
     sig = int.from_bytes(self.raw_data[start:start + 4], byteorder='little')
@@ -114,52 +273,367 @@ class MFTRecord:
       raise Exception("Something Wrong!")
     offset = int.from_bytes(self.raw_data[start + 20:start + 21], byteorder='little')
     begin = start + offset
-    self.standard_info["created_time"] = as_datetime(int.from_bytes(self.raw_data[begin:begin + 8], byteorder='little'))
-    self.standard_info["last_modified_time"] = as_datetime(int.from_bytes(self.raw_data[begin + 8:begin + 16], byteorder='little'))
+    # Raw FILETIME values, converted with as_datetime when displayed
+    self.standard_info["created_time"] = int.from_bytes(self.raw_data[begin:begin + 8], byteorder='little')
+    self.standard_info["last_modified_time"] = int.from_bytes(self.raw_data[begin + 8:begin + 16], byteorder='little')
     self.standard_info["flags"] = NTFSAttribute(int.from_bytes(self.raw_data[begin + 32:begin + 36], byteorder='little') & 0xFFFF)
 
 
+class FileTable:
+  '''
+  Columnar store of every in-use MFT record, row number = MFT record number
+  '''
+  def __init__(self, capacity: int) -> None:
+    self.in_use = bytearray(capacity)
+    self.resident = bytearray(capacity)
+    self.parents = array('I', bytes(4 * capacity))
+    self.flags = array('I', bytes(4 * capacity))
+    self.sizes = array('Q', bytes(8 * capacity))
+    self.created = array('q', bytes(8 * capacity))
+    self.modified = array('q', bytes(8 * capacity))
+    self.first_lcn = array('q', bytes(8 * capacity))
+    # Names live in one string pool, runlists in one raw byte pool
+    self.name_start = array('Q', bytes(8 * capacity))
+    self.name_length = array('H', bytes(2 * capacity))
+    self.name_parts: list[str] = []
+    self.name_total = 0
+    self.names = ""
+    self.run_start = array('Q', bytes(8 * capacity))
+    self.run_length = array('H', bytes(2 * capacity))
+    self.runs = bytearray()
+    self.child_start = array('I')
+    self.child_ids = array('I')
+    self.root_id = None
+    # Code point -> upper case code point from $UpCase, None falls back to str.upper
+    self.upcase: dict[int, int] = None
+    # Per directory map of folded child name -> record number, built on the first lookup
+    self.child_index: dict[int, dict[str, int]] = {}
+
+  def __len__(self) -> int:
+    return len(self.in_use)
+
+  def __grow(self, size: int):
+    extra = size - len(self.in_use)
+    for column in (self.in_use, self.resident):
+      column.extend(bytes(extra))
+    for column in (self.parents, self.flags, self.sizes, self.created, self.modified,
+                   self.first_lcn, self.name_start, self.name_length, self.run_start, self.run_length):
+      column.frombytes(bytes(column.itemsize * extra))
+
+  def add(self, row: tuple):
+    file_id, parent_id, flags, size, created, modified, first_lcn, resident, name, runs = row
+    if file_id >= len(self.in_use):
+      self.__grow(file_id + 1)
+    self.in_use[file_id] = 1
+    self.resident[file_id] = resident
+    self.parents[file_id] = parent_id
+    self.flags[file_id] = flags
+    self.sizes[file_id] = size
+    self.created[file_id] = created
+    self.modified[file_id] = modified
+    self.first_lcn[file_id] = first_lcn
+    self.name_start[file_id] = self.name_total
+    self.name_length[file_id] = len(name)
+    self.name_parts.append(name)
+    self.name_total += len(name)
+    self.child_index.pop(parent_id, None)
+    self.run_start[file_id] = len(self.runs)
+    self.run_length[file_id] = len(runs)
+    self.runs += runs
+
+  def finish(self):
+    self.names = "".join(self.name_parts)
+    self.name_parts = []
+    self.__link()
+    if len(self.in_use) > 5 and self.in_use[5] and self.parents[5] == 5:
+      self.root_id = 5
+    else:
+      for i in range(len(self.in_use)):
+        if self.in_use[i] and self.parents[i] == i:
+          self.root_id = i
+          break
+
+  def __link(self):
+    # Group children by parent (counting sort), child_start[i]:child_start[i + 1] spans record i
+    n = len(self.in_use)
+    in_use = self.in_use
+    parents = self.parents
+    counts = array('I', bytes(4 * (n + 1)))
+    for i in range(n):
+      if in_use[i]:
+        p = parents[i]
+        if p != i and p < n and in_use[p]:
+          counts[p + 1] += 1
+    for i in range(n):
+      counts[i + 1] += counts[i]
+    fill = array('I', counts)
+    child_ids = array('I', bytes(4 * counts[n]))
+    for i in range(n):
+      if in_use[i]:
+        p = parents[i]
+        if p != i and p < n and in_use[p]:
+          child_ids[fill[p]] = i
+          fill[p] += 1
+    self.child_start = counts
+    self.child_ids = child_ids
+    self.invalidate_index()
+
+  def get_name(self, file_id: int) -> str:
+    start = self.name_start[file_id]
+    return self.names[start:start + self.name_length[file_id]]
+
+  def get_runs(self, file_id: int) -> RunList:
+    start = self.run_start[file_id]
+    return RunList(self.runs[start:start + self.run_length[file_id]])
+
+  def get_children(self, file_id: int) -> array:
+    return self.child_ids[self.child_start[file_id]:self.child_start[file_id + 1]]
+
+  def ensure(self, file_id: int):
+    # Every row is complete once the table is built, see LazyFileTable
+    pass
+
+  def is_loaded(self, file_id: int) -> bool:
+    return True
+
+  def set_upcase(self, upcase: 'dict[int, int]'):
+    self.upcase = upcase
+    self.invalidate_index()
+
+  def fold(self, name: str) -> str:
+    if self.upcase is None:
+      return name.upper()
+    return name.translate(self.upcase)
+
+  def find_child(self, file_id: int, name: str) -> int:
+    # Case-insensitive like Windows, -1 when there is no such child
+    index = self.child_index.get(file_id)
+    if index is None:
+      index = self.child_index[file_id] = {}
+      for i in self.get_children(file_id):
+        index.setdefault(self.fold(self.get_name(i)), i)
+    return index.get(self.fold(name), -1)
+
+  def invalidate_index(self, file_id: int = None):
+    if file_id is None:
+      self.child_index.clear()
+    else:
+      self.child_index.pop(file_id, None)
+
+  def to_columns(self) -> dict:
+    return {
+      "in_use": self.in_use, "resident": self.resident, "parents": self.parents, "flags": self.flags,
+      "sizes": self.sizes, "created": self.created, "modified": self.modified, "first_lcn": self.first_lcn,
+      "name_start": self.name_start, "name_length": self.name_length,
+      "names": self.names.encode('utf-8', 'surrogatepass'),
+      "run_start": self.run_start, "run_length": self.run_length, "runs": self.runs,
+      "child_start": self.child_start, "child_ids": self.child_ids,
+      "root_id": array('q', [-1 if self.root_id is None else self.root_id]),
+    }
+
+  @staticmethod
+  def from_columns(columns: dict) -> 'FileTable':
+    table = FileTable(0)
+    for name in ("parents", "flags", "sizes", "created", "modified", "first_lcn", "name_start",
+                 "name_length", "run_start", "run_length", "child_start", "child_ids"):
+      setattr(table, name, columns[name])
+    table.in_use = bytearray(columns["in_use"])
+    table.resident = bytearray(columns["resident"])
+    table.runs = bytearray(columns["runs"])
+    table.names = str(columns["names"], 'utf-8', 'surrogatepass')
+    table.root_id = None if columns["root_id"][0] < 0 else columns["root_id"][0]
+    return table
+
+class LazyFileTable(FileTable):
+  '''
+  FileTable filled on demand: rows of a directory's children come from its $I30
+  index entries when it is first listed, the MFT record itself is only parsed
+  when its data (residency, runlist) is needed
+  '''
+  def __init__(self, volume: 'NTFS', capacity: int) -> None:
+    super().__init__(0)
+    self.volume = volume
+    self.capacity = capacity
+    # Sparse columns, memory grows with what was visited instead of the MFT size
+    for column in ("in_use", "resident", "parents", "flags", "sizes", "created", "modified", "first_lcn"):
+      setattr(self, column, defaultdict(int))
+    self.loaded: set[int] = set()
+    self.listed: dict[int, array] = {}
+    self.lazy_names: dict[int, str] = {}
+    self.lazy_runs: dict[int, bytes] = {}
+    self.root_id = 5
+    self.ensure(5)
+    if not self.in_use[5]:
+      raise Exception("Cannot read the root directory record")
+
+  def __len__(self) -> int:
+    return self.capacity
+
+  def add(self, row: tuple):
+    file_id, parent_id, flags, size, created, modified, first_lcn, resident, name, runs = row
+    if file_id in self.lazy_names:
+      # Already listed: the index entry names the link the path went through, the record may
+      # hold another hard link first
+      name = self.lazy_names[file_id]
+      parent_id = self.parents[file_id]
+    else:
+      self.invalidate_index(parent_id)
+    self.in_use[file_id] = 1
+    self.resident[file_id] = resident
+    self.parents[file_id] = parent_id
+    self.flags[file_id] = flags
+    self.sizes[file_id] = size
+    self.created[file_id] = created
+    self.modified[file_id] = modified
+    self.first_lcn[file_id] = first_lcn
+    self.lazy_names[file_id] = name
+    self.lazy_runs[file_id] = runs
+
+  def finish(self):
+    pass
+
+  def ensure(self, file_id: int):
+    if file_id in self.loaded:
+      return
+    self.loaded.add(file_id)
+    try:
+      self.add(self.volume.read_record(file_id).summary())
+    except Exception:
+      # Deleted or unreadable, keep what the index entry said
+      pass
+
+  def is_loaded(self, file_id: int) -> bool:
+    return file_id in self.loaded
+
+  def get_name(self, file_id: int) -> str:
+    return self.lazy_names.get(file_id, "")
+
+  def get_runs(self, file_id: int) -> RunList:
+    self.ensure(file_id)
+    return RunList(self.lazy_runs.get(file_id, b""))
+
+  def get_children(self, file_id: int) -> array:
+    children = self.listed.get(file_id)
+    if children is not None:
+      return children
+    children = array('I')
+    for ref, key, _, _ in self.volume.read_index(file_id):
+      # Key is a copy of the child's $FILE_NAME, skip the extra DOS 8.3 names
+      if len(key) < 0x42 or key[0x41] == 2 or ref == file_id:
+        continue
+      if ref not in self.loaded:
+        fn_flags = int.from_bytes(key[0x38:0x3C], byteorder='little')
+        self.in_use[ref] = 1
+        self.parents[ref] = file_id
+        self.flags[ref] = (fn_flags & 0xFFFF) | (NTFSAttribute.DIRECTORY.value if fn_flags & 0x10000000 else 0)
+        # Windows does not always update the key on writes, the size from the record replaces it once loaded
+        self.sizes[ref] = int.from_bytes(key[0x30:0x38], byteorder='little')
+        self.created[ref] = int.from_bytes(key[0x08:0x10], byteorder='little')
+        self.modified[ref] = int.from_bytes(key[0x10:0x18], byteorder='little')
+        self.lazy_names[ref] = str(key[0x42:0x42 + 2 * key[0x40]], 'utf-16le')
+      children.append(ref)
+    self.listed[file_id] = children
+    self.invalidate_index(file_id)
+    return children
+
+  def to_columns(self) -> dict:
+    raise Exception("A lazily loaded file table cannot be cached")
+
+class FileRecord:
+  '''
+  Lightweight view of one row of the FileTable
+  '''
+  __slots__ = ("table", "file_id")
+
+  def __init__(self, table: FileTable, file_id: int) -> None:
+    self.table = table
+    self.file_id = file_id
+
+  @property
+  def name(self) -> str:
+    return self.table.get_name(self.file_id)
+
+  @property
+  def parent_id(self) -> int:
+    return self.table.parents[self.file_id]
+
+  @property
+  def flags(self) -> NTFSAttribute:
+    return NTFSAttribute(self.table.flags[self.file_id])
+
+  @property
+  def size(self) -> int:
+    return self.table.sizes[self.file_id]
+
+  @property
+  def created_time(self) -> datetime:
+    return as_datetime(self.table.created[self.file_id])
+
+  @property
+  def last_modified_time(self) -> datetime:
+    return as_datetime(self.table.modified[self.file_id])
+
+  @property
+  def first_lcn(self) -> int:
+    self.table.ensure(self.file_id)
+    return self.table.first_lcn[self.file_id]
+
+  @property
+  def resident(self) -> bool:
+    self.table.ensure(self.file_id)
+    return bool(self.table.resident[self.file_id])
+
+  @property
+  def childs(self) -> 'list[FileRecord]':
+    return [FileRecord(self.table, i) for i in self.table.get_children(self.file_id)]
+
+  def runs(self) -> RunList:
+    return self.table.get_runs(self.file_id)
+
+  def is_directory(self):
+    return bool(self.table.flags[self.file_id] & NTFSAttribute.DIRECTORY.value)
+
+  def is_leaf(self):
+    return len(self.table.get_children(self.file_id)) == 0
+
+  def is_loaded(self) -> bool:
+    return self.table.is_loaded(self.file_id)
+
+  def is_active_record(self):
+    if self.table.flags[self.file_id] & (NTFSAttribute.SYSTEM.value | NTFSAttribute.HIDDEN.value):
+      return False
+    return True
+
+  def find_record(self, name: str):
+    i = self.table.find_child(self.file_id, name)
+    if i < 0:
+      return None
+    return FileRecord(self.table, i)
+
+  def get_active_records(self) -> 'list[FileRecord]':
+    record_list: list[FileRecord] = []
+    for record in self.childs:
+      if record.is_active_record():
+        record_list.append(record)
+    return record_list
+
 class DirectoryTree:
-  def __init__(self, nodes: 'list[MFTRecord]') -> None:
+  def __init__(self, table: FileTable) -> None:
+    self.table = table
     self.root = None
-    self.nodes_dict: dict[int, MFTRecord] = {}
-    for node in nodes:
-      self.nodes_dict[node.file_id] = node
-
-    for key in self.nodes_dict:
-      parent_id = self.nodes_dict[key].file_name['parent_id']
-      if parent_id in self.nodes_dict:
-        self.nodes_dict[parent_id].childs.append(self.nodes_dict[key])
-
-    for key in self.nodes_dict:
-      parent_id = self.nodes_dict[key].file_name['parent_id']
-      if parent_id == self.nodes_dict[key].file_id:
-        self.root = self.nodes_dict[key]
-        break
-    
+    if table.root_id is not None:
+      self.root = FileRecord(table, table.root_id)
     self.current_dir = self.root
 
   def find_record(self, name: str):
     return self.current_dir.find_record(name)
   
-  def get_parent_record(self, record: MFTRecord):
-    return self.nodes_dict[record.file_name['parent_id']]
+  def get_parent_record(self, record: FileRecord):
+    return FileRecord(self.table, record.parent_id)
 
-  def get_active_records(self) -> 'list[MFTRecord]':
+  def get_active_records(self) -> 'list[FileRecord]':
     return self.current_dir.get_active_records()
 
-class MFTFile:
-  def __init__(self, data: bytes) -> None:
-    self.raw_data = data
-    self.info_offset = int.from_bytes(self.raw_data[0x14:0x16], byteorder='little')
-    self.info_len = int.from_bytes(self.raw_data[0x3C:0x40], byteorder='little')
-    self.file_name_offset = self.info_offset + self.info_len
-    self.file_name_len = int.from_bytes(self.raw_data[0x9C:0xA0], byteorder='little')
-    self.data_offset = self.file_name_offset + self.file_name_len
-    self.data_len = int.from_bytes(self.raw_data[0x104:0x108], byteorder='little')
-    self.num_sector = (int.from_bytes(self.raw_data[0x118:0x120], byteorder='little') + 1) * 8
-    del self.raw_data
-
 class NTFS:
   important_info = [
     "OEM_ID",
@@ -172,11 +646,18 @@ class NTFS:
     "First Cluster of $MFTMirr",
     "MFT record size"
   ]
-  def __init__(self, name: str) -> None:
-    self.name = name
-    self.cwd = [self.name]
+  def __init__(self, name: Union[str, BlockDevice], workers: int = None, use_cache: bool = True, lazy: bool = False) -> None:
+    # workers: processes used to parse the MFT, 0 or 1 parses serially
+    # use_cache: reuse the parsed file table saved by a previous run when the volume is unchanged
+    # lazy: skip the MFT scan, directories are read from their $I30 index when visited
+    self.lazy = lazy
+    self.workers = (os.cpu_count() or 1) if workers is None else workers
+    # Trigram index over the names of the file table, built by the first indexed find
+    self.name_index: TrigramIndex = None
     try:
-      self.fd = open(r'\\.\%s' % self.name, 'rb')
+      self.dev = name if isinstance(name, BlockDevice) else BlockDevice(name)
+      self.name = self.dev.name
+      self.cwd = [self.name]
     except FileNotFoundError:
       print(f"[ERROR] No volume named {name}")
       exit()
@@ -189,13 +670,13 @@ class NTFS:
       exit()
 
     try:
-      self.boot_sector_raw = self.fd.read(0x200)
+      self.boot_sector_raw = self.dev.read(0, 0x200)
       self.boot_sector = {}
       self.__extract_boot_sector()
 
       if self.boot_sector["OEM_ID"] != b'NTFS    ':
         raise Exception("Not NTFS")
-      self.boot_sector["OEM_ID"] = self.boot_sector["OEM_ID"].decode()
+      self.boot_sector["OEM_ID"] = bytes(self.boot_sector["OEM_ID"]).decode()
       self.boot_sector['Serial Number'] = hex(self.boot_sector['Serial Number'] & 0xFFFFFFFF)[2:].upper()
       self.boot_sector['Serial Number'] = self.boot_sector['Serial Number'][:4] + "-" + self.boot_sector['Serial Number'][4:]
       self.SC = self.boot_sector["Sectors Per Cluster"]
@@ -203,30 +684,188 @@ class NTFS:
 
       self.record_size = self.boot_sector["MFT record size"]
       self.mft_offset = self.boot_sector['First Cluster of $MFT']
-      self.fd.seek(self.mft_offset * self.SC * self.BS)
-      self.mft_file = MFTFile(self.fd.read(self.record_size))
-      mft_record: list[MFTRecord] = []
-      for _ in range(2, self.mft_file.num_sector, 2):
-        dat = self.fd.read(self.record_size)
-        if dat[:4] == b"FILE":
-          try:
-            mft_record.append(MFTRecord(dat))
-          except Exception as e:
-            pass
-  
-      self.dir_tree = DirectoryTree(mft_record)
+      # $MFT describes itself, its runlist tells where the rest of the table lives
+      mft_head = bytearray(self.record_size)
+      self.dev.readinto(self.mft_offset * self.SC * self.BS, mft_head)
+      if mft_head[:4] != b"FILE" or not apply_fixup(mft_head, 0, self.record_size):
+        raise Exception("Corrupted $MFT record")
+      self.mft_file = MFTRecord(mft_head)
+      if lazy:
+        self.dir_tree = DirectoryTree(LazyFileTable(self, self.mft_file.data['size'] // self.record_size))
+      else:
+        self.dir_tree = DirectoryTree(self.__open_file_table(use_cache))
+      self.dir_tree.table.set_upcase(self.__load_upcase())
     except Exception as e:
       print(f"[ERROR] {e}")
       exit()
 
+  def iter_mft_extents(self, chunk_size: int = 4 << 20):
+    '''
+    Yield (first record number, device offset, size) pieces of $MFT following every run
+    '''
+    cluster_size = self.SC * self.BS
+    chunk_size -= chunk_size % self.record_size
+    size_left = self.mft_file.data['size']
+    record_number = 0
+    for _, lcn, length in self.mft_file.data['runs']:
+      run_size = min(length * cluster_size, size_left)
+      size_left -= run_size
+      for off in range(0, run_size, chunk_size):
+        size = min(chunk_size, run_size - off)
+        yield record_number, None if lcn is None else lcn * cluster_size + off, size
+        record_number += size // self.record_size
+      if size_left <= 0:
+        break
+
+  def iter_mft_chunks(self, chunk_size: int = 4 << 20):
+    '''
+    Yield (first record number, fixed-up records) following every run of $MFT
+    '''
+    for first, offset, size in self.iter_mft_extents(chunk_size):
+      yield first, read_mft_extent(self.dev, offset, size, self.record_size)
+
+  def __load_file_table(self) -> FileTable:
+    table = FileTable(self.mft_file.data['size'] // self.record_size)
+    extents = [(offset, size) for _, offset, size in self.iter_mft_extents() if offset is not None]
+    if self.workers > 1 and len(extents) > 1:
+      try:
+        with ProcessPoolExecutor(min(self.workers, len(extents))) as pool:
+          offsets, sizes = zip(*extents)
+          for records in pool.map(parse_mft_extent, repeat(self.dev.path), offsets, sizes, repeat(self.record_size)):
+            for row in records:
+              table.add(row)
+        table.finish()
+        return table
+      except Exception as e:
+        print(f"[WARNING] Parallel MFT parsing failed ({e}), parsing serially")
+        table = FileTable(self.mft_file.data['size'] // self.record_size)
+    for _, chunk in self.iter_mft_chunks():
+      for row in parse_mft_records(chunk, self.record_size):
+        table.add(row)
+    table.finish()
+    return table
+
+  def __open_file_table(self, use_cache: bool) -> FileTable:
+    # The fingerprint does not see every MFT record change, drives and raw devices have no size
+    # and mtime to catch the rest, only image files are cached
+    if not use_cache or not IndexCache.file_stamp(self.dev):
+      return self.__load_file_table()
+    key = self.__cache_key()
+    path = IndexCache.cache_path(self.dev)
+    columns = IndexCache.load(path, key)
+    if columns is not None:
+      return FileTable.from_columns(columns)
+    table = self.__load_file_table()
+    IndexCache.save(path, key, table.to_columns())
+    return table
+
+  def __cache_key(self) -> dict:
+    # The system files and the head of $LogFile change whenever the volume is written to
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(self.boot_sector_raw)
+    digest.update(self.read_raw_records(0, 16))
+    try:
+      log_lcn = self.read_record(2).data['runs'].first_lcn()
+      digest.update(self.dev.read(log_lcn * self.SC * self.BS, 8192))
+    except Exception:
+      pass
+    return {
+      "fs": "NTFS",
+      "serial": self.boot_sector['Serial Number'],
+      "geometry": [self.BS, self.SC, self.boot_sector["No. Sectors In Volume"], self.mft_offset, self.record_size],
+      "fingerprint": digest.hexdigest(),
+      "stamp": IndexCache.file_stamp(self.dev),
+    }
+
+  def __load_upcase(self) -> 'dict[int, int]':
+    # $UpCase (record 10) holds the upper case form of every UTF-16 code unit
+    try:
+      record = self.read_record(10)
+      if record.file_name['long_name'] != "$UpCase" or 'runs' not in record.data:
+        return None
+      data = NTFSFile(self.dev, record.data['runs'], record.data['size'], self.SC * self.BS).readall()
+      upcase = array('H')
+      upcase.frombytes(data[:len(data) & ~1])
+      if sys.byteorder == 'big':
+        upcase.byteswap()
+      return {i: c for i, c in enumerate(upcase) if c != i}
+    except Exception:
+      return None
+
+  def read_index(self, file_id: int) -> 'list[tuple[int, bytes, int, bool]]':
+    '''
+    Entries of the $I30 index of a directory record in B+tree (name) order, walking
+    $INDEX_ROOT and the INDX blocks of $INDEX_ALLOCATION it points to
+    '''
+    buf = self.read_raw_records(file_id)
+    if buf[:4] != b"FILE" or not apply_fixup(buf, 0, self.record_size):
+      raise Exception("Corrupted MFT record")
+    root = find_attribute(buf, 0x90, "$I30")
+    if root < 0:
+      return []
+    content = root + int.from_bytes(buf[root + 0x14:root + 0x16], byteorder='little')
+    block_size = int.from_bytes(buf[content + 8:content + 0xC], byteorder='little')
+    cluster_size = self.SC * self.BS
+    allocation = None
+    alloc = find_attribute(buf, 0xA0, "$I30")
+    if alloc >= 0:
+      length = int.from_bytes(buf[alloc + 4:alloc + 8], byteorder='little')
+      run_offset = int.from_bytes(buf[alloc + 0x20:alloc + 0x22], byteorder='little')
+      size = int.from_bytes(buf[alloc + 0x30:alloc + 0x38], byteorder='little')
+      allocation = NTFSFile(self.dev, RunList(bytes(buf[alloc + run_offset:alloc + length])), size, cluster_size)
+    # Subnode VCNs count clusters, or 512-byte units when a block is smaller than a cluster
+    vcn_size = cluster_size if block_size >= cluster_size else 512
+
+    def node_ops(node_buf, node):
+      ops = []
+      for entry in iter_index_node(node_buf, node):
+        if entry[2] is not None:
+          ops.append(entry[2])
+        if not entry[3]:
+          ops.append(entry)
+      return ops
+
+    entries = []
+    visited = set()
+    stack = node_ops(buf, content + 0x10)[::-1]
+    while stack:
+      op = stack.pop()
+      if not isinstance(op, int):
+        entries.append(op)
+        continue
+      # In-order walk: a subnode is expanded right where it sits between two keys
+      if allocation is None or op in visited:
+        continue
+      visited.add(op)
+      block = bytearray(block_size)
+      allocation.seek(op * vcn_size)
+      if allocation.readinto(block) != block_size or block[:4] != b"INDX" or not apply_fixup(block, 0, block_size):
+        continue
+      stack.extend(node_ops(block, 0x18)[::-1])
+    return entries
+
+  def read_raw_records(self, file_id: int, count: int = 1) -> bytearray:
+    mft = NTFSFile(self.dev, self.mft_file.data['runs'], self.mft_file.data['size'], self.SC * self.BS)
+    mft.seek(file_id * self.record_size)
+    buf = bytearray(count * self.record_size)
+    del buf[mft.readinto(buf):]
+    return buf
+
+  def read_record(self, file_id: int) -> MFTRecord:
+    buf = self.read_raw_records(file_id)
+    if buf[:4] != b"FILE" or not apply_fixup(buf, 0, self.record_size):
+      raise Exception("Corrupted MFT record")
+    return MFTRecord(buf)
+
   @staticmethod
   def check_ntfs(name: str):
     try:
-      with open(r'\\.\%s' % name, 'rb') as fd:
-        oem_id = fd.read(0xB)[3:]
-        if oem_id == b'NTFS    ':
-          return True
-        return False
+      dev = BlockDevice(name)
+      oem_id = bytes(dev.read(3, 8))
+      dev.close()
+      if oem_id == b'NTFS    ':
+        return True
+      return False
     except Exception as e:
       print(f"[ERROR] {e}")
       exit()
@@ -255,7 +894,7 @@ class NTFS:
     dirs = re.sub(r"[/\\]+", r"\\", path).strip("\\").split("\\")
     return dirs
   
-  def visit_dir(self, path) -> MFTRecord:
+  def visit_dir(self, path) -> FileRecord:
     if path == "":
       raise Exception("Directory name is required!")
     path = self.__parse_path(path)
@@ -280,6 +919,170 @@ class NTFS:
         raise Exception("Not a directory")
     return cur_dir
 
+  def walk(self, path: str = "", max_depth: int = None):
+    '''
+    Yield (dirpath, entries) for path and every directory below it, depth first
+    in listing order, entries are DirEntry rows.
+    Removing directories from entries before resuming prunes them like os.walk.
+    Subdirectories of a level >= max_depth are not listed. The cwd is left alone.
+    '''
+    top = self.visit_dir(path) if path != "" else self.dir_tree.current_dir
+    table = self.dir_tree.table
+    stack = [(path if path != "" else self.get_cwd(), top.file_id, 0)]
+    while stack:
+      dirpath, file_id, depth = stack.pop()
+      entries = []
+      for i in table.get_children(file_id):
+        if not table.flags[i] & (NTFSAttribute.SYSTEM.value | NTFSAttribute.HIDDEN.value):
+          entries.append(self.__dir_entry(i))
+      yield dirpath, entries
+      if max_depth is not None and depth + 1 >= max_depth:
+        continue
+      for entry in reversed(entries):
+        if entry.is_dir:
+          stack.append((join_path(dirpath, entry.name), entry.ref, depth + 1))
+
+  def find(self, path: str, flt: FindFilter, use_index: bool = False):
+    '''
+    Yield (path, entry) for everything below path matching flt, in one pass over the file table
+    (a walk below path in lazy mode, without the trigram index)
+    '''
+    table = self.dir_tree.table
+    top = self.visit_dir(path) if path != "" else self.dir_tree.current_dir
+    if self.lazy:
+      for dirpath, entries in self.walk(path):
+        for entry in entries:
+          if flt.match(entry):
+            yield join_path(dirpath, entry.name), entry
+      return
+    ids = None
+    if use_index:
+      if self.name_index is None:
+        self.name_index = TrigramIndex((i, table.get_name(i)) for i in range(len(table)) if table.in_use[i])
+      ids = self.name_index.candidates(flt.literal())
+    if ids is None:
+      ids = range(len(table))
+    after = to_filetime(flt.after) if flt.after is not None else None
+    before = to_filetime(flt.before) if flt.before is not None else None
+    hidden = NTFSAttribute.SYSTEM.value | NTFSAttribute.HIDDEN.value
+    # Directory record -> (path, is top or below it), None path for hidden or detached ones
+    state = {}
+    for i in ids:
+      flags = table.flags[i]
+      if not table.in_use[i] or i == table.root_id or flags & hidden:
+        continue
+      if not flt.match_stat(bool(flags & NTFSAttribute.DIRECTORY.value), table.sizes[i], flags):
+        continue
+      if (after is not None and table.modified[i] < after) or (before is not None and table.modified[i] >= before):
+        continue
+      name = table.get_name(i)
+      if not flt.match_name(name):
+        continue
+      parent_path, below = self.__resolve_dir(table.parents[i], top.file_id, state)
+      if below:
+        yield join_path(parent_path, name), self.__dir_entry(i)
+
+  def deleted(self, path: str = ""):
+    '''
+    Yield a DeletedEntry for every record no longer in use whose parent directory is below path,
+    in one sequential pass over $MFT. Records of deleted parents are listed under
+    "[record number]" at the volume root. Extents are checked against $Bitmap.
+    '''
+    table = self.dir_tree.table
+    top = self.visit_dir(path) if path != "" else self.dir_tree.current_dir
+    state = {}
+    bitmap = self.__open_bitmap()
+    cluster_size = self.SC * self.BS
+    for first, chunk in self.iter_mft_chunks():
+      for off in range(0, len(chunk), self.record_size):
+        # Base records only, flag bit 0 clear = not in use
+        if chunk[off:off + 4] != b"FILE" or chunk[off + 0x16] & 1 or any(chunk[off + 0x20:off + 0x26]):
+          continue
+        try:
+          record = MFTRecord(chunk[off:off + self.record_size], deleted=True)
+        except Exception:
+          continue
+        file_id = first + off // self.record_size
+        parent_id = record.file_name['parent_id']
+        parent_path, below = self.__resolve_dir(parent_id, top.file_id, state)
+        if parent_path is None:
+          if top.file_id != table.root_id:
+            continue
+          parent_path, below = join_path(self.name, f"[{parent_id}]"), True
+        if not below:
+          continue
+        size = record.data.get('size', 0)
+        extents = []
+        clusters = 0
+        if 'runs' in record.data:
+          clusters = -(-size // cluster_size)
+          left = clusters
+          for _, lcn, length in record.data['runs']:
+            if left <= 0:
+              break
+            length = min(length, left)
+            left -= length
+            if lcn is not None:
+              extents += self.__unallocated(bitmap, lcn, length)
+        yield DeletedEntry(join_path(parent_path, record.file_name['long_name']), record.is_directory(), size,
+                           NTFS.__safe_datetime(record.standard_info['created_time']),
+                           NTFS.__safe_datetime(record.standard_info['last_modified_time']), file_id, clusters, extents)
+
+  def __open_bitmap(self) -> VolumeFile:
+    # $Bitmap (record 6), one bit per cluster, set when allocated
+    record = self.read_record(6)
+    if 'runs' not in record.data:
+      return ResidentFile(record.data.get('content', b""))
+    return NTFSFile(self.dev, record.data['runs'], record.data['size'], self.SC * self.BS)
+
+  def __unallocated(self, bitmap: VolumeFile, lcn: int, length: int) -> 'list[tuple[int, int]]':
+    # Runs of lcn..lcn+length-1 the bitmap marks free, clusters past its end count as allocated
+    bitmap.seek(lcn >> 3)
+    bits = bitmap.read(((lcn + length - 1) >> 3) - (lcn >> 3) + 1)
+    runs = []
+    start = None
+    for c in range(lcn, lcn + length):
+      i = (c >> 3) - (lcn >> 3)
+      if i < len(bits) and not bits[i] >> (c & 7) & 1:
+        if start is None:
+          start = c
+      elif start is not None:
+        runs.append((start, c - start))
+        start = None
+    if start is not None:
+      runs.append((start, lcn + length - start))
+    return runs
+
+  @staticmethod
+  def __safe_datetime(timestamp: int) -> datetime:
+    try:
+      return as_datetime(timestamp)
+    except (ValueError, OSError, OverflowError):
+      return None
+
+  def __resolve_dir(self, file_id: int, top_id: int, state: dict) -> 'tuple[str, bool]':
+    table = self.dir_tree.table
+    hidden = NTFSAttribute.SYSTEM.value | NTFSAttribute.HIDDEN.value
+    chain = []
+    i = file_id
+    while i not in state:
+      if i < len(table):
+        table.ensure(i)
+      if i >= len(table) or not table.in_use[i] or len(chain) > 1024:
+        state[i] = (None, False)
+      elif i == table.root_id:
+        state[i] = (self.name, i == top_id)
+      else:
+        chain.append(i)
+        i = table.parents[i]
+    for i in reversed(chain):
+      parent_path, below = state[table.parents[i]]
+      if parent_path is None or table.flags[i] & hidden:
+        state[i] = (None, False)
+      else:
+        state[i] = (join_path(parent_path, table.get_name(i)), below or i == top_id)
+    return state[file_id]
+
   def get_dir(self, path = ""):
     try:
       if path != "":
@@ -290,14 +1093,16 @@ class NTFS:
       ret = []
       for record in record_list:
         obj = {}
-        obj["Flags"] = record.standard_info['flags'].value
-        obj["Date Modified"] = record.standard_info['last_modified_time']
-        obj["Size"] = record.data['size']
-        obj["Name"] = record.file_name['long_name']
-        if record.data['resident']:
+        obj["Flags"] = record.flags.value
+        obj["Date Modified"] = record.last_modified_time
+        # Until the record is read in lazy mode this is the size in the parent's index, which can lag behind
+        obj["Size"] = record.size
+        obj["Name"] = record.name
+        # Records not read yet in lazy mode show where their MFT record is
+        if not record.is_loaded() or record.resident:
           obj["Sector"] = self.mft_offset * self.SC + record.file_id
         else:
-          obj["Sector"] = record.data['cluster_offset'] * self.SC
+          obj["Sector"] = record.first_lcn * self.SC
         ret.append(obj)
       return ret
     except Exception as e:
@@ -327,8 +1132,23 @@ class NTFS:
     if len(self.cwd) == 1:
       return self.cwd[0] + "\\"
     return "\\".join(self.cwd)
+
+  def abspath(self, path: str) -> str:
+    dirs = self.__parse_path(path) if path != "" else []
+    if dirs and dirs[0] == self.name:
+      parts = []
+      dirs.pop(0)
+    else:
+      parts = self.cwd[1:]
+    for d in dirs:
+      if d == "..":
+        if parts:
+          parts.pop()
+      elif d not in ("", "."):
+        parts.append(d)
+    return "\\".join([self.name] + parts)
   
-  def get_file_content(self, path: str):
+  def __get_file_record(self, path: str) -> FileRecord:
     path = self.__parse_path(path)
     if len(path) > 1:
       name = path[-1]
@@ -342,62 +1162,68 @@ class NTFS:
       raise Exception("File doesn't exist")
     if record.is_directory():
       raise Exception("Is a directory")
+    return record
 
-    if 'resident' not in record.data:
-      return b''
-    if record.data['resident']:
-      return record.data['content']
-    else:
-      real_size = record.data['size']
-      offset = record.data['cluster_offset'] * self.SC * self.BS
-      size = record.data['cluster_size'] * self.SC * self.BS
-      self.fd.seek(offset)
-      data = self.fd.read(min(size, real_size))
-      return data
+  def get_file_content(self, path: str):
+    record = self.__get_file_record(path)
 
-  def get_text_file(self, path: str) -> str:
-    path = self.__parse_path(path)
-    if len(path) > 1:
-      name = path[-1]
-      path = "\\".join(path[:-1])
-      next_dir = self.visit_dir(path)
-      record = next_dir.find_record(name)
-    else:
-      record = self.dir_tree.find_record(path[0])
+    return b"".join(self.iter_data(record))
+
+  def open(self, path: str) -> VolumeFile:
+    return self.__open_record(self.__get_file_record(path))
+
+  def open_entry(self, entry: DirEntry) -> VolumeFile:
+    return self.__open_record(FileRecord(self.dir_tree.table, entry.ref))
+
+  def __open_record(self, record: FileRecord) -> VolumeFile:
+    if record.resident:
+      return ResidentFile(self.read_record(record.file_id).data.get('content', b""))
+    return NTFSFile(self.dev, record.runs(), record.size, self.SC * self.BS)
 
+  def stat(self, path: str) -> DirEntry:
+    dirs = self.__parse_path(path)
+    if dirs == [self.name]:
+      return self.__dir_entry(self.dir_tree.root.file_id)
+    if dirs[-1] in (".", ".."):
+      return self.__dir_entry(self.visit_dir(path).file_id)
+    cur_dir = self.visit_dir("\\".join(dirs[:-1])) if len(dirs) > 1 else self.dir_tree.current_dir
+    record = cur_dir.find_record(dirs[-1])
     if record is None:
       raise Exception("File doesn't exist")
-    if record.is_directory():
-      raise Exception("Is a directory")
-    if 'resident' not in record.data:
-      return ''
-    if record.data['resident']:
-      try:
-        data = record.data['content'].decode()
-      except UnicodeDecodeError as e:
-        raise Exception(
-            "Not a text file, please use appropriate software to open.")
-      except Exception as e:
-        raise (e)
-      return data
-    else:
-      data = ""
-      size_left = record.data['size']
-      offset = record.data['cluster_offset'] * self.SC * self.BS
-      cluster_num = record.data['cluster_size']
-      self.fd.seek(offset)
-      for _ in range(cluster_num):
-        if size_left <= 0:
-          break
-        raw_data = self.fd.read(min(self.SC * self.BS, size_left))
-        size_left -= self.SC * self.BS
-        try:
-          data += raw_data.decode()
-        except UnicodeDecodeError as e:
-          raise Exception("Not a text file, please use appropriate software to open.")
-        except Exception as e:
-          raise (e)
-      return data
+    return self.__dir_entry(record.file_id)
+
+  def __dir_entry(self, file_id: int) -> DirEntry:
+    table = self.dir_tree.table
+    return DirEntry(table.get_name(file_id), bool(table.flags[file_id] & NTFSAttribute.DIRECTORY.value),
+                    table.sizes[file_id], table.flags[file_id], file_id, as_datetime(table.modified[file_id]))
+
+  def iter_data(self, record: FileRecord, chunk_size: int = 1 << 20):
+    if record.resident:
+      yield self.read_record(record.file_id).data.get('content', b"")
+      return
+    cluster_size = self.SC * self.BS
+    size_left = record.size
+    for _, lcn, length in record.runs():
+      run_size = min(length * cluster_size, size_left)
+      size_left -= run_size
+      for off in range(0, run_size, chunk_size):
+        n = min(chunk_size, run_size - off)
+        if lcn is None:
+          # Sparse run, nothing on disk
+          yield bytes(n)
+        else:
+          yield self.dev.read(lcn * cluster_size + off, n)
+      if size_left <= 0:
+        break
+
+  def get_text_file(self, path: str) -> str:
+    data = self.get_file_content(path)
+    try:
+      return str(data, 'utf-8')
+    except UnicodeDecodeError as e:
+      raise Exception("Not a text file, please use appropriate software to open.")
+    except Exception as e:
+      raise (e)
   
   def __str__(self) -> str:
     s = "Volume name: " + self.name
@@ -407,6 +1233,6 @@ class NTFS:
     return s
   
   def __del__(self):
-    if getattr(self, "fd", None):
+    if getattr(self, "dev", None):
       print("Closing Volume...")
-      self.fd.close()
+      self.dev.close()
@@ -1,10 +1,33 @@
 import cmd
+import codecs
+import re
+import shutil
+import sys
+import time
+from array import array
+from datetime import datetime
 from typing import Union
 from FAT32 import FAT32
 from NTFS import NTFS
+from Extract import Extractor
+from Find import FindFilter
+from Hash import Hasher
 class Shell(cmd.Cmd):
   intro = "Welcome to Shelby the pseudo-shell! Type help or ? to list the commands.\n"
   prompt = ""
+  chunk_size = 1 << 16
+  # Bytes per read of xxd, a multiple of the 16 bytes of a line
+  dump_size = 1 << 17
+  # Printable ASCII stays, everything else shows as '.'
+  printable = bytes(c if 31 < c < 127 else ord('.') for c in range(256))
+  # Text column of __hexdump: lower case a-f go to 0x80-0x85 so that the final pass,
+  # which upper-cases the hex digits, can turn them back
+  dump_text = printable.translate(bytes.maketrans(b"abcdef", bytes(range(0x80, 0x86))))
+  dump_output = bytes.maketrans(b"abcdef" + bytes(range(0x80, 0x86)), b"ABCDEFabcdef")
+  dump_buffer = (None, None)
+  # One padded xxd line, see __hexdump
+  dump_template = bytes(16) + b": ".ljust(8, b"\x00") + bytes(24) + b" ".ljust(8, b"\x00") + bytes(24) \
+                  + b" ".ljust(8, b"\x00") + bytes(16) + b"\n".ljust(8, b"\x00")
   def __init__(self, volume: Union[FAT32, NTFS]) -> None:
     super(Shell, self).__init__()
     self.vol = volume
@@ -13,6 +36,47 @@ class Shell(cmd.Cmd):
   def __update_prompt(self):
     Shell.prompt = f'┌──(Tommy@Shelby)-[{self.vol.get_cwd()}]\n└─$ '
   
+  @staticmethod
+  def __split_args(arg: str, usage: str, options: 'dict[str, bool]' = None, paths: 'tuple[int, int]' = (1, 1)) -> 'tuple[dict[str, str], list[str]]':
+    '''
+    Split a command line into options and between paths[0] and paths[1] paths, options maps each
+    option to whether it takes a value. A command with a single path takes the text between the
+    options as it is, unquoted names with spaces work like in cat; several paths need quotes.
+    '''
+    options = options or {}
+    tokens = list(re.finditer(r'"[^"]*"|\'[^\']*\'|\S+', arg))
+    found = {}
+    rest = []
+    i = 0
+    while i < len(tokens):
+      text = tokens[i].group()
+      if text in options:
+        if options[text]:
+          if i + 1 == len(tokens):
+            raise Exception(f"{text} needs a value")
+          i += 1
+          found[text] = Shell.__unquote(tokens[i].group())
+        else:
+          found[text] = ""
+      else:
+        rest.append(i)
+      i += 1
+    if paths[1] == 1 and rest:
+      if rest[-1] - rest[0] != len(rest) - 1:
+        raise Exception(f"Usage: {usage}")
+      args = [Shell.__unquote(arg[tokens[rest[0]].start():tokens[rest[-1]].end()])]
+    else:
+      args = [Shell.__unquote(tokens[j].group()) for j in rest]
+    if args and args[0].startswith("-") and len(args[0]) > 1 and tokens[rest[0]].group()[0] == "-":
+      raise Exception(f"Unknown option {args[0].split()[0]}")
+    if not paths[0] <= len(args) <= paths[1]:
+      raise Exception(f"Usage: {usage}")
+    return found, args
+
+  @staticmethod
+  def __unquote(text: str) -> str:
+    return text[1:-1] if len(text) > 1 and text[0] == text[-1] and text[0] in "'\"" else text
+
   def do_pwd(self, arg):
     '''
     pwd: print current working directory
@@ -63,40 +127,39 @@ class Shell(cmd.Cmd):
     '''
       tree: print the tree of the current directory and it's sub-directory
       tree <path>: print the directory tree in the specified path
+      tree -L <depth> [path]: descend at most depth levels
     '''
-    def print_tree(entry, prefix="", last=False):
-      print(prefix + ("└── " if last else "├── ") + entry["Name"])
-      # check if is archive
-      if entry["Flags"] & 0b100000:
-        return
-      
-      self.vol.change_dir(entry["Name"])
-      entries = self.vol.get_dir()
-      l = len(entries)
-      for i in range(l):
-        if entries[i]["Name"] in (".", ".."):
-          continue
-        prefix_char = "    " if last else "│   "
-        print_tree(entries[i], prefix + prefix_char, i == l - 1)
-      self.vol.change_dir("..")
-
-    cwd = self.vol.get_cwd()
     try:
-      if arg != "":
-        self.vol.change_dir(arg)
-        print(self.vol.get_cwd())
-      else:
-        print(cwd)
-      entries = self.vol.get_dir()
-      l = len(entries)
-      for i in range(l):
-        if entries[i]["Name"] in (".", ".."):
-          continue
-        print_tree(entries[i], "", i == l - 1)
+      options, args = Shell.__split_args(arg, "tree [-L <depth>] [path]", {"-L": True}, (0, 1))
+      max_depth = None
+      if "-L" in options:
+        if not options["-L"].isdigit() or int(options["-L"]) < 1:
+          raise Exception("tree -L needs a positive depth")
+        max_depth = int(options["-L"])
+      arg = args[0] if args else ""
+      # walk() yields directories in the order they are printed, each listing
+      # is pushed when it arrives and drained until the next directory line
+      stack = []
+      pending = None
+      for dirpath, entries in self.vol.walk(arg, max_depth):
+        if pending is None:
+          print(dirpath)
+          pending = ("", 0)
+        stack.append([pending[0], entries, 0, pending[1]])
+        while stack:
+          frame = stack[-1]
+          prefix, entries, i, depth = frame
+          if i == len(entries):
+            stack.pop()
+            continue
+          frame[2] += 1
+          last = i == len(entries) - 1
+          print(prefix + ("└── " if last else "├── ") + entries[i].name)
+          if entries[i].is_dir and (max_depth is None or depth + 1 < max_depth):
+            pending = (prefix + ("    " if last else "│   "), depth + 1)
+            break
     except Exception as e:
       print(f"[ERROR] {e}")
-    finally:
-      self.vol.change_dir(cwd)
 
   def do_cat(self, arg):
     '''
@@ -106,35 +169,331 @@ class Shell(cmd.Cmd):
       print(f"[ERROR] No path provided")
       return
     try:
-      print(self.vol.get_text_file(arg))
+      with self.vol.open(arg) as f:
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+          chunk = f.read(Shell.chunk_size)
+          if not chunk:
+            break
+          sys.stdout.write(decoder.decode(chunk))
+        sys.stdout.write(decoder.decode(b"", final=True) + "\n")
+    except UnicodeDecodeError:
+      print("\n[ERROR] Not a text file, please use appropriate software to open.")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_head(self, arg):
+    '''
+      head [-n <count>] <path to file>: print the first lines of a text file (default 10)
+    '''
+    try:
+      count, path = self.__count_and_path(arg, "head")
+      with self.vol.open(path) as f:
+        for i, line in enumerate(Shell.__iter_lines(f)):
+          if i >= count:
+            break
+          print(line)
+    except UnicodeDecodeError:
+      print("\n[ERROR] Not a text file, please use appropriate software to open.")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_tail(self, arg):
+    '''
+      tail [-n <count>] <path to file>: print the last lines of a text file (default 10), only the end is read
+    '''
+    try:
+      count, path = self.__count_and_path(arg, "tail")
+      with self.vol.open(path) as f:
+        for line in Shell.__iter_lines(f, Shell.__tail_start(f, count)):
+          print(line)
+    except UnicodeDecodeError:
+      print("\n[ERROR] Not a text file, please use appropriate software to open.")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_less(self, arg):
+    '''
+      less <path to file>: page through a text file, Enter shows the next page, q quits
+    '''
+    if arg == "":
+      print(f"[ERROR] No path provided")
+      return
+    try:
+      page = max(1, shutil.get_terminal_size().lines - 1)
+      with self.vol.open(arg) as f:
+        for i, line in enumerate(Shell.__iter_lines(f), 1):
+          print(line)
+          if i % page == 0 and input(":").strip().lower() == "q":
+            break
+    except UnicodeDecodeError:
+      print("\n[ERROR] Not a text file, please use appropriate software to open.")
+    except EOFError:
+      print()
     except Exception as e:
       print(f"[ERROR] {e}")
 
+  def __count_and_path(self, arg: str, command: str) -> 'tuple[int, str]':
+    options, args = Shell.__split_args(arg, f"{command} [-n <count>] <path to file>", {"-n": True})
+    count = 10
+    if "-n" in options:
+      if not options["-n"].isdigit():
+        raise Exception(f"{command} -n needs a count")
+      count = int(options["-n"])
+    return count, args[0]
+
+  @staticmethod
+  def __iter_lines(f, start: int = 0):
+    # Lines from byte offset start on, decoded as they are read, a character split between reads is kept whole
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    f.seek(start)
+    parts = []
+    while True:
+      chunk = f.read(Shell.chunk_size)
+      text = decoder.decode(chunk, final=not chunk)
+      if "\n" in text:
+        lines = text.split("\n")
+        parts.append(lines[0])
+        yield "".join(parts)
+        yield from lines[1:-1]
+        parts = [lines[-1]]
+      elif text:
+        parts.append(text)
+      if not chunk:
+        break
+    if any(parts):
+      yield "".join(parts)
+
+  @staticmethod
+  def __tail_start(f, count: int) -> int:
+    # Byte offset where the last count lines begin, found reading backwards from the end;
+    # a newline byte never occurs inside a UTF-8 sequence so the offset is a character boundary
+    if count <= 0:
+      return f.size
+    end = f.size
+    if end:
+      f.seek(end - 1)
+      if f.read(1) == b"\n":
+        # The final newline ends the last line, it does not start another
+        end -= 1
+    found = 0
+    pos = end
+    while pos > 0:
+      low = max(0, pos - Shell.chunk_size)
+      f.seek(low)
+      block = f.read(pos - low)
+      i = len(block)
+      while True:
+        i = block.rfind(b"\n", 0, i)
+        if i < 0:
+          break
+        found += 1
+        if found == count:
+          return low + i + 1
+      pos = low
+    return 0
+
   def do_xxd(self, arg):
     '''
-      xxd <path to file>: print hexdump of the file specified in path
+      xxd [-s <offset>] [-l <length>] <path to file>: print hexdump of the file specified in path,
+        starting at offset (from the end if negative) and stopping after length bytes
     '''
-    try: 
-      raw_data = self.vol.get_file_content(arg)
+    try:
+      options, args = Shell.__split_args(arg, "xxd [-s <offset>] [-l <length>] <path to file>", {"-s": True, "-l": True})
+      offset = int(options.get("-s", "0"), 0)
+      length = int(options["-l"], 0) if "-l" in options else None
+      if length is not None and length < 0:
+        raise Exception("xxd -l needs a positive length")
+      f = self.vol.open(args[0])
     except Exception as e:
       print(f"[ERROR] {e}")
       return
 
-    for i in range(0, len(raw_data), 16):
-      line = raw_data[i: i + 16]
-      index = "%08X:" % i 
-      ascii = ""
-      hex_str = ""
-      print(index, end=" ")
-      for j, c in enumerate(line, 1):
-        if j % 9 == 0:
-            hex_str += " "
-        hex_str += "%02X " % c
-        if c > 31 and c < 127:
-            ascii += chr(c)
+    with f:
+      if offset < 0:
+        offset = max(0, f.size + offset)
+      end = f.size if length is None else min(f.size, offset + length)
+      f.seek(offset)
+      sys.stdout.flush()
+      out = getattr(sys.stdout, "buffer", None)
+      while offset < end:
+        # Whole lines per read except for the last one
+        raw_data = f.read(min(Shell.dump_size, end - offset))
+        if not raw_data:
+          break
+        dump = Shell.__hexdump(raw_data, offset)
+        if out is not None:
+          out.write(dump)
         else:
-            ascii += '.'
-      print(f'{hex_str:<49} {ascii}')
+          sys.stdout.write(dump.decode('ascii'))
+        offset += len(raw_data)
+      if out is not None:
+        out.flush()
+
+  @staticmethod
+  def __hexdump(data: bytes, offset: int) -> bytes:
+    '''
+    xxd lines for data starting at offset. Lines are laid out as 14 words of 8 bytes padded
+    with NULs: offset (2 words), ": ", hex of bytes 0-7 (3), " ", hex of bytes 8-15 (3), " ",
+    text (2), newline. Every column is filled for all lines with one strided word copy, one
+    translate pass then drops the padding and upper-cases the hex digits.
+    '''
+    full = len(data) // 16
+    # Offsets take at least 8 hex digits, never mix widths within one block
+    digits = max(8, len(f"{offset:X}"))
+    if full > 1 and len(f"{offset + 16 * (full - 1):X}") > digits:
+      split = -(-(16 ** digits - offset) // 16) * 16
+      return Shell.__hexdump(data[:split], offset) + Shell.__hexdump(data[split:], offset + split)
+    if full == 0:
+      return Shell.__hexdump_line(data, offset) if data else b""
+    lines = Shell.__dump_buffer(full, digits)
+    words = memoryview(lines).cast('Q')
+    body = memoryview(data)[:16 * full]
+    offsets = array('I' if digits == 8 else 'Q', range(offset, offset + 16 * full, 16))
+    if sys.byteorder == 'little':
+      offsets.byteswap()
+    offset_words = memoryview(offsets.tobytes().hex().encode()).cast('Q')
+    if digits == 8:
+      words[1::14] = offset_words
+    else:
+      words[0::14] = offset_words[0::2]
+      words[1::14] = offset_words[1::2]
+      for i in range(16 - digits):
+        lines[i::112] = bytes(full)
+    # "xx " per byte, 6 words per line
+    hex_words = memoryview((body.hex(' ') + ' ').encode()).cast('Q')
+    for k in range(3):
+      words[3 + k::14] = hex_words[k::6]
+      words[7 + k::14] = hex_words[3 + k::6]
+    text_words = memoryview(body.tobytes().translate(Shell.dump_text)).cast('Q')
+    words[11::14] = text_words[0::2]
+    words[12::14] = text_words[1::2]
+    del words
+    dump = lines.translate(Shell.dump_output, b"\x00")
+    if len(data) > 16 * full:
+      dump += Shell.__hexdump_line(data[16 * full:], offset + 16 * full)
+    return dump
+
+  @staticmethod
+  def __dump_buffer(full: int, digits: int) -> bytearray:
+    # Padded lines of the last block size are kept, the constant words never change
+    key = (full, digits == 8)
+    if Shell.dump_buffer[0] != key:
+      Shell.dump_buffer = (key, bytearray(Shell.dump_template * full))
+    return Shell.dump_buffer[1]
+
+  @staticmethod
+  def __hexdump_line(line: bytes, offset: int) -> bytes:
+    hex_str = bytes(line[:8]).hex(' ').upper() + " "
+    if len(line) > 8:
+      hex_str += " " + bytes(line[8:]).hex(' ').upper() + " "
+    return f"{offset:08X}: {hex_str:<49} {bytes(line).translate(Shell.printable).decode('ascii')}\n".encode()
+
+  def do_extract(self, arg):
+    '''
+      extract <src> <host-dir>: copy a file or directory tree to the host, quote paths with spaces
+    '''
+    try:
+      _, args = Shell.__split_args(arg, "extract <src> <host-dir>", paths=(2, 2))
+      stats = Extractor(self.vol).extract(args[0], args[1])
+      print(f"{stats['Files']} files, {stats['Directories']} directories, {stats['Bytes']} bytes in {stats['Seconds']}s "
+            f"({stats['MB/s']} MB/s, {stats['Files/s']} files/s)")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_hash(self, arg):
+    '''
+      hash [-o <manifest>] [path]: md5, sha1 and sha256 of every file below path as a hashdeep manifest,
+        printed or written to a host file with progress shown
+    '''
+    try:
+      options, args = Shell.__split_args(arg, "hash [-o <manifest>] [path]", {"-o": True}, (0, 1))
+      output = options.get("-o")
+      if args:
+        # Fail before anything is written
+        self.vol.stat(args[0])
+      hasher = Hasher(self.vol)
+      out = open(output, 'w', encoding='utf-8') if output else sys.stdout
+      try:
+        out.write(hasher.manifest_header("hash " + arg))
+        last = 0
+        for path, entry, digests in hasher.hash(args[0] if args else ""):
+          out.write(hasher.manifest_line(path, entry, digests))
+          if output and time.time() - last >= 0.5:
+            last = time.time()
+            stats = hasher.stats()
+            sys.stdout.write(f"\r{stats['Files']} files, {stats['Bytes'] / (1 << 20):.1f} MB, {stats['MB/s']:.1f} MB/s   ")
+            sys.stdout.flush()
+      finally:
+        if output:
+          out.close()
+      stats = hasher.stats()
+      print(("\n" if output else "") + f"{stats['Files']} files, {stats['Bytes']} bytes in {stats['Seconds']}s ({stats['MB/s']} MB/s)")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_find(self, arg):
+    '''
+      find [path] [options]: list files and folders below path (default: current directory)
+        -name <glob>       name matches the glob, case-insensitive
+        -regex <pattern>   name contains a match of the regular expression
+        -contains <text>   name contains text
+        -size [+|-]<n>[k|M|G]  at least (+), at most (-) or exactly n bytes
+        -newer <date>      modified on or after date (YYYY-MM-DD[ HH:MM:SS])
+        -older <date>      modified before date
+        -type f|d          files or directories only
+        -attr <rhsad>      has all these attributes (read-only, hidden, system, archive, directory)
+        -index             answer name filters from a trigram index, built on first use
+    '''
+    try:
+      filters = {option: True for option in ("-name", "-regex", "-contains", "-size", "-newer", "-older", "-type", "-attr")}
+      options, args = Shell.__split_args(arg, "find [path] [options]", {**filters, "-index": False}, (0, 1))
+      path = args[0] if args else ""
+      use_index = "-index" in options
+      min_size = max_size = None
+      if "-size" in options:
+        size = options["-size"]
+        sign = size[0] if size[:1] in ("+", "-") else ""
+        size = size[len(sign):]
+        unit = {"k": 1 << 10, "M": 1 << 20, "G": 1 << 30}.get(size[-1:], 1)
+        size = int(size[:-1] if unit > 1 else size) * unit
+        min_size = size if sign != "-" else None
+        max_size = size if sign != "+" else None
+      attributes = 0
+      for c in options.get("-attr", ""):
+        if c not in "rhsad":
+          raise Exception(f"Unknown attribute {c}")
+        attributes |= {"r": 0b1, "h": 0b10, "s": 0b100, "d": 0b10000, "a": 0b100000}[c]
+      flt = FindFilter(options.get("-name"), options.get("-regex"), options.get("-contains"), min_size, max_size,
+                       datetime.fromisoformat(options["-newer"]) if "-newer" in options else None,
+                       datetime.fromisoformat(options["-older"]) if "-older" in options else None,
+                       options.get("-type"), attributes)
+      count = 0
+      for file_path, entry in self.vol.find(path, flt, use_index):
+        print(file_path + ("\\" if entry.is_dir else ""))
+        count += 1
+      print(f"{count} match{'es' if count != 1 else ''}")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_deleted(self, arg):
+    '''
+      deleted [path]: list deleted files and folders below path that still have metadata on disk,
+        Surviving counts the clusters of their data not yet reused
+    '''
+    try:
+      _, args = Shell.__split_args(arg, "deleted [path]", paths=(0, 1))
+      print(f"{'Mode':<5}  {'Surviving':>11}  {'LastWriteTime':<20}  {'Length':>12}  {'Path'}")
+      print(f"{'────':<5}  {'─────────':>11}  {'─────────────':<20}  {'──────':>12}  {'────'}")
+      count = 0
+      for entry in self.vol.deleted(args[0] if args else ""):
+        surviving = f"{sum(n for _, n in entry.extents)}/{entry.clusters}" if entry.clusters else "-"
+        modified = str(entry.modified) if entry.modified is not None else "?"
+        print(f"{'d' if entry.is_dir else '-':<5}  {surviving:>11}  {modified:<20}  {entry.size if entry.size else '':>12}  {entry.path}")
+        count += 1
+      print(f"{count} deleted entr{'ies' if count != 1 else 'y'}")
+    except Exception as e:
+      print(f"[ERROR] {e}")
 
   def do_echo(self, arg):
     '''
@@ -148,6 +507,64 @@ class Shell(cmd.Cmd):
     '''
     print(self.vol)
     
+  def do_cachestat(self, arg):
+    '''
+      cachestat: print directory table cache statistics (FAT32 only)
+    '''
+    if not isinstance(self.vol, FAT32):
+      print("[ERROR] Only FAT32 volumes cache directory tables")
+      return
+    for key, value in self.vol.DET.stats().items():
+      print(f"{key}: {value}")
+
+  def do_df(self, arg):
+    '''
+      df: print free, used and bad space from the FAT and how allocation spreads across the volume (FAT32 only)
+    '''
+    if not isinstance(self.vol, FAT32):
+      print("[ERROR] Only FAT32 volumes can be scanned for space usage")
+      return
+    try:
+      usage = self.vol.space_usage()
+      cluster_size = usage["Cluster Size"]
+      for key in ("Clusters", "Used Clusters", "Free Clusters", "Bad Clusters"):
+        print(f"{key + ':':<16}{usage[key]:>12}  {usage[key] * cluster_size / (1 << 20):>12.1f} MB")
+      if usage["FSInfo Free Clusters"] is None:
+        print("FSInfo:         no free cluster count recorded")
+      elif not usage["FSInfo Matches"]:
+        print(f"[WARNING] FSInfo records {usage['FSInfo Free Clusters']} free clusters, the FAT has {usage['Free Clusters']}")
+      print(f"{'Chains:':<16}{usage['Chains']:>12}")
+      print(f"{'Fragments:':<16}{usage['Fragments']:>12}")
+      # One character per slice of the data area, darker is fuller
+      shades = " ░▒▓█"
+      print("Allocation:     [" + "".join(shades[min(4, int(used * 4 + 0.999))] for used in usage["Histogram"]) + "]")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
+  def do_frag(self, arg):
+    '''
+      frag [-n <count>] [path]: list the most fragmented files and folders below path (FAT32 only)
+    '''
+    if not isinstance(self.vol, FAT32):
+      print("[ERROR] Only FAT32 volumes can be scanned for fragmentation")
+      return
+    try:
+      options, args = Shell.__split_args(arg, "frag [-n <count>] [path]", {"-n": True}, (0, 1))
+      count = 20
+      if "-n" in options:
+        if not options["-n"].isdigit():
+          raise Exception("frag -n needs a count")
+        count = int(options["-n"])
+      files = list(self.vol.fragmentation(args[0] if args else ""))
+      fragmented = sorted((item for item in files if item[2] > 1), key=lambda item: -item[2])
+      print(f"{'Fragments':>9}  {'Length':>12}  {'Path'}")
+      for path, entry, fragments in fragmented[:count]:
+        print(f"{fragments:>9}  {entry.size if entry.size else '':>12}  {path}" + ("\\" if entry.is_dir else ""))
+      total = sum(item[2] for item in files)
+      print(f"{len(fragmented)} of {len(files)} fragmented, {total / len(files) if files else 0:.2f} fragments per file")
+    except Exception as e:
+      print(f"[ERROR] {e}")
+
   def do_bye(self, arg):
     '''
       bye: exit the shell
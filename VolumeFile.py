@@ -0,0 +1,67 @@
+import io
+from BlockDevice import BlockDevice
+
+class VolumeFile(io.RawIOBase):
+  def __init__(self, dev: BlockDevice, size: int, cluster_size: int) -> None:
+    super().__init__()
+    self.dev = dev
+    self.size = size
+    self.cluster_size = cluster_size
+    self.pos = 0
+
+  def locate(self, vcn: int) -> 'tuple[int, int]':
+    '''
+    Return (byte offset of cluster vcn on the device or None if sparse,
+    number of contiguous clusters from vcn on), (None, 0) past the end
+    '''
+    raise NotImplementedError
+
+  def readable(self) -> bool:
+    return True
+
+  def seekable(self) -> bool:
+    return True
+
+  def tell(self) -> int:
+    return self.pos
+
+  def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+    if whence == io.SEEK_SET:
+      pos = offset
+    elif whence == io.SEEK_CUR:
+      pos = self.pos + offset
+    elif whence == io.SEEK_END:
+      pos = self.size + offset
+    else:
+      raise ValueError(f"Invalid whence ({whence})")
+    if pos < 0:
+      raise ValueError("Negative seek position")
+    self.pos = pos
+    return self.pos
+
+  def readinto(self, b) -> int:
+    if self.pos >= self.size:
+      return 0
+    view = memoryview(b).cast('B')
+    n = min(len(view), self.size - self.pos)
+    done = 0
+    while done < n:
+      vcn, within = divmod(self.pos, self.cluster_size)
+      offset, clusters = self.locate(vcn)
+      if clusters <= 0:
+        # Allocation ends before the recorded size
+        break
+      chunk = min(n - done, clusters * self.cluster_size - within)
+      if offset is None:
+        view[done:done + chunk] = bytes(chunk)
+      else:
+        self.dev.readinto(offset + within, view[done:done + chunk])
+      done += chunk
+      self.pos += chunk
+    return done
+
+  def readall(self) -> bytes:
+    data = bytearray(max(0, self.size - self.pos))
+    n = self.readinto(data)
+    del data[n:]
+    return bytes(data)
@@ -1,6 +1,7 @@
 from FAT32 import FAT32
 from NTFS import NTFS
 from Shell import Shell
+import argparse
 import os
 
 if __name__ == "__main__":
@@ -10,7 +11,17 @@ if __name__ == "__main__":
   print("* 21127296 - Dang Ha Huy")
   print("* 21127300 - Nguyen Cat Huy")
   print("----------------------------")
-  volumes = [chr(x) + ":" for x in range(65, 91) if os.path.exists(chr(x) + ":")]
+  parser = argparse.ArgumentParser()
+  # Image files or raw devices (e.g. /dev/sdb1) can be given on the command line
+  parser.add_argument("volumes", nargs="*", help="image files or raw devices to open")
+  parser.add_argument("--serial", action="store_true", help="parse the NTFS MFT in a single process")
+  parser.add_argument("--lazy", action="store_true", help="read NTFS directories on demand instead of scanning the whole MFT")
+  parser.add_argument("--no-cache", action="store_true", help="ignore and do not write the on-disk index cache")
+  args = parser.parse_args()
+  if args.volumes:
+    volumes = args.volumes
+  else:
+    volumes = [chr(x) + ":" for x in range(65, 91) if os.path.exists(chr(x) + ":")]
   print("Available volumes:")
   for i in range(len(volumes)):
     print(f"{i + 1}/", volumes[i])
@@ -27,9 +38,9 @@ if __name__ == "__main__":
   
   volume_name = volumes[choice - 1]
   if FAT32.check_fat32(volume_name):
-    vol = FAT32(volume_name)
+    vol = FAT32(volume_name, use_cache=not args.no_cache)
   elif NTFS.check_ntfs(volume_name):
-    vol = NTFS(volume_name)
+    vol = NTFS(volume_name, workers=1 if args.serial else None, use_cache=not args.no_cache, lazy=args.lazy)
   else:
     print("[ERROR] Unsupported volume type")
     exit()
@@ -0,0 +1,57 @@
+import contextlib
+import io
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ImageGen
+from FAT32 import FAT32
+from NTFS import NTFS
+from Shell import Shell
+
+@pytest.fixture(scope="session")
+def tree():
+  return ImageGen.build_tree(files=300, depth=2, fanout=3, max_size=20000, long_names=0.5, deleted=0.1, seed=7)
+
+@pytest.fixture(scope="session", params=["fat32", "ntfs"])
+def image(request, tree, tmp_path_factory):
+  path = str(tmp_path_factory.mktemp(request.param) / f"{request.param}.img")
+  if request.param == "fat32":
+    ImageGen.make_fat32(path, tree, frag=0.3, seed=7)
+  else:
+    ImageGen.make_ntfs(path, tree, frag=0.3, mft_fragments=3, seed=7)
+  return request.param, path
+
+@pytest.fixture
+def volume(image):
+  fs, path = image
+  vol = FAT32(path, use_cache=False) if fs == "fat32" else NTFS(path, use_cache=False)
+  yield vol
+  del vol
+
+def tree_paths(tree, deleted: bool = False) -> dict:
+  '''
+  Path below the volume root -> node for the generated tree, live or deleted nodes
+  '''
+  paths = {}
+  stack = [("", tree)]
+  while stack:
+    prefix, node = stack.pop()
+    for child in node.children:
+      path = prefix + "\\" + child.name
+      if child.deleted == deleted:
+        paths[path] = child
+      if child.is_dir and not child.deleted:
+        stack.append((path, child))
+  return paths
+
+def run(vol, line: str) -> str:
+  # Shell output, xxd writes bytes to sys.stdout.buffer
+  buffer = io.BytesIO()
+  out = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+  with contextlib.redirect_stdout(out):
+    Shell(vol).onecmd(line)
+    out.flush()
+  return buffer.getvalue().decode("utf-8")
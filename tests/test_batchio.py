@@ -0,0 +1,30 @@
+import random
+import ImageGen
+from BatchIO import BatchRead
+from conftest import tree_paths
+
+def test_batch_read_returns_every_request(volume, tree):
+  files = [(path, node) for path, node in tree_paths(tree).items() if not node.is_dir]
+  # Shuffled so that the offset sort has seeks to save
+  random.Random(3).shuffle(files)
+  batch = BatchRead(volume.dev, max_gap=16 << 10)
+  expected = {}
+  on_device = 0
+  for path, node in files:
+    f = volume.open(volume.name + path)
+    data = ImageGen.file_content(node)
+    batch.add(path, f)
+    expected[path] = data
+    # A range of the same file, cut across cluster boundaries
+    if node.size > 5000:
+      batch.add((path, 4000), f, 4000, 1000)
+      expected[(path, 4000)] = data[4000:5000]
+    if f.dev is not None:
+      on_device += len(data) + (1000 if node.size > 5000 else 0)
+  assert dict(batch.run()) == expected
+  stats = batch.stats()
+  assert stats["Requests"] == len(expected)
+  # One seek at most per read, gaps are read through instead of seeking over them
+  assert 0 < stats["Seeks"] <= stats["Reads"]
+  assert stats["Seeks Saved"] > 0
+  assert stats["Bytes"] >= on_device
@@ -0,0 +1,30 @@
+import os
+import pytest
+from BlockDevice import BlockDevice
+
+@pytest.mark.skipif(not hasattr(os, "pread"), reason="reads go through seek and read")
+def test_unmapped_reads_are_aligned(image, monkeypatch):
+  # Raw Windows volumes cannot be mapped and only accept sector aligned reads
+  _, path = image
+  mapped = BlockDevice(path)
+  dev = BlockDevice(path)
+  dev.view.release()
+  dev.map.close()
+  dev.view = dev.map = None
+  pread = os.pread
+  def aligned_pread(fd, size, offset):
+    assert offset % 512 == 0 and size % 512 == 0
+    return pread(fd, size, offset)
+  monkeypatch.setattr(os, "pread", aligned_pread)
+  monkeypatch.delattr(os, "preadv", raising=False)
+  for offset, size in [(0x52, 8), (3, 8), (511, 2), (4095, 4097), (mapped.size - 5, 5), (mapped.size - 5, 100)]:
+    assert dev.read(offset, size) == bytes(mapped.read(offset, size))
+    assert dev.pread(offset, size) == bytes(mapped.read(offset, size))
+    buf = bytearray(size)
+    n = dev.readinto(offset, buf)
+    assert buf[:n] == mapped.read(offset, size)
+  buffers = [bytearray(3), bytearray(700)]
+  assert dev.preadv(buffers, 1000) == 703
+  assert bytes(buffers[0] + buffers[1]) == bytes(mapped.read(1000, 703))
+  dev.close()
+  mapped.close()
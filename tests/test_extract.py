@@ -0,0 +1,57 @@
+import os
+import ImageGen
+from Extract import Extractor
+from conftest import tree_paths
+
+def host_files(root: str) -> dict:
+  found = {}
+  for dirpath, _, files in os.walk(root):
+    for name in files:
+      path = os.path.join(dirpath, name)
+      with open(path, 'rb') as f:
+        found[os.path.relpath(path, root)] = f.read()
+  return found
+
+def expected_files(tree, top: str) -> dict:
+  # Host relative path -> content for the files below top, top itself included by name
+  base = top.rpartition("\\")[0]
+  return {os.path.join(*path[len(base):].strip("\\").split("\\")): ImageGen.file_content(node)
+          for path, node in tree_paths(tree).items() if not node.is_dir and path.startswith(top + "\\")}
+
+def subdirs(tree) -> 'list[str]':
+  return sorted(path for path, node in tree_paths(tree).items() if node.is_dir and path.count("\\") == 2)
+
+def test_host_name_stays_in_directory():
+  assert Extractor.host_name(".") == "_"
+  assert Extractor.host_name("..") == "__"
+  assert Extractor.host_name("name. ") == "name__"
+  assert Extractor.host_name("a/b\\c") == "a_b_c"
+
+def test_extract_subtree(volume, tree, tmp_path):
+  top = subdirs(tree)[0]
+  Extractor(volume).extract(volume.name + top, str(tmp_path), progress=False)
+  assert host_files(str(tmp_path)) == expected_files(tree, top)
+
+def test_extract_parent_entry(volume, tree, tmp_path):
+  # ".." is resolved to the directory it stands for, nothing is written next to dest
+  top = subdirs(tree)[0]
+  parent = top.rpartition("\\")[0]
+  dest = tmp_path / "host" / "out"
+  volume.change_dir(volume.name + top)
+  Extractor(volume).extract("..", str(dest), progress=False)
+  assert os.listdir(tmp_path / "host") == ["out"]
+  assert host_files(str(dest)) == expected_files(tree, parent)
+
+  volume.change_dir(volume.name + parent)
+  dest = tmp_path / "root" / "out"
+  Extractor(volume).extract("..", str(dest), progress=False)
+  assert os.listdir(tmp_path / "root") == ["out"]
+  assert host_files(str(dest)) == {os.path.join(*path.strip("\\").split("\\")): ImageGen.file_content(node)
+                                   for path, node in tree_paths(tree).items() if not node.is_dir}
+
+def test_stat_dot_entries(volume, tree):
+  top = subdirs(tree)[0]
+  volume.change_dir(volume.name + top)
+  assert volume.stat(".").is_dir and volume.stat("..").is_dir
+  assert volume.abspath("..") == volume.name + top.rpartition("\\")[0]
+  assert volume.abspath("..\\..\\..") == volume.name
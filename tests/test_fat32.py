@@ -0,0 +1,60 @@
+import pytest
+from FAT32 import FAT
+from conftest import run
+
+@pytest.fixture
+def fat32(volume, image):
+  if image[0] != "fat32":
+    pytest.skip("FAT32 only")
+  return volume
+
+def naive_usage(vol) -> dict:
+  clusters = min((vol.boot_sector["No. Sectors In Volume"] - vol.boot_sector["Starting Sector of Data"]) // vol.SC,
+                 len(vol.FAT) - 2)
+  free = bad = ends = contiguous = 0
+  for i in range(2, 2 + clusters):
+    value = vol.FAT[i]
+    free += value == 0
+    bad += value == FAT.BAD_CLUSTER
+    ends += value > FAT.BAD_CLUSTER
+    contiguous += value == i + 1
+  return {"Clusters": clusters, "Free Clusters": free, "Used Clusters": clusters - free - bad,
+          "Bad Clusters": bad, "Chains": ends, "Fragments": clusters - free - bad - contiguous}
+
+@pytest.mark.parametrize("chunk", [FAT.SCAN_CHUNK, 1000])
+def test_space_usage_matches_naive_count(fat32, monkeypatch, chunk):
+  # A small chunk also covers the partial chunks of every bucket
+  monkeypatch.setattr(FAT, "SCAN_CHUNK", chunk)
+  usage = fat32.space_usage()
+  assert {key: usage[key] for key in naive_usage(fat32)} == naive_usage(fat32)
+  assert usage["Fragments"] > usage["Chains"]
+  assert usage["FSInfo Matches"]
+
+def test_fragmentation_matches_chain(fat32):
+  fragmented = 0
+  for path, entry, fragments in fat32.fragmentation():
+    chain = fat32.FAT.get_cluster_chain(entry.ref)
+    assert fragments == 1 + sum(b != a + 1 for a, b in zip(chain, chain[1:])), path
+    fragmented += fragments > 1
+  assert fragmented
+  # Only the doubling steps of the run skipping are kept
+  assert all(n & (n - 1) == 0 for n in fat32.FAT.runs)
+
+def test_df_and_frag_output(fat32):
+  usage = naive_usage(fat32)
+  output = run(fat32, "df")
+  for key in ("Used Clusters", "Free Clusters", "Chains", "Fragments"):
+    assert f"{key + ':':<16}{usage[key]:>12}" in output
+  assert "[WARNING]" not in output
+  files = list(fat32.fragmentation())
+  worst = sorted((item for item in files if item[2] > 1), key=lambda item: -item[2])[:5]
+  lines = run(fat32, f"frag -n 5 {fat32.name}").splitlines()
+  assert len(lines) == len(worst) + 2
+  assert [int(line.split()[0]) for line in lines[1:-1]] == [fragments for _, _, fragments in worst]
+  assert lines[-1].startswith(f"{sum(item[2] > 1 for item in files)} of {len(files)} fragmented")
+
+def test_df_and_frag_need_fat32(volume, image):
+  if image[0] != "ntfs":
+    pytest.skip("NTFS only")
+  assert run(volume, "df").startswith("[ERROR]")
+  assert run(volume, "frag").startswith("[ERROR]")
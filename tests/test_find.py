@@ -0,0 +1,18 @@
+import pytest
+from Find import FindFilter
+
+GLOBS = ["F1[0123456789].*", "[!f]*", "F2?[0-4]*", "*[.]txt", "*long name*", "DIR0*"]
+
+def test_literal_skips_bracket_expressions():
+  assert FindFilter(name="F1[0123456789].*").literal() == "f1"
+  assert FindFilter(name="[!x]abc*").literal() == "abc"
+  assert FindFilter(name="F1[]]xyz*").literal() == "xyz"
+  assert FindFilter(name="ab[cd").literal() == "ab[cd"
+
+@pytest.mark.parametrize("glob", GLOBS)
+def test_indexed_find_matches_walk(volume, glob):
+  flt = FindFilter(name=glob)
+  plain = sorted(path for path, _ in volume.find("", flt))
+  indexed = sorted(path for path, _ in volume.find("", flt, use_index=True))
+  assert plain
+  assert indexed == plain
@@ -0,0 +1,74 @@
+import gc
+import hashlib
+import os
+import shutil
+import pytest
+import IndexCache
+from DirEntry import join_path
+from FAT32 import FAT32
+from NTFS import NTFS
+
+def snapshot(vol) -> dict:
+  # Everything a mount mode must not change: the tree, entry metadata and file contents
+  result = {}
+  for dirpath, entries in vol.walk(""):
+    for entry in entries:
+      path = join_path(dirpath, entry.name)
+      digest = None
+      if not entry.is_dir:
+        with vol.open(path) as f:
+          digest = hashlib.sha1(f.read(entry.size)).hexdigest()
+      result[path] = (entry.is_dir, entry.size, entry.ref, entry.modified, digest)
+  return result
+
+def mount(fs: str, path: str, **options):
+  return FAT32(path, **options) if fs == "fat32" else NTFS(path, **options)
+
+@pytest.fixture
+def copy(image, tmp_path):
+  # Cache files are written next to the image, every test gets its own copy
+  fs, path = image
+  target = str(tmp_path / os.path.basename(path))
+  shutil.copy(path, target)
+  return fs, target
+
+@pytest.fixture
+def fresh(copy):
+  vol = mount(*copy, use_cache=False)
+  result = snapshot(vol)
+  del vol
+  return result
+
+def test_cached_mount_matches_fresh(copy, fresh):
+  fs, path = copy
+  options = {"det_budget": 1 << 14} if fs == "fat32" else {}
+  for i in range(3):
+    vol = mount(fs, path, **options)
+    assert snapshot(vol) == fresh
+    if fs == "fat32" and i:
+      assert vol.cached_dirs
+    del vol
+    gc.collect()
+    assert os.path.exists(path + ".shelby-cache")
+
+def test_ntfs_modes_match(copy, fresh, capsys):
+  fs, path = copy
+  if fs != "ntfs":
+    pytest.skip("NTFS only")
+  # The MFT is in several extents, two workers go through the process pool merge
+  for options in ({"lazy": True}, {"workers": 1}, {"workers": 2}):
+    vol = NTFS(path, use_cache=False, **options)
+    assert snapshot(vol) == fresh
+    del vol
+  # No fallback to serial parsing
+  assert "[WARNING]" not in capsys.readouterr().out
+
+def test_no_cache_without_file_stamp(copy, monkeypatch):
+  # Drives and raw devices have no size and mtime to tell a stale cache
+  fs, path = copy
+  monkeypatch.setattr(IndexCache, "file_stamp", lambda dev: [])
+  vol = mount(fs, path)
+  snapshot(vol)
+  del vol
+  gc.collect()
+  assert not os.path.exists(path + ".shelby-cache")
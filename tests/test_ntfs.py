@@ -0,0 +1,72 @@
+import random
+import struct
+from datetime import datetime
+import pytest
+import ImageGen
+from NTFS import NTFS, MFTRecord, NTFSAttribute, RunList, apply_fixup
+
+def test_runlist_decodes_encoded_runs():
+  # Forward and backward jumps, a sparse run and lengths needing several bytes
+  runs = [(100, 3), (5000000, 70000), (40, 1), (None, 16), (1 << 33, 2), (2, 300)]
+  decoded = list(RunList(ImageGen.encode_runs(runs)))
+  vcn = 0
+  for (lcn, length), (got_vcn, got_lcn, got_length) in zip(runs, decoded):
+    assert (got_vcn, got_lcn, got_length) == (vcn, lcn, length)
+    vcn += length
+  assert len(decoded) == len(runs)
+  assert RunList(ImageGen.encode_runs(runs)).total_clusters() == vcn
+
+def test_fixup_restores_sector_ends():
+  original = bytearray(random.Random(1).randbytes(1024))
+  original[0:4] = b"FILE"
+  original[4:8] = (0x30).to_bytes(2, "little") + (3).to_bytes(2, "little")
+  record = bytearray(original)
+  ImageGen.apply_fixup(record, 0x30, usn=7)
+  assert record[510:512] == record[1022:1024] == (7).to_bytes(2, "little")
+  assert apply_fixup(record, 0, 1024)
+  assert record[:0x30] == original[:0x30] and record[0x36:] == original[0x36:]
+
+def test_fixup_detects_torn_writes():
+  record = bytearray(1024)
+  record[4:8] = (0x30).to_bytes(2, "little") + (3).to_bytes(2, "little")
+  ImageGen.apply_fixup(record, 0x30)
+  record[1023] ^= 0xFF
+  assert not apply_fixup(record, 0, 1024)
+
+def test_record_prefers_long_name():
+  # Windows often stores the DOS 8.3 alias before the long name
+  t = datetime(2020, 1, 2)
+  si = struct.pack("<qqqqIIIIIIqq", *[ImageGen.ntfs_time(t)] * 4, 0x20, 0, 0, 0, 0, 0, 0, 0)
+  dos = bytearray(ImageGen.file_name_body(5, "LONGFI~1.TXT", t, 3, 0x20))
+  dos[65] = 2
+  body = (ImageGen.resident_attr(0x10, si) + ImageGen.resident_attr(0x30, bytes(dos), attr_id=1)
+          + ImageGen.resident_attr(0x30, ImageGen.file_name_body(5, "long file name.txt", t, 3, 0x20), attr_id=2)
+          + ImageGen.resident_attr(0x80, b"abc", attr_id=3))
+  rec = bytearray(1024)
+  struct.pack_into("<4sHHqHHHHII", rec, 0, b"FILE", 0x30, 3, 0, 1, 1, 0x38, 1, 0x38 + len(body) + 8, 1024)
+  struct.pack_into("<I", rec, 0x2C, 40)
+  rec[0x38:0x38 + len(body)] = body
+  struct.pack_into("<I", rec, 0x38 + len(body), 0xFFFFFFFF)
+  record = MFTRecord(rec)
+  assert record.file_name["long_name"] == "long file name.txt"
+  assert record.file_name["parent_id"] == 5
+  assert record.data["content"] == b"abc"
+
+def test_lazy_load_keeps_listed_name(image):
+  fs, path = image
+  if fs != "ntfs":
+    pytest.skip("NTFS only")
+  vol = NTFS(path, use_cache=False, lazy=True)
+  table = vol.dir_tree.table
+  file_id = next(i for i in table.get_children(5) if not table.flags[i] & NTFSAttribute.DIRECTORY.value)
+  name = table.get_name(file_id)
+  assert table.find_child(5, name) == file_id
+  # A record naming another hard link or the 8.3 alias must not rename the listed entry
+  table.add((file_id, 5, 0x20, 1, 0, 0, 0, True, "ALIAS~1.TXT", b""))
+  assert table.get_name(file_id) == name
+  assert table.find_child(5, name) == file_id
+  # A record loaded before its directory was listed shows up under its parent's index
+  table.add((len(table) + 1, 5, 0x20, 1, 0, 0, 0, True, "late.txt", b""))
+  table.listed[5].append(len(table) + 1)
+  assert table.find_child(5, "late.txt") == len(table) + 1
+  del vol
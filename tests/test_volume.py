@@ -0,0 +1,167 @@
+import hashlib
+import os
+import shutil
+import ImageGen
+from Find import FindFilter
+from Hash import Hasher
+from Shell import Shell
+from conftest import run, tree_paths
+
+def hexdump(data: bytes, offset: int = 0) -> str:
+  # The line format xxd had before it was vectorized
+  lines = []
+  for i in range(0, len(data), 16):
+    line = data[i:i + 16]
+    hex_str = line[:8].hex(' ').upper() + " "
+    if len(line) > 8:
+      hex_str += " " + line[8:].hex(' ').upper() + " "
+    text = "".join(chr(c) if 31 < c < 127 else "." for c in line)
+    lines.append(f"{offset + i:08X}: {hex_str:<49} {text}\n")
+  return "".join(lines)
+
+def test_walk_matches_tree(volume, tree):
+  expected = {path: (node.is_dir, 0 if node.is_dir else node.size) for path, node in tree_paths(tree).items()}
+  found = {}
+  for dirpath, entries in volume.walk(""):
+    for entry in entries:
+      found[dirpath[len(volume.name):].rstrip("\\") + "\\" + entry.name] = (entry.is_dir, 0 if entry.is_dir else entry.size)
+  assert found == expected
+
+def test_ls_lists_every_directory(volume, tree):
+  for path, node in tree_paths(tree).items():
+    if node.is_dir:
+      names = sorted(child.name for child in node.children if not child.deleted)
+      assert sorted(f["Name"] for f in volume.get_dir(volume.name + path) if f["Name"] not in (".", "..")) == names
+  output = run(volume, "ls")
+  for child in tree.children:
+    assert (child.name in output) != child.deleted
+
+def test_file_contents(volume, tree):
+  for path, node in tree_paths(tree).items():
+    if not node.is_dir:
+      with volume.open(volume.name + path) as f:
+        assert f.read(node.size + 1) == ImageGen.file_content(node)
+
+def test_cat_prints_text_files(volume, tree):
+  checked = 0
+  for path, node in tree_paths(tree).items():
+    if node.is_dir or node.seed % 5 == 4:
+      continue
+    try:
+      # Sizes may cut the last character in half, cat refuses those
+      text = ImageGen.file_content(node).decode("utf-8")
+    except UnicodeDecodeError:
+      continue
+    assert run(volume, "cat " + volume.name + path) == text + "\n"
+    checked += 1
+  assert checked
+
+def test_xxd_output_is_unchanged(volume, tree):
+  files = [(path, node) for path, node in tree_paths(tree).items() if not node.is_dir and node.size > 100]
+  for path, node in files[:20]:
+    data = ImageGen.file_content(node)
+    assert run(volume, "xxd " + volume.name + path) == hexdump(data)
+    assert run(volume, f"xxd -s 37 -l 50 {volume.name + path}") == hexdump(data[37:87], 37)
+    assert run(volume, f"xxd -s -20 {volume.name + path}") == hexdump(data[-20:], len(data) - 20)
+
+def test_find_by_name_and_size(volume, tree):
+  expected = sorted(path for path, node in tree_paths(tree).items()
+                    if not node.is_dir and node.name.lower().endswith(".log") and node.size >= 10000)
+  flt = FindFilter(name="*.log", min_size=10000, kind="f")
+  assert sorted(path[len(volume.name):] for path, _ in volume.find("", flt)) == expected
+
+def test_deleted_lists_deleted_files(volume, tree, image):
+  expected = {(path, node.size) for path, node in tree_paths(tree, deleted=True).items()}
+  found = set()
+  for entry in volume.deleted(""):
+    path = entry.path[len(volume.name):]
+    if image[0] == "fat32":
+      # Deleting overwrites the first character of the short name
+      dirname, _, name = path.rpartition("\\")
+      match = [p for p, _ in expected if p.rpartition("\\")[0] == dirname and p.rpartition("\\")[2][1:] == name[1:]]
+      path = match[0] if len(match) == 1 else path
+    found.add((path, entry.size))
+  assert found == expected
+
+def test_hash_matches_hashlib(volume, tree):
+  files = {path: node for path, node in tree_paths(tree).items() if not node.is_dir}
+  hasher = Hasher(volume, workers=2)
+  seen = set()
+  for path, entry, digests in hasher.hash(""):
+    data = ImageGen.file_content(files[path[len(volume.name):]])
+    assert digests == {name: hashlib.new(name, data).hexdigest() for name in ("md5", "sha1", "sha256")}
+    seen.add(path[len(volume.name):])
+  assert seen == set(files)
+
+def tree_lines(output: str) -> 'list[tuple[int, str]]':
+  # (depth, name) of every line below the top directory
+  result = []
+  for line in output.splitlines()[1:]:
+    marker = max(line.find("├── "), line.find("└── "))
+    result.append((marker // 4, line[marker + 4:]))
+  return sorted(result)
+
+def expected_tree(node, max_depth: int = None, depth: int = 0) -> 'list[tuple[int, str]]':
+  result = []
+  for child in node.children:
+    if not child.deleted:
+      result.append((depth, child.name))
+      if child.is_dir and (max_depth is None or depth + 1 < max_depth):
+        result += expected_tree(child, max_depth, depth + 1)
+  return sorted(result)
+
+def test_tree_depth_limit(volume, tree):
+  assert tree_lines(run(volume, "tree")) == expected_tree(tree)
+  assert tree_lines(run(volume, "tree -L 1")) == expected_tree(tree, 1)
+  top = next(child for child in tree.children if child.is_dir and not child.deleted)
+  # The depth option goes before or after a path that may contain spaces
+  for line in (f"tree -L 1 {top.name}", f"tree {top.name} -L 1", f'tree "{top.name}" -L 1'):
+    output = run(volume, line)
+    assert output.splitlines()[0].endswith(top.name)
+    assert tree_lines(output) == expected_tree(top, 1)
+  assert tree_lines(run(volume, f"tree {top.name}")) == expected_tree(top)
+  assert run(volume, "tree -L 0") == "[ERROR] tree -L needs a positive depth\n"
+  assert run(volume, "tree -L").startswith("[ERROR]")
+
+def text_files(tree) -> 'list[tuple[str, list[str]]]':
+  # (path, lines) of the files that decode cleanly, the last line may lack its newline
+  files = []
+  for path, node in tree_paths(tree).items():
+    if node.is_dir or node.seed % 5 == 4 or node.size < 200:
+      continue
+    try:
+      lines = ImageGen.file_content(node).decode("utf-8").split("\n")
+    except UnicodeDecodeError:
+      continue
+    files.append((path, lines[:-1] if lines[-1] == "" else lines))
+  return files[:20]
+
+def test_head_and_tail(volume, tree, monkeypatch):
+  # Small reads put line breaks and multi-byte characters across chunk boundaries
+  monkeypatch.setattr(Shell, "chunk_size", 61)
+  files = text_files(tree)
+  assert files
+  for path, lines in files:
+    path = volume.name + path
+    assert run(volume, "head " + path) == "".join(line + "\n" for line in lines[:10])
+    assert run(volume, "tail " + path) == "".join(line + "\n" for line in lines[-10:])
+    assert run(volume, f"head -n 3 {path}") == "".join(line + "\n" for line in lines[:3])
+    assert run(volume, f"tail {path} -n 4") == "".join(line + "\n" for line in lines[-4:])
+    assert run(volume, f"tail -n 0 {path}") == ""
+  assert run(volume, "head -n x " + volume.name + files[0][0]) == "[ERROR] head -n needs a count\n"
+
+def test_less_pages(volume, tree, monkeypatch):
+  monkeypatch.setattr(shutil, "get_terminal_size", lambda: os.terminal_size((80, 6)))
+  path, lines = next((path, lines) for path, lines in text_files(tree) if len(lines) > 12)
+  path = volume.name + path
+  answers = iter(["", "q"])
+  monkeypatch.setattr("builtins.input", lambda prompt: next(answers))
+  # Five lines a page, quit at the second prompt
+  assert run(volume, "less " + path) == "".join(line + "\n" for line in lines[:10])
+  monkeypatch.setattr("builtins.input", lambda prompt: "")
+  assert run(volume, "less " + path) == "".join(line + "\n" for line in lines)
+
+  def closed(prompt):
+    raise EOFError
+  monkeypatch.setattr("builtins.input", closed)
+  assert run(volume, "less " + path) == "".join(line + "\n" for line in lines[:5]) + "\n"